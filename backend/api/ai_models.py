@@ -1,114 +1,361 @@
 import os
 import json
 import logging
-import requests
+import threading
+import contextvars
 from abc import ABC, abstractmethod
 from dotenv import load_dotenv
-import openai
+from .llm_clients import get_client_registry
+from .log_handlers import verbose_payloads, LLM_LOG, PAYLOAD_LOG
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class StreamInterrupted(Exception):
+    """
+    Raised by `AIModel.stream_response` / `astream_response` when the provider
+    call fails after part of the completion was already yielded.
+    """
+
 class AIModel(ABC):
     @abstractmethod
     def generate_response(self, content):
         pass
 
-class GroqModel(AIModel):
-    def __init__(self):
-        self.api_key = os.getenv('GROQ_API_KEY')
-        self.url = "https://api.groq.com/openai/v1/chat/completions"
-        self.model = "mixtral-8x7b-32768"
+    @abstractmethod
+    def stream_response(self, content):
+        """
+        Yields the completion text incrementally, one provider delta at a time.
+        Yields nothing if the provider call fails, and raises `StreamInterrupted`
+        if it fails after some text was yielded, so callers never mistake a
+        truncated answer for a complete one.
+        """
+        pass
 
-    def generate_response(self, content):
-        headers = {
+    @abstractmethod
+    async def agenerate_response(self, content):
+        """
+        Async counterpart of `generate_response`, awaiting the provider without
+        holding a worker thread.
+        """
+        pass
+
+    @abstractmethod
+    def astream_response(self, content):
+        """
+        Async counterpart of `stream_response`; an async generator of text deltas.
+        """
+        pass
+
+    def served_provider(self):
+        """
+        The provider that served the last completion of the current thread or
+        task, for models that route between providers; None otherwise.
+        """
+        return None
+
+def provider_label(ai_model, model_name):
+    """
+    Returns a callable naming the provider that served `ai_model`'s completion,
+    for span labels resolved when the span ends.
+    """
+    return lambda: ai_model.served_provider() or model_name
+
+# Token usage of the most recent non-streaming completion in the current
+# thread or task, used to report provider-side prompt prefix caching.
+_last_usage = contextvars.ContextVar('llm_last_usage', default=None)
+
+def normalize_usage(usage):
+    """
+    Converts a provider `usage` block (JSON dict or OpenAI SDK object) into
+    {'prompt_tokens', 'completion_tokens', 'cached_tokens'}.
+    """
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, 'model_dump') else dict(usage)
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0,
+        'cached_tokens': details.get('cached_tokens') or 0,
+    }
+
+def get_last_usage():
+    return _last_usage.get()
+
+def set_last_usage(usage):
+    _last_usage.set(usage)
+
+def parse_sse_chunk(line):
+    """
+    Extracts the text delta from one `data:` line of an OpenAI-compatible
+    chat-completions stream. Returns None for keep-alives and the [DONE] marker.
+    """
+    if not line or not line.startswith('data:'):
+        return None
+    payload = line[len('data:'):].strip()
+    if payload == '[DONE]':
+        return None
+    chunk = json.loads(payload)
+    choices = chunk.get('choices') or []
+    if not choices:
+        return None
+    return choices[0].get('delta', {}).get('content')
+
+class ChatCompletionsHTTPModel(AIModel):
+    """
+    Base for providers reached through a plain HTTP OpenAI-compatible
+    chat-completions endpoint (Groq, OpenAI GPT-4).
+    """
+    provider_name = None
+
+    @property
+    def url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def _headers(self):
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+
+    def _payload(self, content, stream=False):
         data = {
             "model": self.model,
             "messages": [{"role": "user", "content": content}],
             "temperature": 0.7,
             "max_tokens": 150
         }
+        if stream:
+            data["stream"] = True
+        return data
+
+    def generate_response(self, content):
+        data = self._payload(content)
+        set_last_usage(None)
         try:
-            logger.info(f"Sending request to Groq API: {json.dumps(data)[:500]}...")
-            response = requests.post(self.url, headers=headers, json=data)
-            logger.info(f"Groq API response status: {response.status_code}")
-            
+            if verbose_payloads():
+                logger.info("Sending request to %s API: %.500s", self.provider_name, json.dumps(data), extra=PAYLOAD_LOG)
+            registry = get_client_registry()
+            session = registry.session(self.provider_name, self.base_url)
+            response = session.post(self.url, headers=self._headers(), json=data, timeout=registry.requests_timeout)
+            logger.info("%s API response status: %s", self.provider_name, response.status_code, extra=LLM_LOG)
+
             if response.status_code == 200:
-                logger.info(f"Groq API response: {response.text[:500]}...")
-                return response.json()
+                if verbose_payloads():
+                    logger.info("%s API response: %.500s", self.provider_name, response.text, extra=PAYLOAD_LOG)
+                body = response.json()
+                set_last_usage(normalize_usage(body.get('usage')))
+                return body['choices'][0]['message']['content']
             else:
-                logger.error(f"Failed to call Groq API: {response.status_code} - {response.text}")
+                logger.error("Failed to call %s API: %s - %s", self.provider_name, response.status_code, response.text)
                 return None
         except Exception as e:
-            logger.exception(f"Error in Groq API call: {str(e)}")
+            logger.exception("Error in %s API call: %s", self.provider_name, e)
             return None
 
-class GPT4Model(AIModel):
-    def __init__(self):
-        self.api_key = os.getenv('OPENAI_API_KEY')
-        self.url = "https://api.openai.com/v1/chat/completions"
-        self.model = "gpt-4"
+    def stream_response(self, content):
+        data = self._payload(content, stream=True)
+        yielded = False
+        try:
+            if verbose_payloads():
+                logger.info("Streaming request to %s API: %.500s", self.provider_name, json.dumps(data), extra=PAYLOAD_LOG)
+            registry = get_client_registry()
+            session = registry.session(self.provider_name, self.base_url)
+            with session.post(self.url, headers=self._headers(), json=data, stream=True, timeout=registry.requests_timeout) as response:
+                if response.status_code != 200:
+                    logger.error("Failed to stream from %s API: %s - %s", self.provider_name, response.status_code, response.text)
+                    return
+                for line in response.iter_lines(decode_unicode=True):
+                    delta = parse_sse_chunk(line)
+                    if delta:
+                        yield delta
+                        yielded = True
+        except Exception as e:
+            logger.exception("Error in %s streaming API call: %s", self.provider_name, e)
+            if yielded:
+                raise StreamInterrupted(str(e)) from e
 
-    def generate_response(self, content):
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": content}],
-            "temperature": 0.7,
-            "max_tokens": 150
-        }
+    async def agenerate_response(self, content):
+        data = self._payload(content)
+        set_last_usage(None)
         try:
-            logger.info(f"Sending request to OpenAI API: {json.dumps(data)[:500]}...")
-            response = requests.post(self.url, headers=headers, json=data)
-            logger.info(f"OpenAI API response status: {response.status_code}")
-            
+            if verbose_payloads():
+                logger.info("Sending async request to %s API: %.500s", self.provider_name, json.dumps(data), extra=PAYLOAD_LOG)
+            client = get_client_registry().async_client(self.provider_name, self.base_url)
+            response = await client.post(self.url, headers=self._headers(), json=data)
+            logger.info("%s API response status: %s", self.provider_name, response.status_code, extra=LLM_LOG)
+
             if response.status_code == 200:
-                logger.info(f"OpenAI API response: {response.text[:500]}...")
-                return response.json()
+                if verbose_payloads():
+                    logger.info("%s API response: %.500s", self.provider_name, response.text, extra=PAYLOAD_LOG)
+                body = response.json()
+                set_last_usage(normalize_usage(body.get('usage')))
+                return body['choices'][0]['message']['content']
             else:
-                logger.error(f"Failed to call OpenAI API: {response.status_code} - {response.text}")
+                logger.error("Failed to call %s API: %s - %s", self.provider_name, response.status_code, response.text)
                 return None
         except Exception as e:
-            logger.exception(f"Error in OpenAI API call: {str(e)}")
+            logger.exception("Error in %s async API call: %s", self.provider_name, e)
             return None
 
+    async def astream_response(self, content):
+        data = self._payload(content, stream=True)
+        yielded = False
+        try:
+            if verbose_payloads():
+                logger.info("Streaming async request to %s API: %.500s", self.provider_name, json.dumps(data), extra=PAYLOAD_LOG)
+            client = get_client_registry().async_client(self.provider_name, self.base_url)
+            async with client.stream('POST', self.url, headers=self._headers(), json=data) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    logger.error("Failed to stream from %s API: %s - %.500s", self.provider_name, response.status_code, body)
+                    return
+                async for line in response.aiter_lines():
+                    delta = parse_sse_chunk(line)
+                    if delta:
+                        yield delta
+                        yielded = True
+        except Exception as e:
+            logger.exception("Error in %s async streaming API call: %s", self.provider_name, e)
+            if yielded:
+                raise StreamInterrupted(str(e)) from e
+
+class GroqModel(ChatCompletionsHTTPModel):
+    provider_name = "Groq"
+
+    def __init__(self):
+        self.api_key = os.getenv('GROQ_API_KEY')
+        self.base_url = os.getenv('GROQ_BASE_URL', "https://api.groq.com/openai/v1")
+        self.model = "mixtral-8x7b-32768"
+
+class GPT4Model(ChatCompletionsHTTPModel):
+    provider_name = "OpenAI"
+
+    def __init__(self):
+        self.api_key = os.getenv('OPENAI_API_KEY')
+        self.base_url = os.getenv('OPENAI_BASE_URL', "https://api.openai.com/v1")
+        self.model = "gpt-4"
+
 class GPT4oMiniModel(AIModel):
+    provider_name = "LiteLLM"
+
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.base_url = os.getenv('LITE_BASE_URL')
         self.model = "4o-mini"
 
     def generate_response(self, content):
+        set_last_usage(None)
         try:
-            client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
-            logger.info(f"Sending request to GPT 4o-mini API: {content[:500]}...")
+            client = get_client_registry().openai_client(self.provider_name, self.api_key, self.base_url)
+            if verbose_payloads():
+                logger.info("Sending request to GPT 4o-mini API: %.500s", content, extra=PAYLOAD_LOG)
             response = client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": content}]
             )
-            logger.info(f"GPT 4o-mini API response received: {response}")
-            logger.info(f"Response content: {response.choices[0].message.content}")
+            logger.info("GPT 4o-mini API response received", extra=LLM_LOG)
+            if verbose_payloads():
+                logger.info("GPT 4o-mini API response: %s", response, extra=PAYLOAD_LOG)
+            set_last_usage(normalize_usage(response.usage))
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.exception("Error in GPT 4o-mini API call: %s", e)
+            return None
+
+    def stream_response(self, content):
+        yielded = False
+        try:
+            client = get_client_registry().openai_client(self.provider_name, self.api_key, self.base_url)
+            if verbose_payloads():
+                logger.info("Streaming request to GPT 4o-mini API: %.500s", content, extra=PAYLOAD_LOG)
+            stream = client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": content}],
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                    yielded = True
+        except Exception as e:
+            logger.exception("Error in GPT 4o-mini streaming API call: %s", e)
+            if yielded:
+                raise StreamInterrupted(str(e)) from e
+
+    async def agenerate_response(self, content):
+        set_last_usage(None)
+        try:
+            client = get_client_registry().async_openai_client(self.provider_name, self.api_key, self.base_url)
+            if verbose_payloads():
+                logger.info("Sending async request to GPT 4o-mini API: %.500s", content, extra=PAYLOAD_LOG)
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": content}]
+            )
+            logger.info("GPT 4o-mini API response received", extra=LLM_LOG)
+            if verbose_payloads():
+                logger.info("GPT 4o-mini API response: %s", response, extra=PAYLOAD_LOG)
+            set_last_usage(normalize_usage(response.usage))
             return response.choices[0].message.content
         except Exception as e:
-            logger.exception(f"Error in GPT 4o-mini API call: {str(e)}")
+            logger.exception("Error in GPT 4o-mini async API call: %s", e)
             return None
 
+    async def astream_response(self, content):
+        yielded = False
+        try:
+            client = get_client_registry().async_openai_client(self.provider_name, self.api_key, self.base_url)
+            if verbose_payloads():
+                logger.info("Streaming async request to GPT 4o-mini API: %.500s", content, extra=PAYLOAD_LOG)
+            stream = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": content}],
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                    yielded = True
+        except Exception as e:
+            logger.exception("Error in GPT 4o-mini async streaming API call: %s", e)
+            if yielded:
+                raise StreamInterrupted(str(e)) from e
+
 class AIModelFactory:
+    """
+    Returns one shared model instance per model name. Models hold no per-request
+    state, and their HTTP clients come from the pooled provider client registry.
+    """
+    _instances = {}
+    # Reentrant: creating the 'auto' model gets its provider models from the factory
+    _lock = threading.RLock()
+
     @staticmethod
     def get_model(model_name):
-        if model_name.lower() == 'groq':
+        key = model_name.lower()
+        model = AIModelFactory._instances.get(key)
+        if model is None:
+            with AIModelFactory._lock:
+                model = AIModelFactory._instances.get(key)
+                if model is None:
+                    model = AIModelFactory._create_model(key)
+                    AIModelFactory._instances[key] = model
+        return model
+
+    @staticmethod
+    def _create_model(model_name):
+        if model_name == 'groq':
             return GroqModel()
-        elif model_name.lower() == 'gpt4':
+        elif model_name == 'gpt4':
             return GPT4Model()
-        elif model_name.lower() == '4o-mini':
+        elif model_name == '4o-mini':
             return GPT4oMiniModel()
+        elif model_name == 'auto':
+            from .routing import RoutedModel
+            return RoutedModel.from_settings()
         else:
             raise ValueError(f"Unsupported model: {model_name}")
\ No newline at end of file
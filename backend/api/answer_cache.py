@@ -0,0 +1,260 @@
+import re
+import json
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from .prompt_builder import format_history
+from .retrieval_cache import get_retrieval_cache
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'of', 'to', 'in', 'on', 'for',
+    'and', 'or', 'me', 'us', 'you', 'your', 'please', 'can', 'could', 'would', 'tell',
+    'about', 'what', 'who', 'how', 'do', 'does', 'did', 'i', 'it', 'its', 'this', 'that',
+}
+
+def normalize_query(text):
+    """
+    Lower-cases the query, strips punctuation and collapses whitespace.
+    """
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+def query_terms(normalized_query):
+    """
+    Returns the set of content-bearing words of a normalized query.
+    """
+    return frozenset(word for word in normalized_query.split() if word not in STOPWORDS)
+
+def similarity(terms_a, terms_b):
+    """
+    Jaccard similarity of two term sets; 0.0 when either is empty.
+    """
+    if not terms_a or not terms_b:
+        return 0.0
+    return len(terms_a & terms_b) / len(terms_a | terms_b)
+
+def context_digest(context):
+    """
+    Digest of the conversation history an answer was generated with, either a
+    string or a list of {role, content} messages; '' for none.
+    """
+    context = format_history(context)
+    return hashlib.sha1(context.encode('utf-8')).hexdigest() if context else ''
+
+class AnswerCache:
+    """
+    In-process cache of LLM answers keyed by (normalized query, retrieved
+    UniversalContent ids, model name, conversation history digest). Answers
+    depend on the history rendered into the prompt, so follow-up questions are
+    only shared between conversations with the same history.
+
+    A lookup first tries the exact key, then any cached query retrieved from the
+    same content by the same model whose term similarity reaches the threshold,
+    so near-duplicate phrasings share one answer. Entries expire after a TTL, the
+    least recently used entry is evicted at capacity, and entries are dropped as
+    soon as one of their contributing content rows changes.
+
+    With `l2_enabled`, answers are also written through to the shared Django
+    cache (Redis when REDIS_URL is set), so that answers computed by another
+    worker process, or by the warm_caches command, are found on an exact-key L1
+    miss. Both levels are tied to the global content version of the retrieval
+    cache: L2 keys embed it and L1 entries record it, so a content change made
+    in any process makes every older answer unreachable at once.
+    """
+    def __init__(self, max_entries=1000, ttl=600, similarity_threshold=0.85, l2_enabled=True, cache_alias='default'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.l2_enabled = l2_enabled
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._by_content = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            ttl=settings.ANSWER_CACHE_TTL,
+            similarity_threshold=settings.ANSWER_CACHE_SIMILARITY,
+            l2_enabled=settings.ANSWER_CACHE_L2_ENABLED,
+        )
+
+    @property
+    def l2(self):
+        return caches[self.cache_alias]
+
+    def l2_key(self, normalized, bucket, version):
+        raw = json.dumps([normalized, sorted(bucket[0]), bucket[1], bucket[2]])
+        return f"answer:{version}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, query, content_ids, model_name, context=''):
+        """
+        Returns the cached answer for the query, or None.
+        """
+        normalized = normalize_query(query)
+        bucket = (frozenset(content_ids), model_name, context_digest(context))
+        version = get_retrieval_cache().version()
+        answer = self._l1_get(normalized, bucket, version)
+        if answer is not None or not self.l2_enabled:
+            return answer
+        answer = self.l2.get(self.l2_key(normalized, bucket, version))
+        return self._l2_result(normalized, bucket, version, answer)
+
+    async def aget(self, query, content_ids, model_name, context=''):
+        """
+        Async counterpart of `get`.
+        """
+        normalized = normalize_query(query)
+        bucket = (frozenset(content_ids), model_name, context_digest(context))
+        version = await get_retrieval_cache().aversion()
+        answer = self._l1_get(normalized, bucket, version)
+        if answer is not None or not self.l2_enabled:
+            return answer
+        answer = await self.l2.aget(self.l2_key(normalized, bucket, version))
+        return self._l2_result(normalized, bucket, version, answer)
+
+    def set(self, query, content_ids, model_name, answer, context=''):
+        """
+        Stores an answer for the query and the content it was generated from.
+        """
+        normalized = normalize_query(query)
+        bucket = (frozenset(content_ids), model_name, context_digest(context))
+        version = get_retrieval_cache().version()
+        self._l1_set(normalized, bucket, version, answer)
+        if self.l2_enabled:
+            self.l2.set(self.l2_key(normalized, bucket, version), answer, timeout=self.ttl)
+
+    async def aset(self, query, content_ids, model_name, answer, context=''):
+        """
+        Async counterpart of `set`.
+        """
+        normalized = normalize_query(query)
+        bucket = (frozenset(content_ids), model_name, context_digest(context))
+        version = await get_retrieval_cache().aversion()
+        self._l1_set(normalized, bucket, version, answer)
+        if self.l2_enabled:
+            await self.l2.aset(self.l2_key(normalized, bucket, version), answer, timeout=self.ttl)
+
+    def _l1_get(self, normalized, bucket, version):
+        with self._lock:
+            key = self._find(normalized, bucket, version, time.monotonic())
+            if key is None:
+                if not self.l2_enabled:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]['answer']
+
+    def _l2_result(self, normalized, bucket, version, answer):
+        if answer is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.l2_hits += 1
+        self._l1_set(normalized, bucket, version, answer)
+        return answer
+
+    def _l1_set(self, normalized, bucket, version, answer):
+        key = (normalized, bucket)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'answer': answer,
+                'version': version,
+                'terms': query_terms(normalized),
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._buckets.setdefault(bucket, set()).add(key)
+            for content_id in bucket[0]:
+                self._by_content.setdefault(content_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_content(self, content_id):
+        """
+        Drops every entry whose answer was generated from the given content row.
+        """
+        with self._lock:
+            keys = self._by_content.pop(content_id, set())
+            for key in list(keys):
+                self._remove(key)
+        if keys:
+            logger.info("Invalidated %d cached answers for content %s", len(keys), content_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._by_content.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'l2_hits': self.l2_hits, 'misses': self.misses}
+
+    def _find(self, normalized, bucket, version, now):
+        key = (normalized, bucket)
+        if key in self._entries and not self._expired(key, version, now):
+            return key
+
+        terms = query_terms(normalized)
+        best_key, best_score = None, 0.0
+        for candidate in list(self._buckets.get(bucket, ())):
+            if self._expired(candidate, version, now):
+                continue
+            score = similarity(terms, self._entries[candidate]['terms'])
+            if score > best_score:
+                best_key, best_score = candidate, score
+        if best_key is not None and best_score >= self.similarity_threshold:
+            return best_key
+        return None
+
+    def _expired(self, key, version, now):
+        # Entries generated before a content change, possibly in another process, are stale
+        entry = self._entries[key]
+        if entry['expires_at'] > now and entry['version'] == version:
+            return False
+        self._remove(key)
+        return True
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        bucket = key[1]
+        bucket_keys = self._buckets.get(bucket)
+        if bucket_keys is not None:
+            bucket_keys.discard(key)
+            if not bucket_keys:
+                del self._buckets[bucket]
+        for content_id in bucket[0]:
+            content_keys = self._by_content.get(content_id)
+            if content_keys is not None:
+                content_keys.discard(key)
+                if not content_keys:
+                    del self._by_content[content_id]
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """
+    Returns the process-wide `AnswerCache`, creating it on first use.
+    """
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache.from_settings()
+    return _answer_cache
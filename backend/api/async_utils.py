@@ -0,0 +1,18 @@
+from functools import wraps
+from django.http import HttpResponseNotAllowed
+
+
+def async_post_view(view_func):
+    """
+    Equivalent of `@csrf_exempt` + `@require_http_methods(["POST"])` for coroutine
+    views. Django 4.2's decorators wrap views in a sync function, which would make
+    Django run an async view in a thread instead of on the event loop.
+    """
+    @wraps(view_func)
+    async def wrapper_view(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view_func(request, *args, **kwargs)
+
+    wrapper_view.csrf_exempt = True
+    return wrapper_view
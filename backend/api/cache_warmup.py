@@ -0,0 +1,133 @@
+import time
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from .gpt_assistant import GPTAssistant
+
+logger = logging.getLogger(__name__)
+
+CACHED, WARMED, RETRIEVED, FAILED = 'cached', 'warmed', 'retrieved', 'failed'
+
+def load_questions(path):
+    """
+    Reads one question per line, skipping blank lines and '#' comments.
+    """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+def warm_question(question, model_name, retrieval_only=False):
+    """
+    Runs one question through the GPTAssistant pipeline, which stores its
+    retrieval results in the retrieval cache and its answer in the answer cache.
+
+    Returns:
+        str: CACHED if an answer was already cached, WARMED if one was generated,
+        RETRIEVED if only retrieval ran, FAILED otherwise.
+    """
+    try:
+        assistant = GPTAssistant(model_name=model_name)
+        relevant_content = assistant.retrieve_context_items(question)
+        if assistant.get_cached_answer(question, relevant_content) is not None:
+            return CACHED
+        if retrieval_only:
+            return RETRIEVED
+        assistant.generate_response(question)
+        return WARMED if assistant.get_cached_answer(question, relevant_content) is not None else FAILED
+    except Exception as e:
+        logger.error("Error warming caches for %r: %s", question, e, exc_info=True)
+        return FAILED
+    finally:
+        # Worker threads would otherwise each keep a database connection open
+        connection.close()
+
+def warm_caches(questions, model_name=None, concurrency=4, retrieval_only=False):
+    """
+    Replays questions through the pipeline with at most `concurrency` in flight,
+    one after the other in the calling thread when `concurrency` is 1.
+
+    Returns:
+        dict: Per-outcome counts, the answer coverage (the fraction of questions
+        with a cached answer afterwards), the elapsed time and each question's outcome.
+    """
+    model_name = model_name or settings.DEFAULT_CHAT_MODEL
+    retrieval_only = retrieval_only or not settings.ANSWER_CACHE_ENABLED
+    started = time.monotonic()
+    if concurrency <= 1:
+        outcomes = [warm_question(question, model_name, retrieval_only) for question in questions]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='cache-warmup') as executor:
+            outcomes = list(executor.map(lambda question: warm_question(question, model_name, retrieval_only), questions))
+
+    counts = {outcome: outcomes.count(outcome) for outcome in (CACHED, WARMED, RETRIEVED, FAILED)}
+    return {
+        'questions': len(questions),
+        **counts,
+        'coverage': (counts[CACHED] + counts[WARMED]) / len(questions) if questions else 0.0,
+        'seconds': round(time.monotonic() - started, 2),
+        'outcomes': dict(zip(questions, outcomes)),
+    }
+
+def warm_from_settings(concurrency=None):
+    questions = load_questions(settings.CACHE_WARMUP_QUESTIONS)
+    report = warm_caches(questions, concurrency=concurrency or settings.CACHE_WARMUP_CONCURRENCY)
+    logger.info(
+        "Warmed caches for %d questions in %ss: %d generated, %d already cached, %d failed, coverage %.0f%%",
+        report['questions'], report['seconds'], report[WARMED], report[CACHED], report[FAILED], report['coverage'] * 100
+    )
+    return report
+
+_pending_warmup = None
+_running_warmup = None
+_pending_warmup_lock = threading.Lock()
+
+def schedule_warmup(delay=None):
+    """
+    Warms the caches in a background thread after `delay` seconds. Calls within
+    the delay restart it, so a burst of content edits triggers a single warm-up.
+    A warm-up still pending when the process exits runs before it does (see
+    `flush_pending_warmup`).
+    """
+    global _pending_warmup
+    delay = settings.CACHE_WARMUP_DELAY if delay is None else delay
+    with _pending_warmup_lock:
+        if _pending_warmup is not None:
+            _pending_warmup.cancel()
+        _pending_warmup = threading.Timer(delay, _run_scheduled_warmup)
+        _pending_warmup.daemon = True
+        _pending_warmup.start()
+
+@atexit.register
+def flush_pending_warmup():
+    """
+    Runs the pending warm-up now and waits for one in progress. Management
+    commands that edit content exit well within CACHE_WARMUP_DELAY, and the
+    daemon timer thread would otherwise die with them.
+    """
+    global _pending_warmup
+    with _pending_warmup_lock:
+        pending, running = _pending_warmup, _running_warmup
+        _pending_warmup = None
+    if running is not None:
+        running.join()
+    if pending is not None:
+        pending.cancel()
+        # No new threads can be started once the interpreter is shutting down
+        _warm_from_settings(concurrency=1)
+
+def _run_scheduled_warmup():
+    global _pending_warmup, _running_warmup
+    with _pending_warmup_lock:
+        # Superseded by a later call, or already flushed
+        if _pending_warmup is not threading.current_thread():
+            return
+        _pending_warmup, _running_warmup = None, threading.current_thread()
+    _warm_from_settings()
+
+def _warm_from_settings(concurrency=None):
+    try:
+        warm_from_settings(concurrency)
+    except Exception as e:
+        logger.error("Scheduled cache warm-up failed: %s", e, exc_info=True)
@@ -0,0 +1,82 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from .streaming import SENTENCE_BOUNDARY
+from .prompt_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+def sentence_spans(text):
+    """
+    Returns the (start, end) character offsets of the sentences in `text`.
+    """
+    spans, start = [], 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return [(start, end) for start, end in spans if text[start:end].strip()]
+
+def chunk_text(text, max_tokens=120, overlap_tokens=30):
+    """
+    Splits text into passages of whole sentences of at most `max_tokens` tokens,
+    each repeating up to `overlap_tokens` tokens of trailing sentences from the
+    previous passage. A sentence longer than `max_tokens` becomes a passage of
+    its own.
+
+    Returns:
+        list: (start offset, end offset) pairs into `text`, in order.
+    """
+    spans = sentence_spans(text or "")
+    costs = [count_tokens(text[start:end]) for start, end in spans]
+    chunks, first = [], 0
+    while first < len(spans):
+        last, used = first, costs[first]
+        while last + 1 < len(spans) and used + costs[last + 1] <= max_tokens:
+            last += 1
+            used += costs[last]
+        chunks.append((spans[first][0], spans[last][1]))
+        if last + 1 >= len(spans):
+            break
+        # Start the next passage with the trailing sentences that fit the overlap
+        next_first, overlap = last + 1, 0
+        while next_first - 1 > first and overlap + costs[next_first - 1] <= overlap_tokens:
+            next_first -= 1
+            overlap += costs[next_first]
+        first = next_first
+    return chunks
+
+def build_passages(content, max_tokens=None, overlap_tokens=None):
+    """
+    Builds the (unsaved) `ContentPassage` rows for a `UniversalContent` row.
+    """
+    from .models import ContentPassage
+    max_tokens = max_tokens or settings.PASSAGE_MAX_TOKENS
+    overlap_tokens = settings.PASSAGE_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    passages = []
+    for position, (start, end) in enumerate(chunk_text(content.content, max_tokens, overlap_tokens)):
+        text = content.content[start:end]
+        passages.append(ContentPassage(
+            source_id=content.pk,
+            position=position,
+            start_offset=start,
+            end_offset=end,
+            title=content.title,
+            content=text,
+            content_type=content.content_type,
+            token_count=count_tokens(f"{content.title}\n{text}"),
+        ))
+    return passages
+
+def rebuild_passages(content, max_tokens=None, overlap_tokens=None):
+    """
+    Replaces the stored passages of a `UniversalContent` row.
+
+    Returns:
+        list: The saved `ContentPassage` rows.
+    """
+    from .models import ContentPassage
+    passages = build_passages(content, max_tokens, overlap_tokens)
+    with transaction.atomic():
+        ContentPassage.objects.filter(source_id=content.pk).delete()
+        return ContentPassage.objects.bulk_create(passages)
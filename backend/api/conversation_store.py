@@ -0,0 +1,216 @@
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .ai_models import AIModelFactory
+from .metrics import span
+from .prompt_builder import SUMMARY_ROLE
+from .prompt_templates import SUMMARY_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+def summarize_turns(summary, turns):
+    """
+    Folds conversation turns into a rolling summary with the LLM.
+
+    Args:
+        summary (str): The current summary, "" for none yet.
+        turns (list): The (role, text) turns to fold in, oldest first.
+
+    Returns:
+        str: The updated summary, or None if the provider call failed.
+    """
+    prompt = SUMMARY_TEMPLATE.render(
+        summary=summary or "(none yet)",
+        turns="\n".join(f"{role}: {text}" for role, text in turns),
+    )
+    with span('summary'):
+        result = AIModelFactory.get_model(settings.CONVERSATION_SUMMARY_MODEL).generate_response(prompt)
+    return result.strip() if result and result.strip() else None
+
+class Conversation:
+    """
+    The server-side state of one chat session: its most recent turns as
+    (role, text) pairs in a fixed-size ring, a rolling summary of the turns folded
+    out of the ring, and the full text of the last answer for "more info" requests.
+    """
+    __slots__ = ('turns', 'summary', 'summarizing', 'full_response', 'last_seen')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        self.summarizing = False
+        self.full_response = ""
+        self.last_seen = time.monotonic()
+
+class ConversationStore:
+    """
+    Per-process store of conversations keyed by session id.
+
+    Each session keeps at most `max_turns` turns, each cut to `max_turn_chars`, so
+    its memory is bounded however long it runs. Sessions idle for longer than
+    `ttl` seconds expire, and the least recently used session is evicted once
+    `max_sessions` are held. Sessions live in the worker process that served them,
+    so a multi-process deployment needs sticky sessions (or one async worker).
+
+    With a `summarize` function, once a session holds `summary_batch` turns beyond
+    its `recent_turns` most recent ones, the older turns are folded into the
+    session's rolling summary by a background worker, off the request path. The
+    history then consists of the summary plus the turns not folded yet, so its
+    size stays roughly constant however long the session runs. If a fold fails,
+    its turns stay verbatim and the next exchange retries.
+    """
+    def __init__(self, max_turns=12, max_turn_chars=2000, max_sessions=10000, ttl=1800,
+                 recent_turns=6, summary_batch=4, summarize=None, summary_workers=2):
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.recent_turns = recent_turns
+        self.summary_batch = summary_batch
+        self.summarize = summarize
+        self.summary_workers = summary_workers
+        self._executor = None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.summaries = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_turns=settings.CONVERSATION_MAX_TURNS,
+            max_turn_chars=settings.CONVERSATION_MAX_TURN_CHARS,
+            max_sessions=settings.CONVERSATION_MAX_SESSIONS,
+            ttl=settings.CONVERSATION_TTL,
+            recent_turns=settings.CONVERSATION_RECENT_TURNS,
+            summary_batch=settings.CONVERSATION_SUMMARY_BATCH,
+            summarize=summarize_turns if settings.CONVERSATION_SUMMARY_ENABLED else None,
+            summary_workers=settings.CONVERSATION_SUMMARY_WORKERS,
+        )
+
+    def history(self, session_id):
+        """
+        Returns the session's history as {role, content} messages: its summary,
+        if any, as a leading 'summary' message, then its unfolded turns, oldest
+        first. Returns [] for an unknown or expired session.
+        """
+        with self._lock:
+            conversation = self._get(session_id, time.monotonic())
+            if conversation is None:
+                return []
+            messages = [{'role': role, 'content': text} for role, text in conversation.turns]
+            if conversation.summary:
+                messages.insert(0, {'role': SUMMARY_ROLE, 'content': conversation.summary})
+            return messages
+
+    def full_response(self, session_id):
+        """
+        Returns the full text of the session's last answer, or "" if there is none.
+        """
+        with self._lock:
+            conversation = self._get(session_id, time.monotonic())
+            return conversation.full_response if conversation is not None else ""
+
+    def record_exchange(self, session_id, user_input, answer):
+        """
+        Appends a user message and the assistant's answer to the session,
+        creating it if needed, and remembers the answer for "more info". A failed
+        answer ("") only records the user message.
+        """
+        now = time.monotonic()
+        with self._lock:
+            conversation = self._get(session_id, now)
+            if conversation is None:
+                conversation = self._sessions[session_id] = Conversation(self.max_turns)
+                self._evict(now)
+            conversation.turns.append(('user', (user_input or "")[:self.max_turn_chars]))
+            if answer:
+                conversation.turns.append(('assistant', answer[:self.max_turn_chars]))
+            conversation.full_response = answer or ""
+            folded = self._turns_to_fold(conversation)
+        if folded:
+            self._summary_executor().submit(self._fold, session_id, conversation, folded)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'turns': sum(len(conversation.turns) for conversation in self._sessions.values()),
+                'evictions': self.evictions,
+                'summaries': self.summaries,
+            }
+
+    def _turns_to_fold(self, conversation):
+        if self.summarize is None or conversation.summarizing:
+            return None
+        excess = len(conversation.turns) - self.recent_turns
+        if excess < self.summary_batch:
+            return None
+        conversation.summarizing = True
+        return list(conversation.turns)[:excess]
+
+    def _summary_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.summary_workers, thread_name_prefix='conversation-summary')
+            return self._executor
+
+    def _fold(self, session_id, conversation, folded):
+        try:
+            summary = self.summarize(conversation.summary, folded)
+        except Exception as e:
+            logger.exception("Error summarizing conversation %s: %s", session_id, e)
+            summary = None
+
+        with self._lock:
+            conversation.summarizing = False
+            if not summary or self._sessions.get(session_id) is not conversation:
+                return
+            conversation.summary = summary
+            self.summaries += 1
+            # Drop the folded turns still in the ring; newer turns were appended behind them
+            folded_ids = {id(turn) for turn in folded}
+            while conversation.turns and id(conversation.turns[0]) in folded_ids:
+                conversation.turns.popleft()
+
+    def _get(self, session_id, now):
+        conversation = self._sessions.get(session_id)
+        if conversation is None:
+            return None
+        if now - conversation.last_seen > self.ttl:
+            del self._sessions[session_id]
+            self.evictions += 1
+            return None
+        conversation.last_seen = now
+        self._sessions.move_to_end(session_id)
+        return conversation
+
+    def _evict(self, now):
+        # Sessions are kept in last-use order, so expired ones are at the front
+        while self._sessions:
+            session_id, conversation = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - conversation.last_seen <= self.ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+def get_conversation_store():
+    """
+    Returns the process-wide `ConversationStore`, creating it on first use.
+    """
+    global _conversation_store
+    if _conversation_store is None:
+        with _conversation_store_lock:
+            if _conversation_store is None:
+                _conversation_store = ConversationStore.from_settings()
+    return _conversation_store
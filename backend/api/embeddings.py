@@ -0,0 +1,245 @@
+import copy
+import threading
+import logging
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from .search_index import LoadedIndex, tokenize
+
+logger = logging.getLogger(__name__)
+
+def to_bytes(vector):
+    """
+    Serialises an embedding for `UniversalContent.embedding` as float32 bytes.
+    """
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def from_bytes(blob):
+    return np.frombuffer(bytes(blob), dtype=np.float32)
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class Embedder(ABC):
+    """
+    Turns texts into unit-length float32 vectors, so that a dot product is
+    their cosine similarity.
+    """
+    dimensions = None
+
+    @abstractmethod
+    def embed(self, texts):
+        """
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            np.ndarray: A (len(texts), dimensions) float32 matrix of unit vectors.
+        """
+        pass
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedder using signed feature hashing of stemmed words and their
+    character trigrams. It needs no model download and runs in microseconds,
+    but only captures surface similarity (shared stems, misspellings).
+    """
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                # crc32 rather than hash(): vectors must be identical across processes
+                digest = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                matrix[row, digest % self.dimensions] += sign * weight
+        return normalize(matrix)
+
+    def _features(self, text):
+        for word in tokenize(text):
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+class SentenceTransformerEmbedder(Embedder):
+    """
+    Dense embeddings from a sentence-transformers model, which also matches
+    paraphrases. Requires the optional `sentence-transformers` package.
+    """
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+def create_embedder(backend, model_name=None, dimensions=256):
+    if backend == 'hashing':
+        return HashingEmbedder(dimensions=dimensions)
+    if backend == 'sentence-transformers':
+        return SentenceTransformerEmbedder(model_name)
+    raise ValueError(f"Unsupported embedding backend: {backend}")
+
+def embedding_text(content):
+    return f"{content.title}\n{content.content}"
+
+class EmbeddingIndex:
+    """
+    Dense top-k search over the stored `UniversalContent` embeddings.
+
+    All vectors are held in one matrix, so a query is a single matrix-vector
+    product plus a partial sort. Like `ContentSearchIndex`, rows are kept in
+    memory, updated by the save/delete signals and reloaded after other
+    processes change content.
+    """
+    def __init__(self, embedder, fields):
+        self.embedder = embedder
+        self.fields = fields
+        self._vectors = {}
+        self._rows = {}
+        self._ids = []
+        self._matrix = np.zeros((0, embedder.dimensions), dtype=np.float32)
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        from .models import UniversalContent
+        skipped = 0
+        queryset = UniversalContent.objects.exclude(embedding=None).only(*self.fields, 'embedding')
+        with self._lock:
+            self._vectors, self._rows = {}, {}
+            for row in queryset.iterator():
+                vector = from_bytes(row.embedding)
+                if vector.shape[0] != self.embedder.dimensions:
+                    skipped += 1
+                    continue
+                row.embedding = None  # Only the matrix needs the vector
+                self._vectors[row.pk] = vector
+                self._rows[row.pk] = row
+            self._dirty = True
+        if skipped:
+            logger.warning("Skipped %d embeddings of the wrong size, run compute_embeddings", skipped)
+        logger.info("Loaded %d embeddings into the dense index", len(self._vectors))
+
+    def update(self, row, vector):
+        with self._lock:
+            self._vectors[row.pk] = np.asarray(vector, dtype=np.float32)
+            self._rows[row.pk] = row
+            self._dirty = True
+
+    def remove(self, pk):
+        with self._lock:
+            if self._vectors.pop(pk, None) is not None:
+                self._rows.pop(pk, None)
+                self._dirty = True
+
+    def row(self, pk):
+        return self._rows.get(pk)
+
+    def search(self, query, k=5):
+        """
+        Returns up to `k` (pk, cosine similarity) pairs for the query, best first.
+        """
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            if self._dirty:
+                self._ids = list(self._vectors)
+                self._matrix = (np.vstack([self._vectors[pk] for pk in self._ids])
+                                if self._ids else np.zeros((0, self.embedder.dimensions), dtype=np.float32))
+                self._dirty = False
+            ids, matrix = self._ids, self._matrix
+        if not ids:
+            return []
+        scores = matrix @ query_vector
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i], float(scores[i])) for i in top]
+
+_embedder = None
+_embeddings_lock = threading.Lock()
+
+def get_embedder():
+    """
+    Returns the process-wide `Embedder` configured by EMBEDDING_BACKEND.
+    """
+    global _embedder
+    if _embedder is None:
+        with _embeddings_lock:
+            if _embedder is None:
+                _embedder = create_embedder(
+                    settings.EMBEDDING_BACKEND,
+                    model_name=settings.EMBEDDING_MODEL,
+                    dimensions=settings.EMBEDDING_DIMENSIONS,
+                )
+    return _embedder
+
+def create_embedding_index():
+    from .gpt_assistant import SEARCH_RESULT_FIELDS
+    return EmbeddingIndex(get_embedder(), SEARCH_RESULT_FIELDS)
+
+_embedding_index = LoadedIndex(create_embedding_index)
+
+def get_embedding_index():
+    """
+    Returns the process-wide `EmbeddingIndex`, loading it on first use and
+    reloading it after content changes.
+    """
+    return _embedding_index.get()
+
+async def aget_embedding_index():
+    return await _embedding_index.aget()
+
+def update_embedding_index(change, version):
+    """
+    Applies `change` to the `EmbeddingIndex` if this process has loaded it.
+    """
+    _embedding_index.apply(change, version)
+
+_embedding_executor = None
+
+def snapshot_row(content):
+    """
+    Copies a `UniversalContent` row as saved, so that later in-memory changes to
+    the instance do not reach the embedding or the index.
+    """
+    row = copy.copy(content)
+    row.metadata = copy.deepcopy(content.metadata)
+    row.embedding = None  # Only the index matrix needs the vector
+    return row
+
+def embed_in_background(row, version):
+    """
+    Computes the embedding of a saved row (see `snapshot_row`) on a background
+    worker, stores it and applies it to the loaded `EmbeddingIndex`, so that
+    saving content does not wait for the embedder. One worker runs the jobs in
+    order, so the last save of a row wins.
+    """
+    global _embedding_executor
+    with _embeddings_lock:
+        if _embedding_executor is None:
+            _embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding')
+    return _embedding_executor.submit(_embed_row, row, version)
+
+def _embed_row(row, version):
+    from .models import UniversalContent
+    try:
+        vector = get_embedder().embed([embedding_text(row)])[0]
+        # update() rather than save(), so that the post_save signal does not fire again
+        if UniversalContent.objects.filter(pk=row.pk).update(embedding=to_bytes(vector)):
+            update_embedding_index(lambda index: index.update(row, vector), version)
+    except Exception as e:
+        logger.error("Could not embed content %s: %s", row.pk, e, exc_info=True)
+    finally:
+        # The worker thread would otherwise keep a database connection open
+        connection.close()
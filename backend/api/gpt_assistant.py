@@ -1,16 +1,53 @@
 import logging
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramSimilarity
-from django.db.models import Q, F, Value, FloatField, ExpressionWrapper
-from django.db.models.functions import Coalesce, Greatest
-from django.core.cache import cache
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramSimilarity, TrigramWordSimilarity
+from django.db.models import Q, F, Value, BooleanField, FloatField, ExpressionWrapper, Window
+from django.db.models.functions import Coalesce, Greatest, Least, RowNumber
+from django.conf import settings
 from typing import List
-from .models import UniversalContent
-from .ai_models import AIModelFactory
+from functools import reduce
+from operator import or_
+from .models import UniversalContent, ContentPassage
+from .ai_models import AIModelFactory, StreamInterrupted, get_last_usage, provider_label
+from .streaming import stream_events, astream_events, replay_tokens
+from .answer_cache import get_answer_cache, normalize_query, query_terms
+from .retrieval_cache import get_retrieval_cache
+from .single_flight import get_single_flight, single_flight_key
+from .prompt_builder import PromptBuilder, count_tokens
+from .prompt_templates import CHAT_TEMPLATE, record_usage
+from .search_index import (
+    get_content_index, aget_content_index, get_passage_index, aget_passage_index, reciprocal_rank_fusion
+)
+from .embeddings import get_embedding_index, aget_embedding_index
+from .metrics import span, timed, timed_stream, atimed_stream, SpanTiming
+from .conversation_store import get_conversation_store
+from .log_handlers import verbose_payloads, CHAT_LOG, SEARCH_LOG, PROMPT_LOG, PAYLOAD_LOG
+import copy
 import random
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Loaded eagerly so that formatting results never triggers deferred-field queries,
+# which would also be illegal from async code.
+SEARCH_RESULT_FIELDS = ('id', 'title', 'content', 'content_type', 'metadata', 'token_count')
+
+# Words shorter than this only take part in full-text matching, not fuzzy trigram matching
+MIN_FUZZY_TERM_LENGTH = 4
+
+# Relevance annotations of the database ranking, see GPTAssistant._rank_annotations
+RANK_ANNOTATIONS = (
+    'search_rank', 'title_rank', 'content_rank',
+    'trigram_similarity_title', 'trigram_similarity_content', 'combined_rank',
+)
+
+# Embedding matches below this cosine similarity are not fused into hybrid results
+MIN_DENSE_SIMILARITY = 0.2
+
+def content_ids(relevant_content: list) -> list:
+    """
+    Returns the UniversalContent ids of retrieved items; passages stand for their source.
+    """
+    return [getattr(content, 'source_id', content.id) for content in relevant_content]
+
 class GPTAssistant:
     """
     GPTAssistant is responsible for generating AI responses based on user input
@@ -18,16 +55,26 @@ class GPTAssistant:
     to fetch relevant information from the database to provide accurate and contextually
     appropriate responses.
     """
-    def __init__(self, model_name='4o-mini'):
+    def __init__(self, model_name=None):
         """
         Initializes the GPTAssistant with the specified AI model.
 
         Args:
-            model_name (str): The name of the AI model to use.
+            model_name (str): The name of the AI model to use. Defaults to settings.DEFAULT_CHAT_MODEL.
         """
-        self.model_name = model_name
-        self.ai_model = AIModelFactory.get_model(model_name)
+        self.model_name = model_name or settings.DEFAULT_CHAT_MODEL
+        self.ai_model = AIModelFactory.get_model(self.model_name)
         self.full_response = ""
+        self.prompt_builder = PromptBuilder.from_settings()
+        # Token counts of the last rendered prompt
+        self.prompt_tokens = 0
+        self.context_tokens = 0
+        self.cached_prefix_fraction = None
+        # Measurements of the last response, see `measurements`
+        self.retrieval_ms = None
+        self.retrieved_ids = []
+        self.answer_cache_hit = False
+        self.llm_ms = None
         self.engagement_phrases = [
             "What would you like to explore next?",
             "Is there a particular aspect you're curious about?",
@@ -41,7 +88,7 @@ class GPTAssistant:
             "Which of our services or areas would you like to know more about?"
         ]
 
-    def generate_response(self, user_input: str, context: str = '') -> dict:
+    def generate_response(self, user_input: str, context: str = '', session_id: str = None) -> dict:
         """
         Generates a response to the user's input by incorporating recent conversation context
         and relevant information fetched from the database.
@@ -49,39 +96,376 @@ class GPTAssistant:
         Args:
             user_input (str): The latest input from the user.
             context (str): The recent conversation context.
+            session_id (str): Optional session whose server-side history replaces `context`;
+                the exchange is appended to it.
 
         Returns:
             dict: A dictionary containing the AI's response and a flag indicating if more information is available.
         """
-        logger.info(f"Generating response for user input: {user_input}")
-        
+        logger.info("Generating response for user input: %.200s", user_input, extra=CHAT_LOG)
+        context = self.conversation_context(session_id, context)
+
+        if settings.SINGLE_FLIGHT_ENABLED:
+            # Identical concurrent requests share one retrieval and one LLM call
+            key = single_flight_key(user_input, context, self.model_name)
+            result = get_single_flight().do(key, lambda: self._generate_response(user_input, context))
+        else:
+            result = self._generate_response(user_input, context)
+        response = self._unpack_result(result)
+        self.remember_exchange(session_id, user_input)
+        return response
+
+    def _generate_response(self, user_input: str, context: str = '') -> dict:
+        # Retrieve additional context using RAG
+        relevant_content = self.retrieve_context_items(user_input)
+
+        ai_response = self.get_cached_answer(user_input, relevant_content, context)
+        self.answer_cache_hit = ai_response is not None
+        self.llm_ms = None
+        if ai_response is None:
+            with span('prompt'):
+                prompt = self.render_prompt(user_input, context, self.format_context(relevant_content))
+
+            # Generate AI response using the AI model
+            with span('llm', provider=provider_label(self.ai_model, self.model_name)) as llm:
+                ai_response = self.ai_model.generate_response(prompt)
+            self.llm_ms = llm.ms
+            self.report_prompt_usage()
+            self.cache_answer(user_input, relevant_content, ai_response, context)
+        response = self.finalize_response(ai_response)
+
+        if verbose_payloads():
+            logger.info("Generated response: %s", response, extra=PAYLOAD_LOG)
+
+        return {
+            "response": response,
+            "has_more_info": bool(self.full_response),
+            "full_response": self.full_response,
+            "measurements": self.measurements()
+        }
+
+    def _unpack_result(self, result: dict) -> dict:
+        """
+        Adopts the (possibly shared) result of a coalesced computation, including
+        the measurements of the request that computed it.
+        """
+        self.full_response = result["full_response"]
+        measurements = result["measurements"]
+        self.retrieved_ids = measurements["retrieved_ids"]
+        self.retrieval_ms = measurements["retrieval_ms"]
+        self.answer_cache_hit = measurements["answer_cache_hit"]
+        self.llm_ms = measurements["llm_ms"]
+        self.prompt_tokens = measurements["prompt_tokens"]
+        return {
+            "response": result["response"],
+            "has_more_info": result["has_more_info"]
+        }
+
+    def stream_response(self, user_input: str, context: str = '', session_id: str = None):
+        """
+        Streaming counterpart of `generate_response`. Relays provider tokens as they
+        arrive and emits a 'sentence' event whenever a sentence is complete, so the
+        client can start speaking before the completion has finished.
+
+        Args:
+            user_input (str): The latest input from the user.
+            context (str): The recent conversation context.
+            session_id (str): Optional session whose server-side history replaces `context`.
+
+        Yields:
+            dict: 'token' and 'sentence' events, followed by a single 'done' event
+            carrying the same payload `generate_response` would have returned.
+        """
+        logger.info("Streaming response for user input: %.200s", user_input, extra=CHAT_LOG)
+        context = self.conversation_context(session_id, context)
+
+        relevant_content = self.retrieve_context_items(user_input)
+
+        cached_answer = self.get_cached_answer(user_input, relevant_content, context)
+        self.answer_cache_hit = cached_answer is not None
+        llm = SpanTiming('llm')
+        if cached_answer is not None:
+            token_stream = iter([cached_answer])
+        else:
+            with span('prompt'):
+                prompt = self.render_prompt(user_input, context, self.format_context(relevant_content))
+            token_stream = timed_stream('llm', self.ai_model.stream_response(prompt), provider=provider_label(self.ai_model, self.model_name), timing=llm)
+
+        chunks = []
+        completed = True
+        try:
+            for event in stream_events(token_stream):
+                if event['type'] == 'token':
+                    chunks.append(event['text'])
+                yield event
+        except StreamInterrupted as e:
+            # Close the turn with what was streamed, but never cache a truncated answer
+            completed = False
+            logger.warning("Completion stream interrupted after %d tokens: %s", len(chunks), e, extra=CHAT_LOG)
+
+        ai_response = "".join(chunks)
+        self.llm_ms = llm.ms
+        if cached_answer is None and completed:
+            self.cache_answer(user_input, relevant_content, ai_response, context)
+        closing_events = self._closing_events(ai_response)
+        self.remember_exchange(session_id, user_input)
+        yield from closing_events
+
+    async def agenerate_response(self, user_input: str, context: str = '', session_id: str = None) -> dict:
+        """
+        Async counterpart of `generate_response`. Retrieval uses the async ORM and the
+        completion is awaited on the provider's async client, so no worker thread is
+        held for the LLM round trip.
+
+        Args:
+            user_input (str): The latest input from the user.
+            context (str): The recent conversation context.
+
+        Returns:
+            dict: A dictionary containing the AI's response and a flag indicating if more information is available.
+        """
+        logger.info("Generating async response for user input: %.200s", user_input, extra=CHAT_LOG)
+        context = self.conversation_context(session_id, context)
+
+        if settings.SINGLE_FLIGHT_ENABLED:
+            key = single_flight_key(user_input, context, self.model_name)
+            result = await get_single_flight().ado(key, lambda: self._agenerate_response(user_input, context))
+        else:
+            result = await self._agenerate_response(user_input, context)
+        response = self._unpack_result(result)
+        self.remember_exchange(session_id, user_input)
+        return response
+
+    async def _agenerate_response(self, user_input: str, context: str = '') -> dict:
+        relevant_content = await self.aretrieve_context_items(user_input)
+
+        ai_response = await self.aget_cached_answer(user_input, relevant_content, context)
+        self.answer_cache_hit = ai_response is not None
+        self.llm_ms = None
+        if ai_response is None:
+            with span('prompt'):
+                prompt = self.render_prompt(user_input, context, self.format_context(relevant_content))
+            with span('llm', provider=provider_label(self.ai_model, self.model_name)) as llm:
+                ai_response = await self.ai_model.agenerate_response(prompt)
+            self.llm_ms = llm.ms
+            self.report_prompt_usage()
+            await self.acache_answer(user_input, relevant_content, ai_response, context)
+        response = self.finalize_response(ai_response)
+
+        if verbose_payloads():
+            logger.info("Generated response: %s", response, extra=PAYLOAD_LOG)
+
+        return {
+            "response": response,
+            "has_more_info": bool(self.full_response),
+            "full_response": self.full_response,
+            "measurements": self.measurements()
+        }
+
+    async def astream_response(self, user_input: str, context: str = '', session_id: str = None):
+        """
+        Async counterpart of `stream_response`.
+
+        Args:
+            user_input (str): The latest input from the user.
+            context (str): The recent conversation context.
+            session_id (str): Optional session whose server-side history replaces `context`.
+
+        Yields:
+            dict: 'token' and 'sentence' events, followed by a single 'done' event.
+        """
+        logger.info("Streaming async response for user input: %.200s", user_input, extra=CHAT_LOG)
+        context = self.conversation_context(session_id, context)
+
+        relevant_content = await self.aretrieve_context_items(user_input)
+
+        cached_answer = await self.aget_cached_answer(user_input, relevant_content, context)
+        self.answer_cache_hit = cached_answer is not None
+        llm = SpanTiming('llm')
+        if cached_answer is not None:
+            token_stream = replay_tokens([cached_answer])
+        else:
+            with span('prompt'):
+                prompt = self.render_prompt(user_input, context, self.format_context(relevant_content))
+            token_stream = atimed_stream('llm', self.ai_model.astream_response(prompt), provider=provider_label(self.ai_model, self.model_name), timing=llm)
+
+        chunks = []
+        completed = True
+        try:
+            async for event in astream_events(token_stream):
+                if event['type'] == 'token':
+                    chunks.append(event['text'])
+                yield event
+        except StreamInterrupted as e:
+            completed = False
+            logger.warning("Completion stream interrupted after %d tokens: %s", len(chunks), e, extra=CHAT_LOG)
+
+        ai_response = "".join(chunks)
+        self.llm_ms = llm.ms
+        if cached_answer is None and completed:
+            await self.acache_answer(user_input, relevant_content, ai_response, context)
+        closing_events = self._closing_events(ai_response)
+        self.remember_exchange(session_id, user_input)
+        for event in closing_events:
+            yield event
+
+    def conversation_context(self, session_id, context):
+        """
+        Returns the conversation context of a request: the session's server-side
+        history when it has one, otherwise the client-supplied context.
+        """
+        if session_id:
+            return get_conversation_store().history(session_id) or context
+        return context
+
+    def remember_exchange(self, session_id, user_input: str):
+        """
+        Appends the user's input and the answer just generated to the session.
+        """
+        if session_id:
+            get_conversation_store().record_exchange(session_id, user_input, self.full_response)
+
+    def measurements(self) -> dict:
+        """
+        Returns what the last response took: the retrieval time and the retrieved
+        content ids, whether the answer came from the answer cache, and for a
+        generated answer the LLM time and prompt tokens. See api/telemetry.py.
+        """
+        return {
+            "retrieved_ids": list(self.retrieved_ids),
+            "retrieval_ms": self.retrieval_ms,
+            "answer_cache_hit": self.answer_cache_hit,
+            "llm_ms": self.llm_ms,
+            "prompt_tokens": 0 if self.answer_cache_hit else self.prompt_tokens
+        }
+
+    def get_cached_answer(self, user_input: str, relevant_content: List[UniversalContent], context: str = ''):
+        """
+        Looks up a previously generated answer for this (or a near-identical) query
+        over the same retrieved content, conversation context and model.
+
+        Returns:
+            str: The cached answer, or None on a miss or when the cache is disabled.
+        """
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        answer = get_answer_cache().get(user_input, content_ids(relevant_content), self.model_name, context)
+        if answer is not None:
+            logger.info("Returning cached answer", extra=CHAT_LOG)
+        return answer
+
+    def cache_answer(self, user_input: str, relevant_content: List[UniversalContent], ai_response, context: str = ''):
+        """
+        Stores a successful answer in the answer cache.
+        """
+        if not settings.ANSWER_CACHE_ENABLED or not ai_response or not ai_response.strip():
+            return
+        get_answer_cache().set(user_input, content_ids(relevant_content), self.model_name, ai_response.strip(), context)
+
+    async def aget_cached_answer(self, user_input: str, relevant_content: List[UniversalContent], context: str = ''):
+        """
+        Async counterpart of `get_cached_answer`.
+        """
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        answer = await get_answer_cache().aget(user_input, content_ids(relevant_content), self.model_name, context)
+        if answer is not None:
+            logger.info("Returning cached answer", extra=CHAT_LOG)
+        return answer
+
+    async def acache_answer(self, user_input: str, relevant_content: List[UniversalContent], ai_response, context: str = ''):
+        """
+        Async counterpart of `cache_answer`.
+        """
+        if not settings.ANSWER_CACHE_ENABLED or not ai_response or not ai_response.strip():
+            return
+        await get_answer_cache().aset(user_input, content_ids(relevant_content), self.model_name, ai_response.strip(), context)
+
+    def _closing_events(self, ai_response: str) -> list:
+        """
+        Builds the events that close a stream: the engagement phrase (or the apology)
+        as a final spoken sentence, then the 'done' event with the full response.
+        """
+        response = self.finalize_response(ai_response)
+        closing = response[len(ai_response.strip()):].strip() if ai_response.strip() else response
+        events = []
+        if closing:
+            events.append({'type': 'sentence', 'text': closing})
+        events.append({
+            'type': 'done',
+            'response': response,
+            'has_more_info': bool(self.full_response)
+        })
+        return events
+
+    def build_prompt(self, user_input: str, context: str = '') -> str:
+        """
+        Builds the RAG prompt for the user's input and the recent conversation context.
+
+        Args:
+            user_input (str): The latest input from the user.
+            context (str): The recent conversation context.
+
+        Returns:
+            str: The prompt to send to the AI model.
+        """
         # Retrieve additional context using RAG
         additional_context = self.get_context(user_input)
-        full_context = f"{context}\n\n{additional_context}".strip()
-        
-        # Construct the prompt with recent conversation history and guidelines
-        prompt = f"""You are an AI assistant for Think41, a technology consulting company with a product mindset. Your role is to provide knowledgeable and helpful information about the company. Always maintain a professional, friendly, and helpful tone.
+        return self.render_prompt(user_input, context, additional_context)
 
-Recent conversation history:
-{full_context}
+    async def abuild_prompt(self, user_input: str, context: str = '') -> str:
+        """
+        Async counterpart of `build_prompt`.
+        """
+        additional_context = await self.aget_context(user_input)
+        return self.render_prompt(user_input, context, additional_context)
 
-User's latest input: '{user_input}'
+    def render_prompt(self, user_input: str, context: str, additional_context: str) -> str:
+        """
+        Renders the prompt from the conversation context and the retrieved content.
 
-Guidelines:
-1. Provide a concise response (50-75 words) that addresses the main point of the user's query.
-2. Use the conversation history to maintain context and provide relevant responses.
-3. If the user asks about Think41's services, founders, background, or any related information, focus on the most relevant details.
-4. For unrelated questions, politely redirect to Think41 topics.
-5. Address inappropriate language with a brief, polite message about professional communication.
-6. If unsure, offer to help find information on the Think41 website or suggest contacting Think41 directly.
-7. Always maintain a professional, friendly, and helpful tone.
+        Args:
+            user_input (str): The latest input from the user.
+            context (str): The recent conversation context.
+            additional_context (str): The formatted retrieved content.
 
-Response:"""
-        
-        # Generate AI response using the AI model
-        ai_response = self.ai_model.generate_response(prompt)
+        Returns:
+            str: The prompt to send to the AI model.
+        """
+        history, history_tokens = self.prompt_builder.build_history(context)
+        full_context = f"{history}\n\n{additional_context}".strip()
         
-        if ai_response:
+        # The static instructions and guidelines come first so providers can cache them
+        prompt = CHAT_TEMPLATE.render(history=full_context, user_input=user_input)
+
+        self.prompt_tokens = CHAT_TEMPLATE.static_tokens + count_tokens(prompt[len(CHAT_TEMPLATE.static):])
+        logger.info(
+            "Prompt tokens: %d (history: %d, retrieved content: %d)",
+            self.prompt_tokens, history_tokens, self.context_tokens, extra=PROMPT_LOG
+        )
+        return prompt
+
+    def report_prompt_usage(self):
+        """
+        Records the provider-reported usage of the last completion and logs the
+        fraction of the prompt served from the provider's prefix cache.
+        """
+        self.cached_prefix_fraction = record_usage(CHAT_TEMPLATE.name, get_last_usage())
+        if self.cached_prefix_fraction is not None:
+            logger.info("Provider served %.0f%% of the prompt from its prefix cache", self.cached_prefix_fraction * 100, extra=PROMPT_LOG)
+
+    def finalize_response(self, ai_response) -> str:
+        """
+        Appends an engagement phrase to the model's answer, or falls back to an apology
+        when the model returned nothing.
+
+        Args:
+            ai_response (str): The raw completion text, or None on failure.
+
+        Returns:
+            str: The response to return to the user.
+        """
+        if ai_response and ai_response.strip():
             ai_response = ai_response.strip()
             engagement_phrase = random.choice(self.engagement_phrases)
             response = f"{ai_response}\n\n{engagement_phrase}"
@@ -89,23 +473,22 @@ Response:"""
         else:
             response = "I apologize, but I'm having trouble generating a response at the moment. How else can I assist you with information about Think41?"
             self.full_response = ""
-        
-        logger.info(f"Generated response: {response[:100]}...")  # Log first 100 characters of the response
-
-        return {
-            "response": response,
-            "has_more_info": bool(self.full_response)
-        }
+        return response
 
-    def get_more_info(self) -> dict:
+    def get_more_info(self, session_id: str = None) -> dict:
         """
         Provides additional information based on the last generated response.
 
+        Args:
+            session_id (str): Optional session whose last answer to elaborate on,
+                instead of the last answer generated by this instance.
+
         Returns:
             dict: A dictionary containing the additional information response.
         """
-        if self.full_response:
-            return {"response": self.full_response}
+        full_response = get_conversation_store().full_response(session_id) if session_id else self.full_response
+        if full_response:
+            return {"response": full_response}
         else:
             return {
                 "response": "I'm sorry, but I don't have any additional information on this topic at the moment. Is there anything else you'd like me to elaborate on regarding Think41 or navigating our website?"
@@ -121,24 +504,103 @@ Response:"""
         Returns:
             str: A concatenated string of relevant content titles and contents.
         """
-        relevant_content = self.search_relevant_content(user_input)
-        context = ""
-        
+        relevant_content = self.retrieve_context_items(user_input)
+        return self.format_context(relevant_content)
+
+    async def aget_context(self, user_input: str) -> str:
+        """
+        Async counterpart of `get_context`.
+        """
+        relevant_content = await self.aretrieve_context_items(user_input)
+        return self.format_context(relevant_content)
+
+    def retrieve_context_items(self, user_input: str) -> list:
+        """
+        Retrieves the items whose text goes into the prompt: whole UniversalContent
+        rows, or only their best matching passages when RETRIEVAL_UNIT is 'passage'.
+
+        Args:
+            user_input (str): The latest input from the user.
+
+        Returns:
+            list: UniversalContent or ContentPassage objects, best first.
+        """
+        with span('context') as retrieval:
+            if settings.RETRIEVAL_UNIT == 'passage':
+                relevant_content = self.search_relevant_passages(user_input)
+            else:
+                relevant_content = self.search_relevant_content(user_input)
+        self._measure_retrieval(relevant_content, retrieval)
+        return relevant_content
+
+    async def aretrieve_context_items(self, user_input: str) -> list:
+        """
+        Async counterpart of `retrieve_context_items`.
+        """
+        with span('context') as retrieval:
+            if settings.RETRIEVAL_UNIT == 'passage':
+                passage_index = await aget_passage_index()
+                relevant_content = self._search_passages(passage_index, user_input)
+            else:
+                relevant_content = await self.asearch_relevant_content(user_input)
+        self._measure_retrieval(relevant_content, retrieval)
+        return relevant_content
+
+    def _measure_retrieval(self, relevant_content: list, retrieval: SpanTiming):
+        self.retrieval_ms = retrieval.ms
+        self.retrieved_ids = content_ids(relevant_content)
+
+    def search_relevant_passages(self, query: str) -> List[ContentPassage]:
+        """
+        Searches the in-memory passage index for the passages that best match the query.
+
+        Args:
+            query (str): The search query derived from the user's input.
+
+        Returns:
+            List[ContentPassage]: Up to 5 passages, each with its source's title.
+        """
+        return self._search_passages(get_passage_index(), query)
+
+    @timed('search')
+    def _search_passages(self, passage_index, query: str) -> List[ContentPassage]:
+        try:
+            passages = passage_index.search(query.lower().strip(), 5)
+            self._log_results(passages)
+            return passages
+        except Exception as e:
+            logger.error("Error during search_relevant_passages: %s", e, exc_info=True)
+            return []
+
+    def format_context(self, relevant_content: List[UniversalContent]) -> str:
+        """
+        Formats retrieved content into the context block of the prompt.
+
+        Args:
+            relevant_content (List[UniversalContent]): The retrieved content items.
+
+        Returns:
+            str: A concatenated string of relevant content titles and contents.
+        """
         if relevant_content:
-            logger.info(f"Found {len(relevant_content)} relevant content items")
-            for content in relevant_content:
-                logger.info(f"Content item: Title: {content.title}, Type: {content.content_type}")
-                context += f"{content.title}:\n{content.content}\n\n"
+            logger.info("Found %d relevant content items", len(relevant_content), extra=PROMPT_LOG)
+            if logger.isEnabledFor(logging.DEBUG):
+                for content in relevant_content:
+                    logger.debug("Content item: Title: %s, Type: %s", content.title, content.content_type)
+            # Fill the context token budget in rank order
+            context, self.context_tokens = self.prompt_builder.build_context(relevant_content)
         else:
-            logger.info("No relevant content found, using default context")
+            logger.info("No relevant content found, using default context", extra=PROMPT_LOG)
+            self.context_tokens = 0
             context = "No specific context found in the database. Please provide a general response based on the user's input."
 
         return context
 
+    @timed('search')
     def search_relevant_content(self, query: str) -> List[UniversalContent]:
         """
         Searches for relevant content in the database using full-text search and trigram similarity.
-        Incorporates performance optimizations and error handling for production readiness.
+        The ranked top results, including the word-by-word fallback matches, come back from a single query.
 
         Args:
             query (str): The search query derived from the user's input.
@@ -147,127 +609,298 @@ Response:"""
             List[UniversalContent]: A list of top 5 relevant UniversalContent objects.
         """
         try:
-            logger.info(f"Searching for relevant content with query: {query}")
+            logger.info("Searching for relevant content with query: %.200s", query, extra=SEARCH_LOG)
 
             # Normalize the query
             normalized_query = query.lower().strip()
 
+            if settings.SEARCH_BACKEND == 'bm25':
+                results = get_content_index().search(normalized_query, 5)
+                self._log_results(results)
+                return results
+
             # Check cache first
-            cache_key = f"search_relevant_content:{normalized_query}"
-            cached_results = cache.get(cache_key)
-            if cached_results:
-                logger.info("Returning cached search results")
-                return cached_results
-
-            # Create a full-text search query
-            search_query = SearchQuery(normalized_query, config='english')
-
-            # Annotate the queryset with relevance scores
-            relevant_content = UniversalContent.objects.annotate(
-                search_rank=Coalesce(SearchRank(F('search_vector'), search_query), Value(0.0)),
-                title_rank=Coalesce(
-                    SearchRank(
-                        F('search_vector'),
-                        SearchQuery(normalized_query, config='english', search_type='phrase')
-                    ), Value(0.0)
-                ),
-                content_rank=Coalesce(SearchRank(F('search_vector'), search_query), Value(0.0)),
-                trigram_similarity_title=TrigramSimilarity('title', normalized_query),
-                trigram_similarity_content=TrigramSimilarity('content', normalized_query),
-                combined_rank=ExpressionWrapper(
-                    F('search_rank') * 2 +
-                    F('title_rank') * 3 +
-                    F('content_rank') * 1.5 +
-                    Greatest(F('trigram_similarity_title') * 2, F('trigram_similarity_content')),
-                    output_field=FloatField()
-                )
-            ).filter(
-                Q(search_vector=search_query) |
-                Q(title__icontains=normalized_query) |
-                Q(content__icontains=normalized_query) |
-                Q(trigram_similarity_title__gt=0.1) |
-                Q(trigram_similarity_content__gt=0.1)
-            ).order_by('-combined_rank').only('id', 'title', 'content')  # Select only necessary fields
-
-            found_results = relevant_content.count()
-            logger.info(f"Initial search found {found_results} results")
-
-            # If no results or low-quality results, try word-by-word search
-            if not relevant_content.exists() or relevant_content.first().combined_rank < 0.1:
-                logger.info("No results or low-quality results found, trying word-by-word search")
-                words = normalized_query.split()
-                q_objects = Q()
-                for word in words:
-                    q_objects |= Q(title__icontains=word) | Q(content__icontains=word)
-                
-                word_query = ' '.join(words)
-                word_search_query = SearchQuery(word_query, config='english')
-
-                word_by_word_content = UniversalContent.objects.filter(q_objects).distinct().annotate(
-                    search_rank=Coalesce(SearchRank(F('search_vector'), word_search_query), Value(0.0)),
-                    title_rank=Coalesce(
-                        SearchRank(
-                            F('search_vector'),
-                            SearchQuery(word_query, config='english', search_type='phrase')
-                        ), Value(0.0)
-                    ),
-                    content_rank=Coalesce(SearchRank(F('search_vector'), word_search_query), Value(0.0)),
-                )
-
-                # Handle trigram similarity for single and multiple words
-                if len(words) == 1:
-                    word_by_word_content = word_by_word_content.annotate(
-                        trigram_similarity_title=TrigramSimilarity('title', words[0]),
-                        trigram_similarity_content=TrigramSimilarity('content', words[0])
-                    )
-                else:
-                    word_by_word_content = word_by_word_content.annotate(
-                        trigram_similarity_title=Greatest(*[
-                            TrigramSimilarity('title', word) for word in words
-                        ]),
-                        trigram_similarity_content=Greatest(*[
-                            TrigramSimilarity('content', word) for word in words
-                        ])
-                    )
-
-                relevant_content = word_by_word_content.annotate(
-                    combined_rank=ExpressionWrapper(
-                        F('search_rank') * 2 +
-                        F('title_rank') * 3 +
-                        F('content_rank') * 1.5 +
-                        Greatest(F('trigram_similarity_title') * 2, F('trigram_similarity_content')),
-                        output_field=FloatField()
-                    )
-                ).filter(
-                    combined_rank__gt=0.01  # Apply minimum rank threshold
-                ).order_by('-combined_rank').only('id', 'title', 'content')
-
-                word_found_results = relevant_content.count()
-                logger.info(f"Word-by-word search found {word_found_results} results")
-
-            # Final filtering and limiting to top 5 results
-            results = relevant_content.filter(combined_rank__gt=0.01)[:5]
-            logger.info(f"Returning top {len(results)} results")
-
-            # Log the titles of the results for debugging
-            for result in results:
-                logger.info(
-                    f"Result: {result.title} (Combined Rank: {result.combined_rank:.4f}, "
-                    f"Search Rank: {result.search_rank:.4f}, Title Rank: {result.title_rank:.4f}, "
-                    f"Content Rank: {result.content_rank:.4f}, "
-                    f"Trigram Sim Title: {result.trigram_similarity_title:.4f}, "
-                    f"Trigram Sim Content: {result.trigram_similarity_content:.4f})"
-                )
-
-            # Cache the results for future identical queries
-            cache.set(cache_key, list(results), timeout=60*5)  # Cache for 5 minutes
-
-            return list(results)
+            retrieval_cache = get_retrieval_cache() if settings.RETRIEVAL_CACHE_ENABLED else None
+            if retrieval_cache is not None:
+                version = retrieval_cache.version()
+                hits = retrieval_cache.get(settings.SEARCH_BACKEND, normalized_query, version)
+                if hits is not None:
+                    logger.info("Returning cached search results", extra=SEARCH_LOG)
+                    if not hits:
+                        return []
+                    rows = UniversalContent.objects.only(*SEARCH_RESULT_FIELDS).in_bulk([pk for pk, _ in hits])
+                    return self._restore_hits(hits, rows)
+
+            if settings.SEARCH_BACKEND == 'hybrid':
+                lexical = list(self._search_queryset(normalized_query)[:settings.SEARCH_HYBRID_CANDIDATES])
+                results = self._fuse_results(normalized_query, lexical, get_embedding_index())
+            else:
+                results = list(self._search_queryset(normalized_query)[:5])
+            self._log_results(results)
+
+            # Cache the ranked ids for future identical queries, including empty results
+            if retrieval_cache is not None:
+                retrieval_cache.set(settings.SEARCH_BACKEND, normalized_query, [(r.id, r.combined_rank) for r in results], version)
+
+            return results
+
+        except Exception as e:
+            logger.error("Error during search_relevant_content: %s", e, exc_info=True)
+            return []
+
+    @timed('search')
+    async def asearch_relevant_content(self, query: str) -> List[UniversalContent]:
+        """
+        Async counterpart of `search_relevant_content`, using the async ORM and cache APIs.
+
+        Args:
+            query (str): The search query derived from the user's input.
+
+        Returns:
+            List[UniversalContent]: A list of top 5 relevant UniversalContent objects.
+        """
+        try:
+            logger.info("Searching for relevant content with query: %.200s", query, extra=SEARCH_LOG)
+
+            normalized_query = query.lower().strip()
+
+            if settings.SEARCH_BACKEND == 'bm25':
+                # Only loading the index touches the database
+                content_index = await aget_content_index()
+                results = content_index.search(normalized_query, 5)
+                self._log_results(results)
+                return results
+
+            retrieval_cache = get_retrieval_cache() if settings.RETRIEVAL_CACHE_ENABLED else None
+            if retrieval_cache is not None:
+                version = await retrieval_cache.aversion()
+                hits = await retrieval_cache.aget(settings.SEARCH_BACKEND, normalized_query, version)
+                if hits is not None:
+                    logger.info("Returning cached search results", extra=SEARCH_LOG)
+                    if not hits:
+                        return []
+                    queryset = UniversalContent.objects.only(*SEARCH_RESULT_FIELDS).filter(pk__in=[pk for pk, _ in hits])
+                    rows = {row.pk: row async for row in queryset}
+                    return self._restore_hits(hits, rows)
+
+            if settings.SEARCH_BACKEND == 'hybrid':
+                lexical = [result async for result in self._search_queryset(normalized_query)[:settings.SEARCH_HYBRID_CANDIDATES]]
+                embedding_index = await aget_embedding_index()
+                results = self._fuse_results(normalized_query, lexical, embedding_index)
+            else:
+                results = [result async for result in self._search_queryset(normalized_query)[:5]]
+            self._log_results(results)
+
+            if retrieval_cache is not None:
+                await retrieval_cache.aset(settings.SEARCH_BACKEND, normalized_query, [(r.id, r.combined_rank) for r in results], version)
+
+            return results
 
         except Exception as e:
-            logger.error(f"Error during search_relevant_content: {e}", exc_info=True)
+            logger.error("Error during asearch_relevant_content: %s", e, exc_info=True)
             return []
 
+    def _restore_hits(self, hits: list, rows: dict) -> List[UniversalContent]:
+        """
+        Rebuilds cached (id, score) hits into ranked rows; rows deleted since are skipped.
+        """
+        results = []
+        for pk, score in hits:
+            row = rows.get(pk)
+            if row is not None:
+                row.combined_rank = score
+                results.append(row)
+        return results
+
+    def _fuse_results(self, normalized_query: str, lexical: List[UniversalContent], embedding_index, k: int = 5) -> List[UniversalContent]:
+        """
+        Fuses the database ranking with embedding search by reciprocal rank fusion,
+        so that rows found by either ranking can reach the top results.
+
+        Args:
+            normalized_query (str): The normalized search query.
+            lexical (List[UniversalContent]): Rows ranked by `_search_queryset`, best first.
+            embedding_index (EmbeddingIndex): The loaded dense index.
+            k (int): The number of results.
+
+        Returns:
+            List[UniversalContent]: The top `k` rows, with the fused score as `combined_rank`.
+        """
+        dense = [
+            pk for pk, score in embedding_index.search(normalized_query, settings.SEARCH_HYBRID_CANDIDATES)
+            if score >= MIN_DENSE_SIMILARITY
+        ]
+        rows = {row.pk: row for row in lexical}
+        fused = reciprocal_rank_fusion([list(rows), dense], k=settings.SEARCH_RRF_K)
+
+        results = []
+        for pk, score in fused:
+            row = rows.get(pk)
+            if row is None:
+                row = embedding_index.row(pk)
+                if row is None:
+                    continue
+                row = copy.copy(row)
+            row.combined_rank = score
+            results.append(row)
+            if len(results) == k:
+                break
+        return results
+
+    @timed('search')
+    def search_relevant_content_batch(self, queries: List[str], k: int = 5) -> dict:
+        """
+        Searches for many queries together. Duplicate queries and the words they
+        share are matched once, and a single query ranks the candidate rows against
+        every query and returns those in the top `k` of at least one of them. The
+        rows are then ranked per query exactly as `search_relevant_content` ranks them.
+
+        Args:
+            queries (List[str]): The search queries.
+            k (int): The number of results per query.
+
+        Returns:
+            dict: The top `k` UniversalContent objects for each query, keyed by query.
+        """
+        normalized = {query: query.lower().strip() for query in queries}
+        unique = [query for query in dict.fromkeys(normalized.values()) if query]
+        if not unique:
+            return {query: [] for query in queries}
+
+        if settings.SEARCH_BACKEND == 'bm25':
+            content_index = get_content_index()
+            ranked = {query: content_index.search(query, k) for query in unique}
+        else:
+            limit = settings.SEARCH_HYBRID_CANDIDATES if settings.SEARCH_BACKEND == 'hybrid' else k
+            ranked = self._batch_search(unique, limit)
+            if settings.SEARCH_BACKEND == 'hybrid':
+                embedding_index = get_embedding_index()
+                ranked = {query: self._fuse_results(query, rows, embedding_index, k) for query, rows in ranked.items()}
+
+        logger.info("Batch search for %d queries (%d distinct)", len(queries), len(unique), extra=SEARCH_LOG)
+        return {query: ranked.get(normalized[query], []) for query in queries}
+
+    def _batch_search(self, normalized_queries: List[str], k: int) -> dict:
+        annotations = {}
+        for i, normalized_query in enumerate(normalized_queries):
+            annotations.update(self._rank_annotations(normalized_query, suffix=f'_{i}'))
+            # Whether the row is one of this query's own candidates
+            annotations[f'matches_{i}'] = ExpressionWrapper(
+                self._candidate_filter([normalized_query]), output_field=BooleanField()
+            )
+        # Each row's position in every query's ranking of its own candidates: only
+        # rows in the top k of some query leave the database
+        positions = {
+            f'position_{i}': Window(RowNumber(), order_by=[F(f'matches_{i}').desc(), F(f'combined_rank_{i}').desc()])
+            for i in range(len(normalized_queries))
+        }
+        best_position = Least(*(F(name) for name in positions)) if len(positions) > 1 else F('position_0')
+        rows = list(
+            UniversalContent.objects.filter(self._candidate_filter(normalized_queries))
+            .annotate(**annotations).annotate(**positions).annotate(best_position=best_position)
+            .filter(best_position__lte=k).only(*SEARCH_RESULT_FIELDS)
+        )
+
+        ranked = {}
+        for i, normalized_query in enumerate(normalized_queries):
+            matches = sorted(
+                (row for row in rows if getattr(row, f'matches_{i}') and getattr(row, f'combined_rank_{i}') > 0.01),
+                key=lambda row: getattr(row, f'combined_rank_{i}'),
+                reverse=True
+            )[:k]
+            results = []
+            for row in matches:
+                # Each query gets its own copy, carrying that query's ranks under the usual names
+                result = copy.copy(row)
+                for name in RANK_ANNOTATIONS:
+                    setattr(result, name, getattr(row, f'{name}_{i}'))
+                results.append(result)
+            ranked[normalized_query] = results
+        return ranked
+
+    def _search_queryset(self, normalized_query: str):
+        """
+        Builds the ranked queryset for a query, with the word-by-word fallback folded in.
+        """
+        return UniversalContent.objects.filter(self._candidate_filter([normalized_query])).annotate(
+            **self._rank_annotations(normalized_query)
+        ).filter(
+            combined_rank__gt=0.01  # Apply minimum rank threshold
+        ).order_by('-combined_rank').only(*SEARCH_RESULT_FIELDS)  # Select only necessary fields
+
+    def _candidate_filter(self, normalized_queries: List[str]) -> Q:
+        """
+        Selects the rows matching any of the queries.
+
+        Every filter is one the indexes can answer: `@@` against the GIN index on
+        `search_vector`, and the pg_trgm `%` / `%>` operators against the trigram GIN
+        indexes on title and content. The whole query and each of its words are OR-ed,
+        so rows that only match individual words are still candidates, ranked below
+        rows that match the whole query. Words shared by several queries are matched once.
+        """
+        words = list(dict.fromkeys(word for query in normalized_queries for word in query.split()))
+        terms = dict.fromkeys(
+            term for query in normalized_queries for term in query_terms(normalize_query(query))
+            # Per-word fuzzy matches catch misspelt words; short and stop words would match everything
+            if len(term) >= MIN_FUZZY_TERM_LENGTH
+        )
+
+        candidates = Q()
+        if words:
+            candidates |= Q(search_vector=reduce(or_, [SearchQuery(word, config='english') for word in words]))
+        for normalized_query in normalized_queries:
+            candidates |= Q(title__trigram_similar=normalized_query) | Q(content__trigram_word_similar=normalized_query)
+        for term in terms:
+            candidates |= Q(title__trigram_word_similar=term) | Q(content__trigram_word_similar=term)
+        return candidates
+
+    def _rank_annotations(self, normalized_query: str, suffix: str = '') -> dict:
+        """
+        Builds the relevance annotations of a query, named with an optional suffix
+        so that one queryset can rank rows against several queries.
+        """
+        words = normalized_query.split()
+        search_query = SearchQuery(normalized_query, config='english')
+        word_search_query = reduce(or_, [SearchQuery(word, config='english') for word in words]) if words else search_query
+
+        return {
+            f'search_rank{suffix}': Coalesce(SearchRank(F('search_vector'), search_query), Value(0.0)),
+            f'title_rank{suffix}': Coalesce(
+                SearchRank(
+                    F('search_vector'),
+                    SearchQuery(normalized_query, config='english', search_type='phrase')
+                ), Value(0.0)
+            ),
+            f'content_rank{suffix}': Coalesce(SearchRank(F('search_vector'), word_search_query), Value(0.0)),
+            f'trigram_similarity_title{suffix}': TrigramSimilarity('title', normalized_query),
+            f'trigram_similarity_content{suffix}': TrigramWordSimilarity(normalized_query, 'content'),
+            f'combined_rank{suffix}': ExpressionWrapper(
+                F(f'search_rank{suffix}') * 2 +
+                F(f'title_rank{suffix}') * 3 +
+                F(f'content_rank{suffix}') * 1.5 +
+                Greatest(F(f'trigram_similarity_title{suffix}') * 2, F(f'trigram_similarity_content{suffix}')),
+                output_field=FloatField()
+            ),
+        }
+
+    def _log_results(self, results: List[UniversalContent]):
+        logger.info("Returning top %d results", len(results), extra=SEARCH_LOG)
+
+        # Per-result scores are only logged for debugging
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        for result in results:
+            if not hasattr(result, 'search_rank'):
+                # Ranked by the in-memory index, which only produces one score
+                logger.debug("Result: %s (Combined Rank: %.4f)", result.title, result.combined_rank)
+                continue
+            logger.debug(
+                "Result: %s (Combined Rank: %.4f, Search Rank: %.4f, Title Rank: %.4f, Content Rank: %.4f, "
+                "Trigram Sim Title: %.4f, Trigram Sim Content: %.4f)",
+                result.title, result.combined_rank, result.search_rank, result.title_rank, result.content_rank,
+                result.trigram_similarity_title, result.trigram_similarity_content,
+            )
+
 def gpt_assistant(prompt: str, prompt_type: str = 'create', model_name: str = '4o-mini') -> dict:
     """
     Convenience function to generate a response using the GPTAssistant class.
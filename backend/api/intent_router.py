@@ -0,0 +1,313 @@
+import math
+import random
+import re
+import logging
+import threading
+from collections import Counter
+from django.conf import settings
+from .answer_cache import normalize_query
+from .metrics import span
+from .youtube_views import extract_yt_term, get_youtube_url, aget_youtube_url
+from .conversation_store import get_conversation_store
+from .telemetry import record_interaction, ENDPOINT_CHAT
+from .log_handlers import CHAT_LOG
+
+logger = logging.getLogger(__name__)
+
+GREETING, THANKS, GOODBYE, YOUTUBE, NAVIGATE, QUESTION = 'greeting', 'thanks', 'goodbye', 'youtube', 'navigate', 'question'
+
+# Intents answered from CANNED_RESPONSES without retrieval or a completion
+CANNED_INTENTS = (GREETING, THANKS, GOODBYE)
+
+# Recorded as the model of routed turns in ChatQueryLog (see api/telemetry.py)
+ROUTER_MODEL_NAME = 'intent-router'
+
+CANNED_RESPONSES = {
+    GREETING: [
+        "Hello! I'm Echo, Think41's assistant. What would you like to know about Think41?",
+        "Hi there! How can I help you learn about Think41 today?",
+        "Hello! Ask me anything about Think41's services, insights or careers.",
+    ],
+    THANKS: [
+        "You're welcome! Is there anything else you'd like to know about Think41?",
+        "Happy to help! What else would you like to explore?",
+        "Glad I could help. Let me know if you have any other questions about Think41.",
+    ],
+    GOODBYE: [
+        "Goodbye! Thanks for visiting Think41.",
+        "Thanks for stopping by. Have a great day!",
+        "Bye for now! Come back any time you have questions about Think41.",
+    ],
+}
+
+# Website pages (the page_name of their tour steps) and the ways users refer to them
+NAVIGATION_PAGES = {
+    'home': ('home', 'homepage', 'home page', 'main page', 'start'),
+    'services': ('services', 'service', 'our services', 'your services'),
+    'insights': ('insights', 'insight', 'blog', 'articles'),
+    'about': ('about', 'about us', 'about page', 'company'),
+    'ai-demo': ('ai demo', 'ai-demo', 'demo'),
+    'careers': ('careers', 'career', 'jobs'),
+    'contact': ('contact', 'contact us'),
+}
+
+PAGE_TITLES = {'ai-demo': 'AI Demo'}
+
+# Matched against the normalized input (lower-case, punctuation stripped), so they
+# only fire when the whole turn is a greeting, thanks or goodbye
+RULES = (
+    (GREETING, re.compile(
+        r'^(hi|hello|hey|hiya|howdy|greetings|good (morning|afternoon|evening))( there| echo| everyone| all)?'
+        r'( how are you( doing)?)?$'
+    )),
+    (THANKS, re.compile(
+        r'^((ok|okay|great|awesome|perfect|cool) )?(thanks|thank you|thx|ty|cheers|much appreciated)'
+        r'( so much| a lot| very much)?( echo)?$'
+    )),
+    (GOODBYE, re.compile(r'^((ok|okay) )?(bye|goodbye|bye bye|see you( later)?|see ya|that s all|that is all)( for now)?'
+                         r'( thanks| thank you)?$')),
+)
+
+_page_aliases = {alias: page for page, aliases in NAVIGATION_PAGES.items() for alias in aliases}
+# Only explicit "go to" phrasings: "show me your services" or "open jobs" are as
+# likely questions about the page's subject, which the LLM should answer
+NAVIGATION_RULE = re.compile(
+    r'^(please )?(go|take me|navigate|bring me)( back)?( over)? to( the)? '
+    r'(?P<page>' + '|'.join(re.escape(alias) for alias in sorted(_page_aliases, key=len, reverse=True)) + r')'
+    r'( page| section| tab)?( please)?$'
+)
+
+# Labelled utterances the local classifier is trained on. QUESTION examples keep
+# short knowledge questions, which share words with small talk, away from the canned intents.
+TRAINING_EXAMPLES = {
+    GREETING: [
+        "hi", "hello", "hey", "hey there", "hello there", "hi echo", "hello echo", "good morning",
+        "good afternoon", "good evening", "hey how are you", "hi how are you doing", "hello how are you",
+        "hi there how is it going", "yo", "hello again", "hi again", "hey echo how are you today",
+        "morning", "nice to meet you", "hey hey", "how's it going", "hey how's it going",
+        "what's up", "hi echo how are you",
+    ],
+    THANKS: [
+        "thanks", "thank you", "thanks a lot", "thank you so much", "thank you very much", "thx", "ty",
+        "cheers", "great thanks", "ok thanks", "okay thank you", "awesome thank you", "thanks that helps",
+        "that was helpful thanks", "thanks echo", "perfect thanks", "much appreciated", "appreciate it",
+        "thanks for the help", "thank you for your help", "that helps a lot", "got it thanks", "nice thanks",
+        "thanks that was really helpful", "that's great thanks", "thank you that's helpful",
+    ],
+    GOODBYE: [
+        "bye", "goodbye", "bye bye", "see you", "see you later", "see ya", "bye for now", "that's all",
+        "that is all", "ok bye", "goodbye and thanks", "thanks bye", "talk to you later", "have a nice day",
+        "have a good day", "have a great day", "i am done", "i'm done", "nothing else", "no that's all",
+        "that's all thanks", "no more questions", "good night", "later", "bye echo", "good night echo",
+    ],
+    QUESTION: [
+        "what does think41 do", "what services do you offer", "tell me about think41", "who are you",
+        "what is think41", "how can you help me", "who founded think41", "where is your office",
+        "what are your services", "hi what do you do", "hello tell me about your services",
+        "thanks what else do you offer", "can you help me with ai", "how do i contact you",
+        "what jobs are open", "are you hiring", "what is your mission", "how big is the team",
+        "do you build ai products", "what technologies do you use", "show me your case studies",
+        "what industries do you work with", "how much does it cost", "tell me more",
+        "what are the latest insights", "hey what is think41", "good morning what services do you have",
+        "what can you do", "how does the ai demo work", "who are your clients", "what is generative ai",
+        "explain your process", "do you offer consulting", "when was think41 founded",
+        "how are you different", "what is your pricing", "can i apply for a job", "more info please",
+    ],
+}
+
+class Intent:
+    """
+    The intent of one chat turn, with the values extracted for it (the search
+    term of YOUTUBE, the page_name of NAVIGATE) and where it came from.
+    """
+    __slots__ = ('name', 'confidence', 'source', 'search_term', 'page_name')
+
+    def __init__(self, name, confidence=1.0, source='rule', search_term=None, page_name=None):
+        self.name = name
+        self.confidence = confidence
+        self.source = source
+        self.search_term = search_term
+        self.page_name = page_name
+
+    def __repr__(self):
+        return f"Intent({self.name!r}, confidence={self.confidence:.2f}, source={self.source!r})"
+
+class IntentClassifier:
+    """
+    Multinomial naive Bayes over the words of the normalized input, trained at
+    startup on a few dozen labelled utterances. It scores a short input in
+    microseconds and needs no dependency or model file.
+
+    Inputs containing words it has never seen get no prediction: an unfamiliar
+    word is more likely a topic the user is asking about than small talk.
+
+    Probabilities of one- and two-word inputs stay modest ("yo" is a greeting
+    with about 0.5), since every intent has seen some of their words; they are
+    only meaningful relative to each other.
+    """
+    def __init__(self, examples, alpha=0.5):
+        self.alpha = alpha
+        self.word_counts = {intent: Counter() for intent in examples}
+        for intent, utterances in examples.items():
+            for utterance in utterances:
+                self.word_counts[intent].update(normalize_query(utterance).split())
+        self.vocabulary = set().union(*self.word_counts.values())
+        total_examples = sum(len(utterances) for utterances in examples.values())
+        self.log_priors = {intent: math.log(len(utterances) / total_examples) for intent, utterances in examples.items()}
+        self.totals = {intent: sum(counts.values()) for intent, counts in self.word_counts.items()}
+
+    def predict(self, text):
+        """
+        Returns:
+            tuple: (intent, probability), or (None, 0.0) for an empty input or one
+            with words outside the vocabulary.
+        """
+        words = normalize_query(text).split()
+        if not words or any(word not in self.vocabulary for word in words):
+            return None, 0.0
+
+        scores = {}
+        for intent, counts in self.word_counts.items():
+            denominator = self.totals[intent] + self.alpha * len(self.vocabulary)
+            scores[intent] = self.log_priors[intent] + sum(
+                math.log((counts[word] + self.alpha) / denominator) for word in words
+            )
+        best = max(scores, key=scores.get)
+        # Softmax over the log scores
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+    def exclusive_words(self, intent):
+        """
+        Returns the words seen in the examples of `intent` and of no other intent.
+        """
+        others = set().union(*(counts for other, counts in self.word_counts.items() if other != intent))
+        return set(self.word_counts[intent]) - others
+
+class IntentRouter:
+    """
+    Classifies chat turns in-process, in front of GPTAssistant, so that only real
+    knowledge questions pay for retrieval and an LLM completion.
+
+    Rules come first: greetings, thanks and goodbyes that make up the whole turn,
+    "play X on youtube" and "go to the <page> page". Turns of at most `max_words`
+    words the rules do not match go to the local classifier, whose canned intents
+    are only accepted with at least `min_confidence`, unless the turn contains a
+    topic word: one the classifier has only seen in QUESTION examples ("hiring",
+    "services", "cost"). Everything else is a QUESTION.
+    """
+    def __init__(self, classifier=None, min_confidence=0.5, max_words=6):
+        self.classifier = classifier or IntentClassifier(TRAINING_EXAMPLES)
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.topic_words = self.classifier.exclusive_words(QUESTION)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            min_confidence=settings.INTENT_ROUTER_MIN_CONFIDENCE,
+            max_words=settings.INTENT_ROUTER_MAX_WORDS,
+        )
+
+    def classify(self, user_input):
+        """
+        Returns the `Intent` of a chat turn.
+        """
+        search_term = extract_yt_term(user_input or "")
+        if search_term:
+            return Intent(YOUTUBE, search_term=search_term)
+
+        normalized = normalize_query(user_input)
+        if not normalized:
+            return Intent(QUESTION)
+        match = NAVIGATION_RULE.match(normalized)
+        if match:
+            return Intent(NAVIGATE, page_name=_page_aliases[match.group('page')])
+        for intent, rule in RULES:
+            if rule.match(normalized):
+                return Intent(intent)
+
+        words = normalized.split()
+        if len(words) <= self.max_words and self.topic_words.isdisjoint(words):
+            intent, confidence = self.classifier.predict(normalized)
+            if intent in CANNED_INTENTS and confidence >= self.min_confidence:
+                return Intent(intent, confidence=confidence, source='model')
+        return Intent(QUESTION, source='default')
+
+    def route(self, user_input):
+        """
+        Answers a chat turn directly when its intent allows it.
+
+        Returns:
+            dict: The chat response, with 'has_more_info' False and the 'intent',
+            plus 'youtube_url' for YOUTUBE and 'page_name' for NAVIGATE; or None
+            when the turn has to go to GPTAssistant.
+        """
+        with span('intent'):
+            intent = self.classify(user_input)
+        if intent.name == QUESTION:
+            return None
+        url = get_youtube_url(intent.search_term) if intent.name == YOUTUBE else None
+        return self.respond(intent, url)
+
+    async def aroute(self, user_input):
+        """
+        Async counterpart of `route`.
+        """
+        with span('intent'):
+            intent = self.classify(user_input)
+        if intent.name == QUESTION:
+            return None
+        url = await aget_youtube_url(intent.search_term) if intent.name == YOUTUBE else None
+        return self.respond(intent, url)
+
+    def respond(self, intent, youtube_url=None):
+        logger.info("Routed chat turn locally: %r", intent, extra=CHAT_LOG)
+        response = {'has_more_info': False, 'intent': intent.name}
+        if intent.name == YOUTUBE:
+            if youtube_url:
+                response.update(response=f"Playing {intent.search_term} on YouTube.", youtube_url=youtube_url)
+            else:
+                response['response'] = f"Sorry, I couldn't find {intent.search_term} on YouTube right now."
+        elif intent.name == NAVIGATE:
+            title = PAGE_TITLES.get(intent.page_name, intent.page_name.replace('-', ' ').title())
+            response.update(response=f"Taking you to the {title} page.", page_name=intent.page_name)
+        else:
+            response['response'] = random.choice(CANNED_RESPONSES[intent.name])
+        return response
+
+def routed_events(response):
+    """
+    The stream events of a locally routed turn: its text as a token and a
+    sentence, then the 'done' event carrying the whole response.
+    """
+    return [
+        {'type': 'token', 'text': response['response']},
+        {'type': 'sentence', 'text': response['response']},
+        {'type': 'done', **response},
+    ]
+
+def record_routed_turn(user_input, session_id, response, streamed=False):
+    """
+    Does for a locally routed turn what GPTAssistant does for the turns it
+    answers: appends the exchange to the session's history and queues its
+    ChatQueryLog row.
+    """
+    if session_id:
+        get_conversation_store().record_exchange(session_id, user_input, response['response'])
+    measurements = {'retrieved_ids': [], 'retrieval_ms': None, 'answer_cache_hit': False, 'llm_ms': None, 'prompt_tokens': 0}
+    record_interaction(ENDPOINT_CHAT, user_input, ROUTER_MODEL_NAME, measurements, streamed=streamed)
+
+_intent_router = None
+_intent_router_lock = threading.Lock()
+
+def get_intent_router():
+    """
+    Returns the process-wide `IntentRouter`, creating it on first use.
+    """
+    global _intent_router
+    if _intent_router is None:
+        with _intent_router_lock:
+            if _intent_router is None:
+                _intent_router = IntentRouter.from_settings()
+    return _intent_router
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import threading
+import weakref
+import httpx
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class ProviderClientRegistry:
+    """
+    Process-wide registry of keep-alive HTTP clients for the LLM providers.
+
+    One client is kept per (client kind, provider, base URL), so every chat message
+    reuses pooled TCP+TLS connections instead of handshaking with the provider again.
+    Async clients are additionally kept per event loop, because an httpx connection
+    pool cannot be shared between loops. They are held in a weak mapping from the
+    loop, and the clients of closed loops are dropped, so short-lived loops (e.g.
+    `asyncio.run` in a thread) neither leak clients nor hand them to a new loop
+    that reuses the id of a dead one.
+    """
+    def __init__(self, pool_size=20, connect_timeout=5.0, read_timeout=60.0, keepalive_expiry=60.0):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._clients = {}
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            pool_size=settings.LLM_POOL_SIZE,
+            connect_timeout=settings.LLM_CONNECT_TIMEOUT,
+            read_timeout=settings.LLM_READ_TIMEOUT,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        )
+
+    @property
+    def requests_timeout(self):
+        """
+        The (connect, read) timeout tuple to pass to `requests`.
+        """
+        return (self.connect_timeout, self.read_timeout)
+
+    def _httpx_timeout(self):
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def _httpx_limits(self):
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _get_or_create(self, key, factory, loop=None):
+        stats_key = f"{key[0]}:{key[1]}:{key[2]}"
+        with self._lock:
+            stats = self._stats.setdefault(stats_key, {'hits': 0, 'misses': 0})
+            clients = self._clients if loop is None else self._clients_for_loop(loop)
+            client = clients.get(key)
+            if client is not None:
+                stats['hits'] += 1
+                return client
+            stats['misses'] += 1
+            client = factory()
+            clients[key] = client
+            logger.info("Created pooled %s client for %s at %s", key[0], key[1], key[2])
+            return client
+
+    def _clients_for_loop(self, loop):
+        clients = self._loop_clients.get(loop)
+        if clients is None:
+            for closed in [other for other in self._loop_clients if other.is_closed()]:
+                del self._loop_clients[closed]
+            clients = self._loop_clients[loop] = {}
+        return clients
+
+    def session(self, provider, base_url):
+        """
+        Returns a pooled `requests.Session` for the provider's base URL.
+        """
+        def factory():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            return session
+        return self._get_or_create(('session', provider, base_url), factory)
+
+    def async_client(self, provider, base_url):
+        """
+        Returns a pooled `httpx.AsyncClient` for the provider's base URL, bound to
+        the running event loop.
+        """
+        return self._get_or_create(
+            ('async_client', provider, base_url),
+            lambda: httpx.AsyncClient(timeout=self._httpx_timeout(), limits=self._httpx_limits()),
+            loop=asyncio.get_running_loop(),
+        )
+
+    def openai_client(self, provider, api_key, base_url):
+        """
+        Returns a shared `openai.OpenAI` client backed by a pooled httpx client.
+        """
+        return self._get_or_create(
+            ('openai', provider, base_url),
+            lambda: openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=self._httpx_timeout(),
+                http_client=httpx.Client(timeout=self._httpx_timeout(), limits=self._httpx_limits()),
+            ),
+        )
+
+    def async_openai_client(self, provider, api_key, base_url):
+        """
+        Returns a shared `openai.AsyncOpenAI` client for the running event loop.
+        """
+        return self._get_or_create(
+            ('async_openai', provider, base_url),
+            lambda: openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=self._httpx_timeout(),
+                http_client=httpx.AsyncClient(timeout=self._httpx_timeout(), limits=self._httpx_limits()),
+            ),
+            loop=asyncio.get_running_loop(),
+        )
+
+    def stats(self):
+        """
+        Returns the registry hit/miss counters per client kind, provider and base URL.
+        """
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'clients': len(self._clients) + sum(len(clients) for clients in self._loop_clients.values()),
+                'pools': {key: dict(value) for key, value in self._stats.items()},
+            }
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_client_registry():
+    """
+    Returns the process-wide `ProviderClientRegistry`, creating it on first use.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ProviderClientRegistry.from_settings()
+    return _registry
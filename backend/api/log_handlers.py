@@ -0,0 +1,69 @@
+import sys
+import atexit
+import random
+import logging
+from queue import Queue, Full
+from logging.handlers import QueueHandler, QueueListener
+from django.conf import settings
+
+# `extra` for log records of each sampled category, see LOG_SAMPLE_RATES
+CHAT_LOG = {'category': 'chat'}
+SEARCH_LOG = {'category': 'search'}
+PROMPT_LOG = {'category': 'prompt'}
+LLM_LOG = {'category': 'llm'}
+PAYLOAD_LOG = {'category': 'payload'}
+
+def verbose_payloads():
+    """
+    Whether prompts, provider requests and provider responses may be logged.
+    Call sites check this before building the payload at all.
+    """
+    return settings.LOG_VERBOSE_PAYLOADS
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records of each category (the `category`
+    attribute set through `extra`). Warnings and errors, and records without a
+    category or with an unlisted one, are always kept.
+    """
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'category', None))
+        return rate is None or random.random() < rate
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Hands records to a background thread that formats and writes them, so a
+    request never waits on the log stream.
+
+    Records are queued as they are: the message is only interpolated from its
+    %-style arguments by the listener thread, and only for records that passed
+    the level check and this handler's filters. When the queue is full, records
+    are dropped (and counted) rather than blocking the caller.
+    """
+    def __init__(self, maxsize=10000, stream=None):
+        super().__init__(Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The queue never leaves the process, so the record needs no pickling-safe copy
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.conf import settings
+from api.models import UniversalContent
+from api.gpt_assistant import GPTAssistant
+
+TABLE = UniversalContent._meta.db_table
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+class Command(BaseCommand):
+    help = 'Benchmark search_relevant_content: latency percentiles, SQL queries, index usage and recall@k'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'think41_queries.json'),
+                            help='JSON list of {"query", "relevant_titles"}')
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per query')
+        parser.add_argument('--backend', choices=['postgres', 'bm25', 'hybrid'], help='Override SEARCH_BACKEND')
+        parser.add_argument('--with-cache', action='store_true', help='Leave the retrieval cache enabled')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'retrieval_baseline.json'),
+                            help='JSON file of the baseline report of each backend')
+        parser.add_argument('--save-baseline', action='store_true', help="Store this run as the backend's baseline")
+        parser.add_argument('--latency-tolerance', type=float, default=0.25, help='Allowed relative p95 increase')
+        parser.add_argument('--recall-tolerance', type=float, default=0.02, help='Allowed absolute recall@k drop')
+
+    def handle(self, *args, **options):
+        with open(options['queries']) as f:
+            labelled = json.load(f)
+        if not labelled:
+            raise CommandError(f"No labelled queries in {options['queries']}")
+
+        backend = options['backend'] or settings.SEARCH_BACKEND
+        # Per-result logging would dominate the timings
+        logging.getLogger('api.gpt_assistant').setLevel(logging.WARNING)
+        with override_settings(SEARCH_BACKEND=backend, RETRIEVAL_CACHE_ENABLED=options['with_cache']):
+            report = self._run(labelled, backend, options)
+
+        self._print_report(report)
+
+        baseline_path = options['baseline']
+        baselines = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baselines = json.load(f)
+
+        if options['save_baseline']:
+            baselines[backend] = report
+            with open(baseline_path, 'w') as f:
+                json.dump(baselines, f, indent=4, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Saved the {backend} baseline to {baseline_path}'))
+            return
+
+        if backend not in baselines:
+            # Without a baseline nothing is checked, which must not pass for a green run
+            raise CommandError(
+                f"No {backend} baseline in {baseline_path}; run with --save-baseline on the reference database to store one"
+            )
+        self._compare(report, baselines[backend], options)
+
+    def _run(self, labelled, backend, options):
+        k = options['k']
+        assistant = GPTAssistant()
+        latencies, query_counts, recalls = [], [], []
+        plans = {'index_scans': {}, 'seq_scans': 0, 'explained': 0}
+
+        # Warm up: loads in-memory indexes and connections outside the timings
+        for item in labelled:
+            assistant.search_relevant_content(item['query'])
+
+        for item in labelled:
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    results = assistant.search_relevant_content(item['query'])
+                    latencies.append((time.perf_counter() - started) * 1000)
+                query_counts.append(len(captured.captured_queries))
+
+            relevant = set(item['relevant_titles'])
+            found = {result.title for result in results[:k]}
+            recalls.append(len(found & relevant) / len(relevant))
+
+            if backend != 'bm25':
+                self._explain(assistant, item['query'], k, plans)
+
+        return {
+            'backend': backend,
+            'rows': UniversalContent.objects.count(),
+            'queries': len(labelled),
+            'k': k,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'sql_queries_per_search': round(sum(query_counts) / len(query_counts), 2),
+            'index_usage': round(1 - plans['seq_scans'] / plans['explained'], 3) if plans['explained'] else None,
+            'index_scans': plans['index_scans'],
+            'recall_at_k': round(sum(recalls) / len(recalls), 4),
+        }
+
+    def _explain(self, assistant, query, k, plans):
+        """
+        Records which indexes the ranking query's plan uses, and whether it
+        falls back to a sequential scan of the content table.
+        """
+        queryset = assistant._search_queryset(query.lower().strip())[:k]
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        plans['explained'] += 1
+        for node in plan_nodes(plan):
+            if node['Node Type'] in INDEX_SCANS:
+                name = node.get('Index Name', '?')
+                plans['index_scans'][name] = plans['index_scans'].get(name, 0) + 1
+            elif node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == TABLE:
+                plans['seq_scans'] += 1
+
+    def _print_report(self, report):
+        self.stdout.write(f"Backend {report['backend']}, {report['rows']} rows, {report['queries']} queries, k={report['k']}")
+        self.stdout.write(f"  latency ms     p50 {report['p50_ms']}  p95 {report['p95_ms']}  p99 {report['p99_ms']}")
+        self.stdout.write(f"  SQL queries    {report['sql_queries_per_search']} per search")
+        if report['index_usage'] is not None:
+            self.stdout.write(f"  index usage    {report['index_usage']:.1%} of plans without a sequential scan")
+            for name, count in sorted(report['index_scans'].items()):
+                self.stdout.write(f"    {name}: {count}")
+        self.stdout.write(f"  recall@{report['k']}       {report['recall_at_k']:.3f}")
+
+    def _compare(self, report, baseline, options):
+        if (baseline.get('rows'), baseline.get('k')) != (report['rows'], report['k']):
+            self.stdout.write(self.style.WARNING(
+                f"Baseline was taken with {baseline.get('rows')} rows and k={baseline.get('k')}; "
+                "results are not directly comparable"
+            ))
+
+        regressions = []
+        max_p95 = baseline['p95_ms'] * (1 + options['latency_tolerance'])
+        if report['p95_ms'] > max_p95:
+            regressions.append(f"p95 latency {report['p95_ms']}ms exceeds {max_p95:.3f}ms")
+        if report['recall_at_k'] < baseline['recall_at_k'] - options['recall_tolerance']:
+            regressions.append(f"recall@k {report['recall_at_k']} is below baseline {baseline['recall_at_k']}")
+        if report['sql_queries_per_search'] > baseline['sql_queries_per_search']:
+            regressions.append(
+                f"{report['sql_queries_per_search']} SQL queries per search, baseline {baseline['sql_queries_per_search']}"
+            )
+        if baseline.get('index_usage') is not None and report['index_usage'] is not None \
+                and report['index_usage'] < baseline['index_usage']:
+            regressions.append(f"index usage {report['index_usage']} is below baseline {baseline['index_usage']}")
+
+        if regressions:
+            raise CommandError("Retrieval regressed against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from api.models import UniversalContent
+from api.chunking import rebuild_passages
+
+class Command(BaseCommand):
+    help = 'Split UniversalContent into overlapping passages for passage retrieval'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-tokens', type=int, default=settings.PASSAGE_MAX_TOKENS, help='Maximum tokens per passage')
+        parser.add_argument('--overlap-tokens', type=int, default=settings.PASSAGE_OVERLAP_TOKENS, help='Tokens repeated from the previous passage')
+
+    def handle(self, *args, **options):
+        rows = passages = 0
+        for content in UniversalContent.objects.only('id', 'title', 'content', 'content_type').iterator():
+            passages += len(rebuild_passages(content, options['max_tokens'], options['overlap_tokens']))
+            rows += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully split {rows} rows into {passages} passages'))
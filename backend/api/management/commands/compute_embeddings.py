@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from api.models import UniversalContent
+from api.embeddings import get_embedder, to_bytes, embedding_text
+from api.retrieval_cache import get_retrieval_cache
+
+class Command(BaseCommand):
+    help = 'Compute UniversalContent embeddings in batches for hybrid search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=64, help='Rows embedded per batch')
+        parser.add_argument('--missing-only', action='store_true', help='Only embed rows without an embedding')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        embedder = get_embedder()
+        queryset = UniversalContent.objects.order_by('id')
+        if options['missing_only']:
+            queryset = queryset.filter(embedding=None)
+        total = queryset.count()
+        self.stdout.write(f'Embedding {total} rows with {type(embedder).__name__} ({embedder.dimensions} dimensions)...')
+
+        batch, done = [], 0
+        for content in queryset.only('id', 'title', 'content').iterator(chunk_size=batch_size):
+            batch.append(content)
+            if len(batch) >= batch_size:
+                done += self._embed_batch(embedder, batch)
+                self.stdout.write(f'  {done}/{total}')
+                batch = []
+        if batch:
+            done += self._embed_batch(embedder, batch)
+
+        # Bulk updates send no signals; cached retrievals were ranked on the old data
+        get_retrieval_cache().bump_version()
+        self.stdout.write(self.style.SUCCESS(f'Successfully embedded {done} rows'))
+
+    def _embed_batch(self, embedder, batch):
+        vectors = embedder.embed([embedding_text(content) for content in batch])
+        for content, vector in zip(batch, vectors):
+            content.embedding = to_bytes(vector)
+        UniversalContent.objects.bulk_update(batch, ['embedding'])
+        return len(batch)
@@ -0,0 +1,98 @@
+import json
+import os
+import random
+from itertools import accumulate
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection
+from api.models import UniversalContent, ContentPassage
+from api.prompt_builder import count_tokens
+from api.retrieval_cache import get_retrieval_cache
+
+SYNTHETIC_CONTENT_TYPE = 'synthetic'
+TOPICS = [
+    'cloud', 'platform', 'analytics', 'security', 'payments', 'logistics', 'health', 'retail',
+    'banking', 'insurance', 'energy', 'media', 'education', 'travel', 'telecom', 'gaming',
+    'agents', 'pipelines', 'observability', 'compliance',
+]
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'te', 'su', 'no', 'vi', 'ze', 'pa', 'do', 'ri', 'fu', 'ge', 'ho', 'ja', 'ny', 'qu', 'tr', 'bl']
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic UniversalContent corpus and a labelled query set for benchmark_retrieval'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows to generate (100 to 1,000,000)')
+        parser.add_argument('--queries', type=int, default=200, help='Labelled queries to write')
+        parser.add_argument('--labels', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'synthetic_queries.json'), help='Where to write the labelled queries')
+        parser.add_argument('--seed', type=int, default=41)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated rows first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = self._vocabulary(rng)
+        # Zipf-like word frequencies, so that common words behave like stopwords do in real text
+        cum_weights = list(accumulate(1.0 / rank for rank in range(1, len(vocabulary) + 1)))
+        # Title words come from the rare end of the vocabulary, so titles are near-unique
+        rare_words = vocabulary[len(vocabulary) // 2:]
+
+        if options['clear']:
+            self._clear()
+
+        rows, batch_size = options['rows'], options['batch_size']
+        sample = set(rng.sample(range(rows), min(options['queries'], rows)))
+        labels = []
+        self.stdout.write(f'Generating {rows} synthetic rows...')
+
+        for start in range(0, rows, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, rows)):
+                topic = rng.choice(TOPICS)
+                name = rng.sample(rare_words, 2)
+                title = f"{topic.title()} {name[0].title()} {name[1].title()}"
+                sentences = [
+                    " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(8, 15))).capitalize() + "."
+                    for _ in range(rng.randint(3, 8))
+                ]
+                sentences.insert(rng.randint(0, len(sentences)), f"The {topic} work of {name[0]} {name[1]} is described here.")
+                content = " ".join(sentences)
+                batch.append(UniversalContent(
+                    title=title,
+                    content=content,
+                    content_type=SYNTHETIC_CONTENT_TYPE,
+                    metadata={'synthetic': True, 'topic': topic},
+                    token_count=count_tokens(f"{title}\n{content}"),
+                ))
+                if i in sample:
+                    labels.append({'query': f"{name[0]} {name[1]} {topic}", 'relevant_titles': [title]})
+            # bulk_create skips save() and the signals; the database trigger still fills search_vector
+            UniversalContent.objects.bulk_create(batch)
+            self.stdout.write(f'  {min(start + batch_size, rows)}/{rows}')
+
+        get_retrieval_cache().bump_version()
+
+        os.makedirs(os.path.dirname(options['labels']) or '.', exist_ok=True)
+        with open(options['labels'], 'w') as f:
+            json.dump(labels, f, indent=4)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully generated {rows} rows and {len(labels)} labelled queries in {options['labels']}"
+        ))
+
+    def _vocabulary(self, rng):
+        words = {
+            "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(20000)
+        }
+        return sorted(words)
+
+    def _clear(self):
+        # Raw deletes: going through the ORM would collect and signal every row
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {ContentPassage._meta.db_table} WHERE source_id IN "
+                f"(SELECT id FROM {UniversalContent._meta.db_table} WHERE content_type = %s)",
+                [SYNTHETIC_CONTENT_TYPE]
+            )
+            cursor.execute(f"DELETE FROM {UniversalContent._meta.db_table} WHERE content_type = %s", [SYNTHETIC_CONTENT_TYPE])
+            self.stdout.write(f'Deleted {cursor.rowcount} synthetic rows')
@@ -0,0 +1,153 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+ENDPOINTS = {
+    'chat': '/api/chat/',
+    'chat-stream': '/api/chat/stream/',
+    'website': '/api/website-interaction/',
+    'website-stream': '/api/website-interaction/stream/',
+}
+DEFAULT_QUESTIONS = [
+    "Who founded Think41?",
+    "What services does Think41 offer?",
+    "What are Autopods?",
+    "How is Think41 funded?",
+    "Tell me about HashedIn",
+    "Where are the founders based?",
+    "How do I apply for a job?",
+    "Who are your clients?",
+]
+
+# The chat and website endpoints answer with an apology, with status 200, when
+# the model fails (see GPTAssistant.finalize_response and website_call.FALLBACK_RESPONSE)
+FAILURE_MARKER = "I'm having trouble generating a response"
+
+def answer_failure(body, stream):
+    """
+    Returns why a successful HTTP response still carries a failed answer, or None.
+
+    Args:
+        body (bytes): The response body.
+        stream (bool): Whether the body is a Server-Sent Events stream.
+    """
+    try:
+        if stream:
+            done = [
+                block for block in body.decode().split('\n\n')
+                if block.startswith('event: done\n')
+            ]
+            if not done:
+                return 'no done event'
+            payload = json.loads(done[-1].split('data: ', 1)[1])
+        else:
+            payload = json.loads(body)
+    except (UnicodeDecodeError, IndexError, ValueError):
+        return 'malformed body'
+    if FAILURE_MARKER in (payload.get('response') or ''):
+        return 'fallback answer'
+    return None
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Command(BaseCommand):
+    help = (
+        'Load-test a running backend at increasing concurrency and report throughput, latency '
+        'percentiles and error rates, counting fallback answers as errors. Run it against stub providers (see stub_llm_server).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='chat')
+        parser.add_argument('--concurrency', default='1,4,16,64', help='Comma-separated concurrency levels')
+        parser.add_argument('--duration', type=float, default=20.0, help='Seconds per concurrency level')
+        parser.add_argument('--model-name', help='model_name sent with each request')
+        parser.add_argument('--questions', help='File with one question per line')
+        parser.add_argument('--unique', action='store_true',
+                            help='Make every question unique, defeating the answer cache and request coalescing')
+        parser.add_argument('--timeout', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        # httpx logs every request at INFO
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        questions = DEFAULT_QUESTIONS
+        if options['questions']:
+            with open(options['questions']) as f:
+                questions = [line.strip() for line in f if line.strip()]
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of integers')
+
+        url = options['base_url'].rstrip('/') + ENDPOINTS[options['endpoint']]
+        self.stdout.write(f"Load testing {url} for {options['duration']}s per level")
+        self.stdout.write(f"{'conc':>5} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttfb p50':>9} {'errors':>7}")
+        for concurrency in levels:
+            result = asyncio.run(self._run_level(url, concurrency, questions, options))
+            self._print_level(concurrency, result)
+
+    async def _run_level(self, url, concurrency, questions, options):
+        stream = options['endpoint'].endswith('stream')
+        question_cycle = itertools.cycle(questions)
+        deadline = time.monotonic() + options['duration']
+        latencies, first_bytes, errors = [], [], []
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(timeout=options['timeout'], limits=limits) as client:
+            async def worker():
+                while time.monotonic() < deadline:
+                    question = next(question_cycle)
+                    if options['unique']:
+                        question = f"{question} ({uuid.uuid4().hex[:8]})"
+                    payload = {'user_input': question}
+                    if options['model_name']:
+                        payload['model_name'] = options['model_name']
+                    started = time.monotonic()
+                    try:
+                        async with client.stream('POST', url, json=payload) as response:
+                            first_byte = None
+                            body = bytearray()
+                            async for chunk in response.aiter_bytes():
+                                if first_byte is None:
+                                    first_byte = time.monotonic() - started
+                                body.extend(chunk)
+                            if response.status_code >= 400:
+                                errors.append(response.status_code)
+                                continue
+                            failure = answer_failure(bytes(body), stream)
+                            if failure:
+                                errors.append(failure)
+                                continue
+                        latencies.append(time.monotonic() - started)
+                        if stream and first_byte is not None:
+                            first_bytes.append(first_byte)
+                    except httpx.HTTPError as e:
+                        errors.append(type(e).__name__)
+
+            started = time.monotonic()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.monotonic() - started
+
+        return {'latencies': latencies, 'first_bytes': first_bytes, 'errors': errors, 'elapsed': elapsed}
+
+    def _print_level(self, concurrency, result):
+        latencies = result['latencies']
+        total = len(latencies) + len(result['errors'])
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f"{concurrency:>5} {total:>7} no successful requests, errors: {result['errors'][:5]}"))
+            return
+        ms = lambda seconds: f"{seconds * 1000:.0f}"
+        ttfb = ms(percentile(result['first_bytes'], 0.5)) if result['first_bytes'] else '-'
+        error_rate = len(result['errors']) / total
+        self.stdout.write(
+            f"{concurrency:>5} {total:>7} {len(latencies) / result['elapsed']:>8.1f} "
+            f"{ms(percentile(latencies, 0.5)):>8} {ms(percentile(latencies, 0.95)):>8} {ms(percentile(latencies, 0.99)):>8} "
+            f"{ttfb:>9} {error_rate:>7.1%}"
+        )
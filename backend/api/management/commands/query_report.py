@@ -0,0 +1,68 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from api.models import ChatQueryLog
+
+def format_ms(value):
+    return f"{value:.0f}ms" if value is not None else "-"
+
+class Command(BaseCommand):
+    help = 'Report the most frequent and the slowest chat queries recorded in the ChatQueryLog table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Only include interactions of the last N days')
+        parser.add_argument('--limit', type=int, default=10, help='Queries per list')
+        parser.add_argument('--endpoint', choices=[choice for choice, _ in ChatQueryLog.ENDPOINT_CHOICES])
+
+    def handle(self, *args, **options):
+        logs = ChatQueryLog.objects.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['endpoint']:
+            logs = logs.filter(endpoint=options['endpoint'])
+
+        totals = logs.aggregate(
+            interactions=Count('id'),
+            cache_hits=Count('id', filter=Q(answer_cache_hit=True)),
+            avg_retrieval_ms=Avg('retrieval_ms'),
+            avg_llm_ms=Avg('llm_ms'),
+            avg_prompt_tokens=Avg('prompt_tokens', filter=Q(answer_cache_hit=False)),
+        )
+        if not totals['interactions']:
+            self.stdout.write(self.style.WARNING(f"No interactions recorded in the last {options['days']:g} days"))
+            return
+
+        self.stdout.write(
+            f"{totals['interactions']} interactions in the last {options['days']:g} days, "
+            f"answer cache hit rate {totals['cache_hits'] / totals['interactions']:.0%}, "
+            f"avg retrieval {format_ms(totals['avg_retrieval_ms'])}, avg LLM {format_ms(totals['avg_llm_ms'])}, "
+            f"avg prompt tokens {totals['avg_prompt_tokens'] or 0:.0f}"
+        )
+
+        per_query = logs.annotate(
+            total_ms=Coalesce('retrieval_ms', Value(0.0)) + Coalesce('llm_ms', Value(0.0))
+        ).values('normalized_query').annotate(
+            count=Count('id'),
+            cache_hits=Count('id', filter=Q(answer_cache_hit=True)),
+            avg_retrieval_ms=Avg('retrieval_ms'),
+            avg_llm_ms=Avg('llm_ms'),
+            avg_total_ms=Avg('total_ms'),
+            max_total_ms=Max('total_ms'),
+        )
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nMost frequent queries'))
+        for row in per_query.order_by('-count', '-avg_total_ms')[:options['limit']]:
+            self.stdout.write(
+                f"  {row['count']:>6}  cache hits {row['cache_hits'] / row['count']:>4.0%}  "
+                f"avg {format_ms(row['avg_total_ms']):>8}  {row['normalized_query']}"
+            )
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nSlowest queries (by average retrieval + LLM time)'))
+        for row in per_query.order_by('-avg_total_ms', '-count')[:options['limit']]:
+            self.stdout.write(
+                f"  avg {format_ms(row['avg_total_ms']):>8}  max {format_ms(row['max_total_ms']):>8}  "
+                f"retrieval {format_ms(row['avg_retrieval_ms']):>7}  LLM {format_ms(row['avg_llm_ms']):>8}  "
+                f"x{row['count']:<5} {row['normalized_query']}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"\nSuccessfully reported on {totals['interactions']} interactions"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from api.models import UniversalContent, weighted_search_vector
+from api.retrieval_cache import get_retrieval_cache
+
+class Command(BaseCommand):
+    help = 'Rebuild UniversalContent.search_vector in batches (title weighted above content)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows updated per UPDATE statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(UniversalContent.objects.order_by('id').values_list('id', flat=True))
+        self.stdout.write(f'Reindexing search vectors for {len(ids)} rows...')
+
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            UniversalContent.objects.filter(id__in=batch).update(search_vector=weighted_search_vector())
+            self.stdout.write(f'  {start + len(batch)}/{len(ids)}')
+
+        # Bulk updates send no signals; cached retrievals were ranked on the old data
+        get_retrieval_cache().bump_version()
+        self.stdout.write(self.style.SUCCESS('Successfully reindexed search vectors'))
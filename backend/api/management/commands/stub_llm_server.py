@@ -0,0 +1,170 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from api.prompt_builder import count_tokens
+
+WORDS = (
+    "Think41 builds custom software on a subscription with Autopods, cross functional teams "
+    "of engineers and product managers working alongside Gen AI agents to deliver products faster"
+).split()
+
+class StubBehaviour:
+    """
+    Latency and failure model of the stub provider.
+
+    Latency is drawn per request from a fixed, uniform (median +- jitter) or
+    lognormal (median, sigma=jitter) distribution; a fraction `error_rate` of
+    requests fail with a 500 or 429.
+    """
+    def __init__(self, latency='lognormal', latency_ms=400.0, jitter=0.5, error_rate=0.0,
+                 tokens_per_second=80.0, response_words=60, seed=None):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self.response_words = response_words
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            if self.latency == 'fixed':
+                return self.latency_ms / 1000
+            if self.latency == 'uniform':
+                spread = self.latency_ms * self.jitter
+                return max(0.0, self._rng.uniform(self.latency_ms - spread, self.latency_ms + spread)) / 1000
+            return self._rng.lognormvariate(0, self.jitter) * self.latency_ms / 1000
+
+    def failure(self):
+        with self._lock:
+            if self._rng.random() >= self.error_rate:
+                return None
+            return self._rng.choice([500, 429])
+
+    def answer(self):
+        with self._lock:
+            return " ".join(self._rng.choice(WORDS) for _ in range(self.response_words)) + "."
+
+def make_handler(behaviour, log):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            if log:
+                super().log_message(format, *args)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                return self._json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError:
+                return self._json(400, {'error': {'message': 'Invalid JSON'}})
+
+            time.sleep(behaviour.delay())
+            status = behaviour.failure()
+            if status is not None:
+                return self._json(status, {'error': {'message': 'Injected failure', 'type': 'stub_error'}})
+
+            prompt = " ".join(str(message.get('content', '')) for message in request.get('messages', []))
+            answer = behaviour.answer()
+            usage = {
+                'prompt_tokens': count_tokens(prompt),
+                'completion_tokens': count_tokens(answer),
+                'prompt_tokens_details': {'cached_tokens': 0},
+            }
+            usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+            model = request.get('model', 'stub')
+            if request.get('stream'):
+                return self._stream(model, answer, usage)
+            return self._json(200, {
+                'id': f'chatcmpl-{uuid.uuid4().hex}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+
+        def _json(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, model, answer, usage):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            # No Content-Length: the connection is closed after the stream
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+            interval = 1 / behaviour.tokens_per_second if behaviour.tokens_per_second > 0 else 0
+            words = answer.split(' ')
+            for i, word in enumerate(words):
+                delta = word if i == 0 else f" {word}"
+                self._event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                             'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]})
+                time.sleep(interval)
+            self._event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                         'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _event(self, payload):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+    return StubHandler
+
+class Command(BaseCommand):
+    help = (
+        'Run a local stub of the OpenAI/Groq chat-completions API for load tests. Point GROQ_BASE_URL, '
+        'OPENAI_BASE_URL and LITE_BASE_URL at it, e.g. http://127.0.0.1:8089/v1'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'], default='lognormal',
+                            help='Distribution of the time to first token')
+        parser.add_argument('--latency-ms', type=float, default=400.0, help='Median time to first token')
+        parser.add_argument('--jitter', type=float, default=0.5, help='Relative spread (uniform) or sigma (lognormal)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500/429')
+        parser.add_argument('--tokens-per-second', type=float, default=80.0, help='Streaming speed')
+        parser.add_argument('--response-words', type=int, default=60)
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--log-requests', action='store_true')
+
+    def handle(self, *args, **options):
+        behaviour = StubBehaviour(
+            latency=options['latency'],
+            latency_ms=options['latency_ms'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            tokens_per_second=options['tokens_per_second'],
+            response_words=options['response_words'],
+            seed=options['seed'],
+        )
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(behaviour, options['log_requests']))
+        server.daemon_threads = True
+        self.stdout.write(self.style.SUCCESS(
+            f"Stub LLM server listening on http://{options['host']}:{options['port']}/v1 "
+            f"({options['latency']} latency, median {options['latency_ms']}ms, error rate {options['error_rate']})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
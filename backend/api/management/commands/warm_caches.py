@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from api.cache_warmup import load_questions, warm_caches, CACHED, WARMED, RETRIEVED, FAILED
+
+class Command(BaseCommand):
+    help = (
+        'Replay the top questions through the assistant to fill the retrieval and answer caches. '
+        'Answers reach the server processes through the shared cache (set REDIS_URL).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', default=settings.CACHE_WARMUP_QUESTIONS, help='File with one question per line')
+        parser.add_argument('--model-name', default=settings.DEFAULT_CHAT_MODEL)
+        parser.add_argument('--concurrency', type=int, default=settings.CACHE_WARMUP_CONCURRENCY,
+                            help='Questions in flight at once')
+        parser.add_argument('--retrieval-only', action='store_true', help='Only warm the retrieval caches, without LLM calls')
+        parser.add_argument('--min-coverage', type=float, default=0.0,
+                            help='Fail when fewer than this fraction of questions end up with a cached answer')
+
+    def handle(self, *args, **options):
+        try:
+            questions = load_questions(options['questions'])
+        except OSError as e:
+            raise CommandError(f"Could not read {options['questions']}: {e}")
+        if not questions:
+            raise CommandError(f"No questions in {options['questions']}")
+        if not settings.ANSWER_CACHE_ENABLED and not options['retrieval_only']:
+            self.stdout.write(self.style.WARNING('ANSWER_CACHE_ENABLED is off, only warming the retrieval caches'))
+
+        self.stdout.write(f"Warming caches for {len(questions)} questions with {options['model_name']}...")
+        report = warm_caches(questions, options['model_name'], options['concurrency'], options['retrieval_only'])
+
+        if options['verbosity'] > 1:
+            for question, outcome in report['outcomes'].items():
+                self.stdout.write(f"  {outcome:<9} {question}")
+        for question, outcome in report['outcomes'].items():
+            if outcome == FAILED:
+                self.stdout.write(self.style.WARNING(f"  failed: {question}"))
+
+        self.stdout.write(
+            f"{report[WARMED]} answers generated, {report[CACHED]} already cached, "
+            f"{report[RETRIEVED]} retrieval only, {report[FAILED]} failed in {report['seconds']}s"
+        )
+        if not options['retrieval_only'] and report['coverage'] < options['min_coverage']:
+            raise CommandError(f"Answer coverage {report['coverage']:.0%} is below {options['min_coverage']:.0%}")
+        self.stdout.write(self.style.SUCCESS(f"Successfully warmed caches, answer coverage {report['coverage']:.0%}"))
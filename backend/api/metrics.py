@@ -0,0 +1,322 @@
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+
+class Histogram:
+    """
+    Latency histogram with one series per combination of label values, exposed
+    in the Prometheus text format.
+    """
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def expose(self):
+        with self._lock:
+            series = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                      for key, value in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, value in sorted(series.items()):
+            labels = format_labels(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, value['buckets']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {value["count"]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {value['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {value['count']}")
+        return lines
+
+REQUEST_DURATION = Histogram(
+    'think41_request_duration_seconds', 'Time to serve a request, including any streamed body',
+    ('endpoint', 'provider'),
+)
+SPAN_DURATION = Histogram(
+    'think41_span_duration_seconds', 'Time spent in each stage of a request',
+    ('endpoint', 'provider', 'span'),
+)
+
+class RequestTimings:
+    """
+    Spans recorded while serving one request. They are turned into the
+    Server-Timing header and, once the request is complete, into histogram
+    observations labelled with the endpoint and the LLM provider that served it.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.endpoint = ''
+        self.provider = ''
+
+    def add(self, name, seconds, provider=None):
+        self.spans.append((name, seconds))
+        if provider:
+            self.provider = provider
+
+    def header(self, total=None):
+        # Repeated spans (e.g. one search per query of a batch) are summed
+        durations = {}
+        for name, seconds in self.spans:
+            durations[name] = durations.get(name, 0.0) + seconds
+        if total is not None:
+            durations['total'] = total
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items()]
+        if self.provider:
+            entries.append(f'provider;desc="{escape_label(self.provider)}"')
+        return ", ".join(entries)
+
+    def finish(self):
+        total = time.perf_counter() - self.started
+        for name, seconds in self.spans:
+            SPAN_DURATION.observe(seconds, endpoint=self.endpoint, provider=self.provider, span=name)
+        REQUEST_DURATION.observe(total, endpoint=self.endpoint, provider=self.provider)
+        return total
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+def record_span(name, seconds, provider=None):
+    """
+    Adds a span to the current request, or observes it directly when called
+    outside a request (management commands, background threads). `provider` may
+    be a callable, which is resolved now, once the span has ended.
+    """
+    if callable(provider):
+        provider = provider()
+    timings = _current_timings.get()
+    if timings is None:
+        SPAN_DURATION.observe(seconds, endpoint='', provider=provider or '', span=name)
+    else:
+        timings.add(name, seconds, provider)
+
+class SpanTiming:
+    """
+    The duration of one `span`, set when the span ends.
+    """
+    __slots__ = ('name', 'seconds')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = None
+
+    @property
+    def ms(self):
+        return self.seconds * 1000 if self.seconds is not None else None
+
+@contextmanager
+def span(name, provider=None):
+    """
+    Times the enclosed block as the span `name`. Yields a `SpanTiming` whose
+    duration is available once the block has exited.
+    """
+    timing = SpanTiming(name)
+    started = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.seconds = time.perf_counter() - started
+        record_span(name, timing.seconds, provider)
+
+def timed(name):
+    """
+    Decorator timing every call of a function or coroutine function as the span `name`.
+    """
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_stream(name, iterator, provider=None, timing=None):
+    """
+    Relays a stream, recording the time until it is exhausted as the span `name`,
+    and in `timing` (a `SpanTiming`) when given.
+    """
+    started = time.perf_counter()
+    try:
+        yield from iterator
+    finally:
+        seconds = time.perf_counter() - started
+        if timing is not None:
+            timing.seconds = seconds
+        record_span(name, seconds, provider)
+
+async def atimed_stream(name, iterator, provider=None, timing=None):
+    """
+    Async counterpart of `timed_stream`.
+    """
+    started = time.perf_counter()
+    try:
+        async for item in iterator:
+            yield item
+    finally:
+        seconds = time.perf_counter() - started
+        if timing is not None:
+            timing.seconds = seconds
+        record_span(name, seconds, provider)
+
+class ServerTimingMiddleware:
+    """
+    Collects the spans of each request, returns them in a Server-Timing header and
+    aggregates them into the histograms served by the metrics endpoint.
+
+    Streamed bodies are produced after the headers are sent, so the header of a
+    streaming response only carries the spans completed before the stream opened;
+    the histograms still receive every span, and a 'stream' span, once the body
+    has been consumed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self._process_response(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self._process_response(request, response, timings)
+
+    def _process_response(self, request, response, timings):
+        match = request.resolver_match
+        timings.endpoint = (match.url_name or match.view_name) if match else 'unmatched'
+        if response.streaming:
+            response['Server-Timing'] = timings.header()
+            if response.is_async:
+                response.streaming_content = self._aobserve_stream(response.streaming_content, timings)
+            else:
+                response.streaming_content = self._observe_stream(response.streaming_content, timings)
+        else:
+            response['Server-Timing'] = timings.header(total=timings.finish())
+        return response
+
+    def _observe_stream(self, content, timings):
+        # The body is iterated by the server after this middleware has returned,
+        # so the request's timings are reinstated around each chunk
+        started = time.perf_counter()
+        iterator = iter(content)
+        try:
+            while True:
+                token = _current_timings.set(timings)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _current_timings.reset(token)
+                yield chunk
+        finally:
+            timings.add('stream', time.perf_counter() - started)
+            timings.finish()
+
+    async def _aobserve_stream(self, content, timings):
+        started = time.perf_counter()
+        iterator = content.__aiter__()
+        try:
+            while True:
+                token = _current_timings.set(timings)
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _current_timings.reset(token)
+                yield chunk
+        finally:
+            timings.add('stream', time.perf_counter() - started)
+            timings.finish()
+
+def _sample_family(name, kind, documentation, samples):
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{{{format_labels(labels)}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+def render_metrics():
+    """
+    Renders this process's metrics in the Prometheus text exposition format.
+    Metrics are per process; with several workers, scrape each one.
+    """
+    from .llm_clients import get_client_registry
+    from .retrieval_cache import get_retrieval_cache
+
+    lines = REQUEST_DURATION.expose() + SPAN_DURATION.expose()
+
+    pool_stats = get_client_registry().stats()
+    lines += _sample_family('think41_llm_pool_size', 'gauge', 'Maximum connections per provider pool',
+                            [((), pool_stats['pool_size'])])
+    lines += _sample_family('think41_llm_pool_clients', 'gauge', 'Pooled provider clients held by this process',
+                            [((), pool_stats['clients'])])
+    lines += _sample_family(
+        'think41_llm_pool_lookups_total', 'counter', 'Provider client lookups that reused (hit) or created (miss) a pool',
+        [((('pool', pool), ('result', result)), counts[key])
+         for pool, counts in sorted(pool_stats['pools'].items())
+         for result, key in (('hit', 'hits'), ('miss', 'misses'))],
+    )
+
+    cache_stats = get_retrieval_cache().stats()
+    lines += _sample_family('think41_retrieval_cache_l1_entries', 'gauge', 'Entries in the in-process retrieval cache',
+                            [((), cache_stats['l1_entries'])])
+    lines += _sample_family(
+        'think41_retrieval_cache_lookups_total', 'counter', 'Retrieval cache lookups by outcome',
+        [((('result', result),), cache_stats[key])
+         for result, key in (('l1_hit', 'l1_hits'), ('l2_hit', 'l2_hits'), ('miss', 'misses'))],
+    )
+    return "\n".join(lines) + "\n"
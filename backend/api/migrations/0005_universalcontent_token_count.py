@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def backfill_token_counts(apps, schema_editor):
+    from api.prompt_builder import count_tokens
+
+    UniversalContent = apps.get_model('api', 'UniversalContent')
+    batch = []
+    for content in UniversalContent.objects.only('id', 'title', 'content').iterator(chunk_size=500):
+        content.token_count = count_tokens(f"{content.title}\n{content.content}")
+        batch.append(content)
+        if len(batch) >= 500:
+            UniversalContent.objects.bulk_update(batch, ['token_count'])
+            batch = []
+    if batch:
+        UniversalContent.objects.bulk_update(batch, ['token_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_auto_20240902_0739'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='universalcontent',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_token_counts, migrations.RunPython.noop),
+    ]
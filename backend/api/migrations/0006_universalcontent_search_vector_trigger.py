@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Keeps UniversalContent.search_vector up to date in the database: a trigger
+    recomputes it on every insert and on updates of title or content, with the
+    title weighted 'A' above the content's 'B'. Existing rows are backfilled.
+    """
+
+    dependencies = [
+        ('api', '0005_universalcontent_token_count'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE OR REPLACE FUNCTION api_universalcontent_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+                    setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS api_universalcontent_search_vector_trigger ON api_universalcontent;
+            CREATE TRIGGER api_universalcontent_search_vector_trigger
+                BEFORE INSERT OR UPDATE OF title, content ON api_universalcontent
+                FOR EACH ROW EXECUTE PROCEDURE api_universalcontent_search_vector_update();
+
+            UPDATE api_universalcontent SET search_vector =
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(content, '')), 'B');
+            """,
+            reverse_sql="""
+            DROP TRIGGER IF EXISTS api_universalcontent_search_vector_trigger ON api_universalcontent;
+            DROP FUNCTION IF EXISTS api_universalcontent_search_vector_update();
+            """
+        ),
+    ]
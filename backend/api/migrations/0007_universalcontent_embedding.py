@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_universalcontent_search_vector_trigger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='universalcontent',
+            name='embedding',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_passages(apps, schema_editor):
+    from django.conf import settings
+    from api.chunking import chunk_text
+    from api.prompt_builder import count_tokens
+
+    UniversalContent = apps.get_model('api', 'UniversalContent')
+    ContentPassage = apps.get_model('api', 'ContentPassage')
+    batch = []
+    for content in UniversalContent.objects.only('id', 'title', 'content', 'content_type').iterator(chunk_size=500):
+        chunks = chunk_text(content.content, settings.PASSAGE_MAX_TOKENS, settings.PASSAGE_OVERLAP_TOKENS)
+        for position, (start, end) in enumerate(chunks):
+            text = content.content[start:end]
+            batch.append(ContentPassage(
+                source_id=content.id, position=position, start_offset=start, end_offset=end,
+                title=content.title, content=text, content_type=content.content_type,
+                token_count=count_tokens(f"{content.title}\n{text}"),
+            ))
+        if len(batch) >= 500:
+            ContentPassage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ContentPassage.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_universalcontent_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentPassage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('start_offset', models.PositiveIntegerField()),
+                ('end_offset', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=200)),
+                ('content', models.TextField()),
+                ('content_type', models.CharField(max_length=50)),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='passages', to='api.universalcontent')),
+            ],
+            options={
+                'ordering': ['source', 'position'],
+                'unique_together': {('source', 'position')},
+            },
+        ),
+        migrations.RunPython(build_passages, migrations.RunPython.noop),
+    ]
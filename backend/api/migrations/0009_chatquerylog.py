@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_contentpassage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatQueryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(choices=[('chat', 'Chat'), ('website', 'Website')], max_length=20)),
+                ('normalized_query', models.CharField(max_length=500)),
+                ('retrieved_ids', models.JSONField(default=list)),
+                ('answer_cache_hit', models.BooleanField(default=False)),
+                ('retrieval_ms', models.FloatField(blank=True, null=True)),
+                ('llm_ms', models.FloatField(blank=True, null=True)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('model_name', models.CharField(max_length=100)),
+                ('streamed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='api_chatque_created_812530_idx'), models.Index(fields=['normalized_query'], name='api_chatque_normali_22b663_idx')],
+            },
+        ),
+    ]
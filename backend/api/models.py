@@ -4,8 +4,9 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.text import slugify
 from django.conf import settings
 from django.utils import timezone
-from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.contrib.postgres.indexes import GinIndex
+from .prompt_builder import count_tokens
 
 def get_default_company():
     from django.conf import settings
@@ -175,12 +176,24 @@ class UserHistory(models.Model):
             self.company = get_default_company()
         super().save(*args, **kwargs)
 
+def weighted_search_vector():
+    """
+    The search_vector expression, matching the database trigger from migration 0006:
+    the title is weighted 'A' and the content 'B'.
+    """
+    return (
+        SearchVector('title', weight='A', config='english') +
+        SearchVector('content', weight='B', config='english')
+    )
+
 class UniversalContent(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     content_type = models.CharField(max_length=50)  # e.g., 'tour_step', 'company_info', 'faq'
     metadata = models.JSONField(default=dict)  # For additional data like page_name, section_id, etc.
-    search_vector = SearchVectorField(null=True)
+    search_vector = SearchVectorField(null=True)  # Maintained by a database trigger (migration 0006)
+    token_count = models.PositiveIntegerField(default=0)  # Prompt tokens of "title\ncontent", kept up to date on save
+    embedding = models.BinaryField(null=True, blank=True, editable=False)  # float32 vector, see api/embeddings.py
 
     class Meta:
         indexes = [GinIndex(fields=['search_vector'])]
@@ -188,6 +201,62 @@ class UniversalContent(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.token_count = count_tokens(f"{self.title}\n{self.content}")
+        super().save(*args, **kwargs)
+
+class ContentPassage(models.Model):
+    """
+    An overlapping chunk of a UniversalContent row, built by api/chunking.py.
+    The title and content type are copied from the source so that passages can
+    be formatted into prompts like whole rows.
+    """
+    source = models.ForeignKey(UniversalContent, on_delete=models.CASCADE, related_name='passages')
+    position = models.PositiveIntegerField()
+    start_offset = models.PositiveIntegerField()  # Character offsets into source.content
+    end_offset = models.PositiveIntegerField()
+    title = models.CharField(max_length=200)
+    content = models.TextField()
+    content_type = models.CharField(max_length=50)
+    token_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['source', 'position']
+        unique_together = ('source', 'position')
+
+    def __str__(self):
+        return f"{self.title} (passage {self.position})"
+
+class ChatQueryLog(models.Model):
+    """
+    One chat or website interaction, written in batches by api/telemetry.py and
+    summarized by the query_report command.
+    """
+    ENDPOINT_CHOICES = [
+        ('chat', 'Chat'),
+        ('website', 'Website'),
+    ]
+
+    endpoint = models.CharField(max_length=20, choices=ENDPOINT_CHOICES)
+    normalized_query = models.CharField(max_length=500)  # See answer_cache.normalize_query
+    retrieved_ids = models.JSONField(default=list)  # UniversalContent ids of the retrieved items, best first
+    answer_cache_hit = models.BooleanField(default=False)
+    retrieval_ms = models.FloatField(null=True, blank=True)
+    llm_ms = models.FloatField(null=True, blank=True)  # None when no completion was requested
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    model_name = models.CharField(max_length=100)
+    streamed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)  # When the request was served, not when the row was written
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['normalized_query']),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint}: {self.normalized_query}"
+
 class PPTSlide(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
@@ -0,0 +1,147 @@
+import re
+import logging
+from django.conf import settings
+from .streaming import SENTENCE_BOUNDARY
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:  # tiktoken is optional, fall back to an approximation
+    _encoding = None
+
+logger = logging.getLogger(__name__)
+
+# Words are split into pieces of at most four characters, which tracks BPE
+# token counts of English prose closely enough for budgeting.
+APPROX_TOKEN = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Role of the message carrying the rolling summary of older turns, see api/conversation_store.py
+SUMMARY_ROLE = 'summary'
+
+def count_tokens(text):
+    """
+    Counts the tokens in `text`, exactly with tiktoken when it is installed and
+    approximately otherwise.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(APPROX_TOKEN.findall(text))
+
+def truncate_to_budget(text, budget):
+    """
+    Truncates `text` at a sentence boundary so that it fits within `budget` tokens.
+    A first sentence longer than the budget is cut at a word boundary instead.
+
+    Returns:
+        tuple: (truncated text, its token count)
+    """
+    kept, used = [], 0
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        cost = count_tokens(sentence) + (1 if kept else 0)
+        if used + cost > budget:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return " ".join(kept), used
+
+    words, used = [], 0
+    for word in text.split():
+        cost = count_tokens(word) + 1
+        if used + cost > budget:
+            break
+        words.append(word)
+        used += cost
+    return " ".join(words), used
+
+def format_history(context):
+    """
+    Renders the client-supplied conversation context, either a string or the
+    frontend's list of {role, content} messages, as one line per turn.
+    """
+    if not context:
+        return ""
+    if isinstance(context, str):
+        return context.strip()
+    lines = []
+    for message in context:
+        if isinstance(message, dict):
+            lines.append(f"{message.get('role', 'user')}: {message.get('content', '')}")
+        else:
+            lines.append(str(message))
+    return "\n".join(lines)
+
+class PromptBuilder:
+    """
+    Assembles the dynamic parts of a prompt within token budgets.
+
+    Retrieved documents are added in rank order until `context_budget` is used up;
+    the document that overflows is truncated at a sentence boundary if a useful
+    amount of budget remains. Documents are costed from their precomputed
+    `UniversalContent.token_count`, so only an overflowing document is re-counted.
+    Conversation history keeps the most recent lines within `history_budget`.
+    """
+    def __init__(self, context_budget=600, history_budget=300, min_truncated_tokens=40):
+        self.context_budget = context_budget
+        self.history_budget = history_budget
+        self.min_truncated_tokens = min_truncated_tokens
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            context_budget=settings.PROMPT_CONTEXT_TOKEN_BUDGET,
+            history_budget=settings.PROMPT_HISTORY_TOKEN_BUDGET,
+        )
+
+    def build_context(self, relevant_content, separator="\n\n"):
+        """
+        Formats ranked content as "title:\\ncontent" blocks within the context budget.
+
+        Returns:
+            tuple: (context text, its token count)
+        """
+        blocks, used = [], 0
+        for content in relevant_content:
+            title_tokens = count_tokens(content.title) + 2
+            cost = getattr(content, 'token_count', 0) or count_tokens(f"{content.title}\n{content.content}")
+            remaining = self.context_budget - used
+            if cost <= remaining:
+                blocks.append(f"{content.title}:\n{content.content}")
+                used += cost
+                continue
+            if remaining - title_tokens >= self.min_truncated_tokens:
+                text, text_tokens = truncate_to_budget(content.content, remaining - title_tokens)
+                if text:
+                    blocks.append(f"{content.title}:\n{text}")
+                    used += title_tokens + text_tokens
+            break
+        return separator.join(blocks), used
+
+    def build_history(self, context):
+        """
+        Keeps the most recent conversation lines within the history budget. A
+        leading summary message is always kept, within half of the budget, ahead
+        of the most recent lines.
+
+        Returns:
+            tuple: (history text, its token count)
+        """
+        summary, used = "", 0
+        if isinstance(context, list) and context and isinstance(context[0], dict) \
+                and context[0].get('role') == SUMMARY_ROLE:
+            summary, used = truncate_to_budget(f"Summary of the earlier conversation: {context[0].get('content', '')}",
+                                               self.history_budget // 2)
+            context = context[1:]
+
+        lines = []
+        for line in reversed(format_history(context).splitlines()):
+            cost = count_tokens(line) + 1
+            if used + cost > self.history_budget:
+                break
+            lines.append(line)
+            used += cost
+        if summary:
+            lines.append(summary)
+        return "\n".join(reversed(lines)), used
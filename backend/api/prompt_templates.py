@@ -0,0 +1,130 @@
+import threading
+import logging
+from .prompt_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+class PromptTemplate:
+    """
+    A prompt split into a static block and a dynamic block.
+
+    The static block (system instructions and guidelines) is rendered once, when
+    the template is registered, and always comes first, byte for byte identical
+    across requests, so that providers can serve it from their prompt prefix
+    cache. Per-request values (history, retrieved content, user input) only ever
+    appear in the dynamic block after it.
+    """
+    def __init__(self, name, static, dynamic):
+        self.name = name
+        self.static = static
+        self.dynamic = dynamic
+        self.static_tokens = count_tokens(static)
+
+    def render(self, **values):
+        return self.static + self.dynamic.format(**values)
+
+_templates = {}
+_usage = {}
+_usage_lock = threading.Lock()
+
+def register_template(template):
+    _templates[template.name] = template
+    return template
+
+def get_template(name):
+    return _templates[name]
+
+def record_usage(name, usage):
+    """
+    Records the provider-reported token usage of a prompt rendered from the
+    named template and returns the fraction of its prompt tokens the provider
+    served from its prefix cache (None when the provider reported no usage).
+    """
+    if not usage or not usage.get('prompt_tokens'):
+        return None
+    with _usage_lock:
+        totals = _usage.setdefault(name, {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0})
+        totals['requests'] += 1
+        totals['prompt_tokens'] += usage['prompt_tokens']
+        totals['cached_tokens'] += usage['cached_tokens']
+    return usage['cached_tokens'] / usage['prompt_tokens']
+
+def usage_stats():
+    """
+    Returns per-template totals and the overall cached-prefix fraction.
+    """
+    with _usage_lock:
+        stats = {}
+        for name, totals in _usage.items():
+            stats[name] = dict(totals)
+            stats[name]['cached_prefix_fraction'] = round(totals['cached_tokens'] / totals['prompt_tokens'], 4)
+            stats[name]['static_tokens'] = _templates[name].static_tokens
+        return stats
+
+THINK41_INTRO = "You are an AI assistant for Think41, a technology consulting company with a product mindset."
+
+CHAT_TEMPLATE = register_template(PromptTemplate(
+    name='chat',
+    static=f"""{THINK41_INTRO} Your role is to provide knowledgeable and helpful information about the company. Always maintain a professional, friendly, and helpful tone.
+
+Guidelines:
+1. Provide a concise response (50-75 words) that addresses the main point of the user's query.
+2. Use the conversation history to maintain context and provide relevant responses.
+3. If the user asks about Think41's services, founders, background, or any related information, focus on the most relevant details.
+4. For unrelated questions, politely redirect to Think41 topics.
+5. Address inappropriate language with a brief, polite message about professional communication.
+6. If unsure, offer to help find information on the Think41 website or suggest contacting Think41 directly.
+7. Always maintain a professional, friendly, and helpful tone.
+
+""",
+    dynamic="""Recent conversation history:
+{history}
+
+User's latest input: '{user_input}'
+
+Response:""",
+))
+
+SUMMARY_TEMPLATE = register_template(PromptTemplate(
+    name='conversation_summary',
+    static="""You maintain a running summary of a conversation between a user and Think41's AI assistant.
+
+Guidelines:
+1. Update the current summary with the new turns, in at most 80 words.
+2. Keep what later turns may refer back to: the user's name and situation, the topics and Think41 services discussed, and the key facts the assistant gave.
+3. Drop greetings, engagement questions and anything repeated.
+4. Write plain prose in the third person, without headings or lists.
+
+""",
+    dynamic="""Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:""",
+))
+
+WEBSITE_TEMPLATE = register_template(PromptTemplate(
+    name='website',
+    static=f"""{THINK41_INTRO} Your role is to provide helpful information about Think41 and assist users navigating the website. Maintain a professional, friendly, and concise tone.
+
+Guidelines:
+1. Provide a concise response (50-100 words) that directly addresses the user's query.
+2. Use the relevant information provided to answer the query accurately.
+3. If the user asks for additional information about a section, elaborate on the details from the relevant content.
+4. Focus on Think41's services, expertise, and how they can help businesses.
+5. If asked about specific pages or navigation, provide clear and brief instructions.
+6. For questions not related to Think41 or the website, politely redirect the conversation.
+7. If the information isn't available in the context, suggest contacting Think41 for more details.
+
+""",
+    dynamic="""Current page: {current_page}
+
+Relevant information from the database:
+{context}
+
+User query: '{user_input}'
+
+Response:""",
+))
@@ -0,0 +1,203 @@
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'retrieval:content_version'
+
+class RetrievalCache:
+    """
+    Two-level cache of retrieval results.
+
+    Values are compact lists of (content id, score) pairs rather than model
+    instances; an empty list is a cached negative result. L1 is a per-process
+    LRU, L2 the shared Django cache (Redis when REDIS_URL is set). Keys embed a
+    global content version kept in L2, and any UniversalContent change bumps it,
+    so every cached result becomes unreachable at once. Stale L1 entries are
+    simply evicted by newer ones.
+
+    The version itself is kept in-process for `version_ttl` seconds, so that L1
+    hits never wait on L2. A bump is seen at once by the process that made it,
+    and within `version_ttl` by the others.
+    """
+    def __init__(self, cache_alias='default', l1_max_entries=1024, ttl=300, negative_ttl=60, version_ttl=1.0):
+        self.cache_alias = cache_alias
+        self.l1_max_entries = l1_max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.version_ttl = version_ttl
+        self._version = None
+        self._version_expires_at = 0.0
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            l1_max_entries=settings.RETRIEVAL_CACHE_L1_MAX_ENTRIES,
+            ttl=settings.RETRIEVAL_CACHE_TTL,
+            negative_ttl=settings.RETRIEVAL_CACHE_NEGATIVE_TTL,
+            version_ttl=settings.RETRIEVAL_CACHE_VERSION_TTL,
+        )
+
+    @property
+    def l2(self):
+        return caches[self.cache_alias]
+
+    def version(self):
+        version = self._local_version()
+        if version is not None:
+            return version
+        version = self.l2.get(VERSION_KEY)
+        if version is None:
+            self.l2.add(VERSION_KEY, 1, timeout=None)
+            version = self.l2.get(VERSION_KEY, 1)
+        return self._remember_version(version)
+
+    async def aversion(self):
+        version = self._local_version()
+        if version is not None:
+            return version
+        version = await self.l2.aget(VERSION_KEY)
+        if version is None:
+            await self.l2.aadd(VERSION_KEY, 1, timeout=None)
+            version = await self.l2.aget(VERSION_KEY, 1)
+        return self._remember_version(version)
+
+    def _local_version(self):
+        with self._lock:
+            if self._version is not None and time.monotonic() < self._version_expires_at:
+                return self._version
+            return None
+
+    def _remember_version(self, version):
+        with self._lock:
+            self._version, self._version_expires_at = version, time.monotonic() + self.version_ttl
+        return version
+
+    def bump_version(self):
+        """
+        Invalidates every cached result, in all processes sharing L2.
+
+        Returns:
+            int: The new version.
+        """
+        try:
+            version = self.l2.incr(VERSION_KEY)
+        except ValueError:
+            # No version yet (or it was evicted): start above any version in use
+            version = int(time.time())
+            self.l2.set(VERSION_KEY, version, timeout=None)
+        return self._remember_version(version)
+
+    def key(self, namespace, query, version):
+        digest = hashlib.sha1(query.encode('utf-8')).hexdigest()
+        return f"retrieval:{version}:{namespace}:{digest}"
+
+    def get(self, namespace, query, version):
+        """
+        Returns the cached (id, score) pairs for the query, [] for a cached
+        negative result, or None on a miss.
+
+        Args:
+            version: The content version read with `version()` for this lookup;
+                pass the same one to `set`, so that results computed across a
+                content change are stored under the version they were read for.
+        """
+        key = self.key(namespace, query, version)
+        hits = self._l1_get(key)
+        if hits is not None:
+            return hits
+        hits = self.l2.get(key)
+        return self._l2_result(key, hits)
+
+    async def aget(self, namespace, query, version):
+        key = self.key(namespace, query, version)
+        hits = self._l1_get(key)
+        if hits is not None:
+            return hits
+        hits = await self.l2.aget(key)
+        return self._l2_result(key, hits)
+
+    def set(self, namespace, query, hits, version):
+        key = self.key(namespace, query, version)
+        hits = self._compact(hits)
+        self._l1_set(key, hits)
+        self.l2.set(key, hits, timeout=self._ttl(hits))
+
+    async def aset(self, namespace, query, hits, version):
+        key = self.key(namespace, query, version)
+        hits = self._compact(hits)
+        self._l1_set(key, hits)
+        await self.l2.aset(key, hits, timeout=self._ttl(hits))
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'l1_entries': len(self._l1),
+                'l1_hits': self.l1_hits,
+                'l2_hits': self.l2_hits,
+                'misses': self.misses,
+            }
+
+    def _compact(self, hits):
+        return [(int(content_id), round(float(score), 6)) for content_id, score in hits]
+
+    def _ttl(self, hits):
+        return self.ttl if hits else self.negative_ttl
+
+    def _l1_get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            self.l1_hits += 1
+            return entry[0]
+
+    def _l1_set(self, key, hits):
+        with self._lock:
+            self._l1[key] = (hits, time.monotonic() + self._ttl(hits))
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l2_result(self, key, hits):
+        if hits is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.l2_hits += 1
+        self._l1_set(key, hits)
+        return hits
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+def get_retrieval_cache():
+    """
+    Returns the process-wide `RetrievalCache`, creating it on first use.
+    """
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        with _retrieval_cache_lock:
+            if _retrieval_cache is None:
+                _retrieval_cache = RetrievalCache.from_settings()
+    return _retrieval_cache
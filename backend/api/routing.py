@@ -0,0 +1,388 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeoutError, wait
+from django.conf import settings
+from .ai_models import AIModel, AIModelFactory, StreamInterrupted, get_last_usage, set_last_usage
+from .log_handlers import LLM_LOG
+
+logger = logging.getLogger(__name__)
+
+# The provider that served the routed completion of the current thread or task
+_served_by = contextvars.ContextVar('llm_served_by', default=None)
+
+class ProviderHealth:
+    """
+    Rolling latency and error statistics for one provider, plus its circuit state.
+
+    The circuit opens after `failure_threshold` consecutive failures, or when the
+    error rate over the window exceeds `error_rate_threshold`. While open, the
+    provider is skipped. After `cooldown` seconds the next request dispatched to it
+    becomes the single trial request (half-open), and its outcome closes or re-opens
+    the circuit. A trial that is abandoned (a cancelled hedge) or that has not
+    reported back within `probe_timeout` seconds frees the slot for another trial,
+    so the circuit never stays half-open.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, window=100, failure_threshold=5, error_rate_threshold=0.5,
+                 min_samples=10, cooldown=30.0, probe_timeout=60.0):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        """
+        Whether a request could be dispatched now. Has no side effects, so it is
+        safe to call for ranking; `acquire` claims the trial slot.
+        """
+        with self._lock:
+            return self._available(time.monotonic())
+
+    def acquire(self):
+        """
+        Claims the right to dispatch a request, called just before sending it. For an
+        open circuit past its cooldown this makes the request the half-open trial.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not self._available(now):
+                return False
+            if self.state != self.CLOSED:
+                self.state = self.HALF_OPEN
+                self.probe_started = now
+                logger.info("Circuit for %s is half-open, sending a trial request", self.name)
+            return True
+
+    def abandon(self):
+        """
+        Reports that a dispatched request ended without an outcome (cancelled). A
+        trial request gives its slot back, so the next request can probe again.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def _available(self, now):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.cooldown
+        # Half-open: only once the trial has gone unanswered for too long
+        return now - self.probe_started >= self.probe_timeout
+
+    def record(self, latency, success):
+        with self._lock:
+            self.outcomes.append(success)
+            if success:
+                if latency is not None:
+                    self.latencies.append(latency)
+                self.consecutive_failures = 0
+                if self.state != self.CLOSED:
+                    logger.info("Circuit for %s closed", self.name)
+                self.state = self.CLOSED
+                return
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self._should_open():
+                if self.state != self.OPEN:
+                    logger.warning("Circuit for %s opened after %d failures", self.name, self.consecutive_failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def _should_open(self):
+        if self.consecutive_failures >= self.failure_threshold:
+            return True
+        return len(self.outcomes) >= self.min_samples and self._error_rate() > self.error_rate_threshold
+
+    def _error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def percentile(self, fraction, default):
+        with self._lock:
+            if not self.latencies:
+                return default
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'p50': self.percentile(0.5, None),
+            'p95': self.percentile(0.95, None),
+            'error_rate': round(self._error_rate(), 3),
+            'samples': len(self.outcomes),
+        }
+
+class RoutedModel(AIModel):
+    """
+    Routes each completion across Groq, GPT-4 and 4o-mini.
+
+    Providers are tried fastest-first by rolling median latency, skipping open
+    circuits. If the primary has not answered after its own p95 latency, a hedged
+    request goes to the next provider and the first successful answer wins. Every
+    request is bounded by `deadline` seconds; if nothing succeeds in time, None is
+    returned like any other provider failure. A stream fails over to the next
+    provider when its first token takes longer than `deadline`. The provider that
+    answered is reported by `served_provider`, for per-provider latency metrics.
+    """
+    model = 'auto'
+
+    def __init__(self, provider_names, deadline=20.0, default_latency=2.0,
+                 min_hedge_delay=0.25, max_workers=32, health_options=None):
+        self.providers = {name: AIModelFactory.get_model(name) for name in provider_names}
+        self.provider_names = list(provider_names)
+        self.deadline = deadline
+        self.default_latency = default_latency
+        self.min_hedge_delay = min_hedge_delay
+        self.health = {name: ProviderHealth(name, **(health_options or {})) for name in provider_names}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-router')
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            provider_names=settings.LLM_ROUTING_PROVIDERS,
+            deadline=settings.LLM_REQUEST_DEADLINE,
+            default_latency=settings.LLM_HEDGE_DEFAULT_DELAY,
+            min_hedge_delay=settings.LLM_HEDGE_MIN_DELAY,
+            max_workers=settings.LLM_ROUTING_MAX_WORKERS,
+            health_options={
+                'failure_threshold': settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                'error_rate_threshold': settings.LLM_CIRCUIT_ERROR_RATE,
+                'cooldown': settings.LLM_CIRCUIT_COOLDOWN,
+                # A trial request that outlives the request deadline has been lost
+                'probe_timeout': settings.LLM_REQUEST_DEADLINE,
+            },
+        )
+
+    def candidates(self):
+        """
+        Returns the providers whose circuit allows a request, fastest first.
+        Providers without samples are ranked at the default latency. Circuit states
+        are not changed; see `acquire`.
+        """
+        ranked = sorted(
+            self.provider_names,
+            key=lambda name: self.health[name].percentile(0.5, self.default_latency)
+        )
+        return [name for name in ranked if self.health[name].available()]
+
+    def acquire(self, remaining):
+        """
+        Pops the next provider of `remaining` whose circuit admits the request,
+        or returns None when none does.
+        """
+        while remaining:
+            name = remaining.pop(0)
+            if self.health[name].acquire():
+                return name
+        return None
+
+    def hedge_delay(self, name):
+        return max(self.min_hedge_delay, self.health[name].percentile(0.95, self.default_latency))
+
+    def _timed_call(self, name, content):
+        started = time.monotonic()
+        result = self.providers[name].generate_response(content)
+        self.health[name].record(time.monotonic() - started, bool(result))
+        # Usage is recorded in the worker thread's context; hand it back to the caller
+        return name, result, get_last_usage()
+
+    async def _atimed_call(self, name, content):
+        started = time.monotonic()
+        try:
+            result = await self.providers[name].agenerate_response(content)
+        except asyncio.CancelledError:
+            # A cancelled (losing) hedge says nothing about the provider
+            self.health[name].abandon()
+            raise
+        self.health[name].record(time.monotonic() - started, bool(result))
+        return name, result, get_last_usage()
+
+    def served_provider(self):
+        return _served_by.get()
+
+    def generate_response(self, content):
+        set_last_usage(None)
+        _served_by.set(None)
+        remaining = self.candidates()
+        if not remaining:
+            logger.error("No LLM provider available, all circuits are open")
+            return None
+
+        deadline = time.monotonic() + self.deadline
+        pending = set()
+
+        def launch():
+            name = self.acquire(remaining)
+            if name is not None:
+                pending.add(self.executor.submit(self._timed_call, name, content))
+            return name
+
+        current = launch()
+        if current is None:
+            logger.error("No LLM provider available, all circuits are open")
+            return None
+        while pending:
+            time_left = deadline - time.monotonic()
+            if time_left <= 0:
+                break
+            # Wait for the latest request's p95 before hedging to the next provider
+            timeout = min(time_left, self.hedge_delay(current)) if remaining else time_left
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, result, usage = future.result()
+                if result:
+                    set_last_usage(usage)
+                    _served_by.set(name)
+                    if name != self.provider_names[0]:
+                        logger.info("Routed completion served by %s", name, extra=LLM_LOG)
+                    return result
+            # Either the hedge delay elapsed or the finished requests failed
+            if remaining:
+                current = launch() or current
+
+        logger.error("No LLM provider answered within %ss", self.deadline)
+        return None
+
+    async def agenerate_response(self, content):
+        set_last_usage(None)
+        _served_by.set(None)
+        remaining = self.candidates()
+        if not remaining:
+            logger.error("No LLM provider available, all circuits are open")
+            return None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        pending = set()
+
+        def launch():
+            name = self.acquire(remaining)
+            if name is not None:
+                pending.add(asyncio.ensure_future(self._atimed_call(name, content)))
+            return name
+
+        current = launch()
+        if current is None:
+            logger.error("No LLM provider available, all circuits are open")
+            return None
+        try:
+            while pending:
+                time_left = deadline - loop.time()
+                if time_left <= 0:
+                    break
+                timeout = min(time_left, self.hedge_delay(current)) if remaining else time_left
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name, result, usage = task.result()
+                    if result:
+                        set_last_usage(usage)
+                        _served_by.set(name)
+                        if name != self.provider_names[0]:
+                            logger.info("Routed completion served by %s", name, extra=LLM_LOG)
+                        return result
+                if remaining:
+                    current = launch() or current
+        finally:
+            for task in pending:
+                task.cancel()
+
+        logger.error("No LLM provider answered within %ss", self.deadline)
+        return None
+
+    def stream_response(self, content):
+        # Streams cannot be hedged once tokens flow; fail over only before the first token,
+        # including when a provider sends none within the deadline
+        _served_by.set(None)
+        remaining = self.candidates()
+        while True:
+            name = self.acquire(remaining)
+            if name is None:
+                return
+            started = time.monotonic()
+            stream = iter(self.providers[name].stream_response(content))
+            first = self.executor.submit(next, stream, None)
+            try:
+                delta = first.result(timeout=self.deadline)
+            except FutureTimeoutError:
+                # Close the hung stream whenever it returns, and move on
+                first.add_done_callback(lambda _, stream=stream: stream.close())
+                self.health[name].record(None, False)
+                logger.warning("No first token from %s within %ss, failing over", name, self.deadline)
+                continue
+            except Exception:
+                # The stream raised before producing anything
+                self.health[name].abandon()
+                raise
+            if delta is None:
+                self.health[name].record(None, False)
+                logger.warning("Streaming from %s failed, failing over", name)
+                continue
+            # Recorded at the first token, so a client hanging up later cannot lose the outcome
+            self.health[name].record(time.monotonic() - started, True)
+            _served_by.set(name)
+            try:
+                yield delta
+                yield from stream
+            except StreamInterrupted:
+                # Failed mid-answer; too late to fail over, but it counts against the provider
+                self.health[name].record(None, False)
+                raise
+            return
+
+    async def astream_response(self, content):
+        _served_by.set(None)
+        remaining = self.candidates()
+        while True:
+            name = self.acquire(remaining)
+            if name is None:
+                return
+            started = time.monotonic()
+            stream = self.providers[name].astream_response(content)
+            try:
+                delta = await asyncio.wait_for(stream.__anext__(), self.deadline)
+            except asyncio.TimeoutError:
+                # wait_for cancelled the pending step, which ends the stream
+                await stream.aclose()
+                self.health[name].record(None, False)
+                logger.warning("No first token from %s within %ss, failing over", name, self.deadline)
+                continue
+            except StopAsyncIteration:
+                delta = None
+            except BaseException:
+                # The stream raised, or the request was cancelled, before producing anything
+                self.health[name].abandon()
+                raise
+            if delta is None:
+                self.health[name].record(None, False)
+                logger.warning("Streaming from %s failed, failing over", name)
+                continue
+            self.health[name].record(time.monotonic() - started, True)
+            _served_by.set(name)
+            try:
+                yield delta
+                async for delta in stream:
+                    yield delta
+            except StreamInterrupted:
+                # Failed mid-answer; too late to fail over, but it counts against the provider
+                self.health[name].record(None, False)
+                raise
+            return
+
+    def stats(self):
+        return {name: self.health[name].snapshot() for name in self.provider_names}
@@ -0,0 +1,360 @@
+import copy
+import math
+import re
+import threading
+import logging
+from collections import Counter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection
+from .answer_cache import STOPWORDS
+from .retrieval_cache import get_retrieval_cache
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r"\w+")
+# Longest first, so that "founders" loses "ers" rather than "s"
+SUFFIXES = ('ings', 'ing', 'ers', 'er', 'ed', 's')
+
+def stem(word):
+    """
+    Strips a common English suffix, so that e.g. "founded", "founder" and
+    "founders" share one index term. Deliberately crude: it only has to map
+    query words and document words onto the same term.
+    """
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and not word.endswith('ss') and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def tokenize(text):
+    """
+    Lower-cases and splits text into stemmed index terms, dropping stopwords.
+    """
+    return [stem(word) for word in TOKEN.findall((text or "").lower()) if word not in STOPWORDS]
+
+class BM25Index:
+    """
+    In-memory inverted index scored with BM25.
+
+    Documents are identified by any hashable id and consist of a title and a body;
+    title terms count `title_boost` times, so title matches outrank body matches.
+    Documents can be added, replaced and removed one at a time, which keeps the
+    index current without rebuilding it.
+    """
+    def __init__(self, k1=1.2, b=0.75, title_boost=3.0):
+        self.k1 = k1
+        self.b = b
+        self.title_boost = title_boost
+        self._postings = {}
+        self._lengths = {}
+        self._doc_terms = {}
+        self._total_length = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._lengths
+
+    def add(self, doc_id, title, text):
+        """
+        Indexes a document, replacing any previous version with the same id.
+        """
+        frequencies = Counter(tokenize(text))
+        for term in tokenize(title):
+            frequencies[term] += self.title_boost
+        with self._lock:
+            self._remove(doc_id)
+            for term, frequency in frequencies.items():
+                self._postings.setdefault(term, {})[doc_id] = frequency
+            length = sum(frequencies.values())
+            self._lengths[doc_id] = length
+            self._doc_terms[doc_id] = list(frequencies)
+            self._total_length += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def search(self, query, k=5):
+        """
+        Returns up to `k` (doc_id, score) pairs for the query, best first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._lengths:
+                return []
+            doc_count = len(self._lengths)
+            average_length = self._total_length / doc_count
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores.most_common(k)
+
+    def _remove(self, doc_id):
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._doc_terms.pop(doc_id):
+            del self._postings[term][doc_id]
+            if not self._postings[term]:
+                del self._postings[term]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several best-first lists of ids with reciprocal rank fusion: each id
+    scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Returns:
+        list: (id, fused score) pairs, best first.
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return scores.most_common()
+
+class ContentSearchIndex:
+    """
+    BM25 index over `UniversalContent`, holding the indexed rows in memory so a
+    search never touches the database.
+
+    The index is kept current by the save/delete signals in `api/signals.py`,
+    and `get_content_index` reloads it once another process has changed content
+    (see `LoadedIndex`).
+    """
+    def __init__(self, fields, **bm25_options):
+        self.fields = fields
+        self.bm25_options = bm25_options
+        self.index = BM25Index(**bm25_options)
+        self._rows = {}
+
+    @classmethod
+    def from_settings(cls):
+        from .gpt_assistant import SEARCH_RESULT_FIELDS
+        return cls(
+            fields=SEARCH_RESULT_FIELDS,
+            k1=settings.SEARCH_BM25_K1,
+            b=settings.SEARCH_BM25_B,
+            title_boost=settings.SEARCH_BM25_TITLE_BOOST,
+        )
+
+    def queryset(self):
+        from .models import UniversalContent
+        return UniversalContent.objects.only(*self.fields)
+
+    def load(self):
+        index, rows = BM25Index(**self.bm25_options), {}
+        for row in self.queryset().iterator():
+            index.add(row.pk, row.title, row.content)
+            rows[row.pk] = row
+        self.index, self._rows = index, rows
+        logger.info("Loaded %d rows into the %s", len(rows), type(self).__name__)
+
+    def update(self, row):
+        self.index.add(row.pk, row.title, row.content)
+        self._rows[row.pk] = copy.copy(row)
+
+    def remove(self, pk):
+        self.index.remove(pk)
+        self._rows.pop(pk, None)
+
+    def search(self, query, k=5):
+        """
+        Returns up to `k` content rows for the query, best first, each a copy
+        annotated with its BM25 score as `combined_rank`.
+        """
+        results = []
+        for pk, score in self.index.search(query, k):
+            row = self._rows.get(pk)
+            if row is None:
+                continue
+            row = copy.copy(row)
+            row.combined_rank = score
+            results.append(row)
+        return results
+
+class PassageSearchIndex(ContentSearchIndex):
+    """
+    BM25 index over `ContentPassage` rows. Passages carry their source's title
+    and content type, so results format exactly like `UniversalContent` rows.
+    Overlapping passages of one source would repeat text in the prompt, so at
+    most `max_per_source` passages of a source are returned.
+    """
+    def __init__(self, max_per_source=2, **bm25_options):
+        super().__init__(fields=None, **bm25_options)
+        self.max_per_source = max_per_source
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_per_source=settings.PASSAGE_MAX_PER_SOURCE,
+            k1=settings.SEARCH_BM25_K1,
+            b=settings.SEARCH_BM25_B,
+            title_boost=settings.SEARCH_BM25_TITLE_BOOST,
+        )
+
+    def queryset(self):
+        from .models import ContentPassage
+        return ContentPassage.objects.all()
+
+    def replace_source(self, source_id, passages):
+        self.remove_source(source_id)
+        for passage in passages:
+            self.update(passage)
+
+    def remove_source(self, source_id):
+        for pk in [pk for pk, row in list(self._rows.items()) if row.source_id == source_id]:
+            self.remove(pk)
+
+    def search(self, query, k=5):
+        # Over-fetch so that capping passages per source still leaves k results,
+        # widening the fetch while a few sources crowd out the others
+        fetch = k * self.max_per_source
+        while True:
+            candidates = super().search(query, fetch)
+            results, per_source = [], Counter()
+            for passage in candidates:
+                if per_source[passage.source_id] >= self.max_per_source:
+                    continue
+                per_source[passage.source_id] += 1
+                results.append(passage)
+                if len(results) == k:
+                    return results
+            if len(candidates) < fetch:
+                # Every matching passage was considered
+                return results
+            fetch *= 2
+
+class LoadedIndex:
+    """
+    Holds a process-wide in-memory index, created by `factory` and loaded on
+    first use, along with the content version of the retrieval cache it was
+    loaded at.
+
+    Any content change, in any process sharing the cache, bumps that version, and
+    the next `get` then reloads the index. One thread reloads while the others
+    keep searching the previous index, so a reload never stalls requests. Changes
+    made in this process are applied incrementally with `apply` instead, which
+    keeps the index current without a reload.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.index = None
+        self.version = None
+        self._lock = threading.Lock()
+
+    def get(self, version=None):
+        if version is None:
+            version = get_retrieval_cache().version()
+        index = self.index
+        if index is not None and self.version == version:
+            return index
+        if not self._lock.acquire(blocking=index is None):
+            return index
+        try:
+            if self.index is None or self.version != version:
+                index = self.factory()
+                index.load()
+                self.index, self.version = index, version
+            return self.index
+        finally:
+            self._lock.release()
+
+    def apply(self, change, version):
+        """
+        Applies an incremental change to the loaded index, if any.
+
+        Args:
+            change: Called with the index, or None when the content change does
+                not affect it.
+            version: The content version the change was published as (the result
+                of `RetrievalCache.bump_version`). An index that was current just
+                before it is current again afterwards; one that missed another
+                change in between still reloads on the next `get`.
+        """
+        index = self.index
+        if index is None:
+            return
+        if change is not None:
+            change(index)
+        if self.index is index and self.version is not None and self.version + 1 == version:
+            self.version = version
+
+    async def aget(self):
+        """
+        Async counterpart of `get`; only loading touches the database.
+        """
+        version = await get_retrieval_cache().aversion()
+        if self.index is not None and self.version == version:
+            return self.index
+        return await sync_to_async(self.get)(version)
+
+_content_index = LoadedIndex(ContentSearchIndex.from_settings)
+_passage_index = LoadedIndex(PassageSearchIndex.from_settings)
+
+def get_content_index():
+    """
+    Returns the process-wide `ContentSearchIndex`, loading it on first use and
+    reloading it after content changes.
+    """
+    return _content_index.get()
+
+async def aget_content_index():
+    return await _content_index.aget()
+
+def update_content_index(change, version):
+    """
+    Applies `change` to the `ContentSearchIndex` if this process has loaded it
+    (see `LoadedIndex.apply`). Signal handlers use this so that saving content
+    never triggers a full load.
+    """
+    _content_index.apply(change, version)
+
+def get_passage_index():
+    """
+    Returns the process-wide `PassageSearchIndex`, loading it on first use and
+    reloading it after content changes.
+    """
+    return _passage_index.get()
+
+async def aget_passage_index():
+    return await _passage_index.aget()
+
+def update_passage_index(change, version):
+    _passage_index.apply(change, version)
+
+def preload_search_indexes():
+    """
+    Loads the in-memory indexes the configured RETRIEVAL_UNIT and SEARCH_BACKEND
+    search in a background thread, so that the first chat request does not pay
+    for loading them. Run by the WSGI and ASGI entry points when
+    SEARCH_INDEX_PRELOAD is on.
+    """
+    thread = threading.Thread(target=_preload_search_indexes, name='search-index-preload', daemon=True)
+    thread.start()
+    return thread
+
+def _preload_search_indexes():
+    try:
+        if settings.RETRIEVAL_UNIT == 'passage':
+            get_passage_index()
+        elif settings.SEARCH_BACKEND == 'bm25':
+            get_content_index()
+        elif settings.SEARCH_BACKEND == 'hybrid':
+            from .embeddings import get_embedding_index
+            get_embedding_index()
+    except DatabaseError as e:
+        # Not migrated yet, or the database is down: the index loads on first use instead
+        logger.warning("Could not preload the search indexes: %s", e)
+    finally:
+        connection.close()
@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import UniversalContent
+from .answer_cache import get_answer_cache
+from .retrieval_cache import get_retrieval_cache
+from .search_index import update_content_index, update_passage_index
+from .chunking import rebuild_passages
+
+# The fields that passages are built from (see api/chunking.py)
+PASSAGE_SOURCE_FIELDS = ('title', 'content', 'content_type')
+
+@receiver(post_save, sender=UniversalContent)
+@receiver(post_delete, sender=UniversalContent)
+def invalidate_cached_answers(sender, instance, **kwargs):
+    get_answer_cache().invalidate_content(instance.pk)
+
+@receiver(post_save, sender=UniversalContent)
+@receiver(post_delete, sender=UniversalContent)
+def invalidate_cached_retrievals(sender, instance, **kwargs):
+    # The handlers below apply the change to this process's indexes under the new version
+    instance._content_version = get_retrieval_cache().bump_version()
+
+def content_version(instance):
+    return instance.__dict__.get('_content_version')
+
+@receiver(post_save, sender=UniversalContent)
+def update_search_index(sender, instance, **kwargs):
+    update_content_index(lambda index: index.update(instance), content_version(instance))
+
+@receiver(post_delete, sender=UniversalContent)
+def remove_from_search_index(sender, instance, **kwargs):
+    update_content_index(lambda index: index.remove(instance.pk), content_version(instance))
+
+@receiver(post_save, sender=UniversalContent)
+def update_embedding(sender, instance, **kwargs):
+    if settings.SEARCH_BACKEND != 'hybrid':
+        return
+    from .embeddings import embed_in_background, snapshot_row, update_embedding_index
+    version = content_version(instance)
+    # The new vector follows once computed; until then the index keeps the old one
+    update_embedding_index(None, version)
+    row = snapshot_row(instance)
+    transaction.on_commit(lambda: embed_in_background(row, version))
+
+@receiver(post_delete, sender=UniversalContent)
+def remove_embedding(sender, instance, **kwargs):
+    from .embeddings import update_embedding_index
+    update_embedding_index(lambda index: index.remove(instance.pk), content_version(instance))
+
+@receiver(pre_save, sender=UniversalContent)
+def detect_passage_changes(sender, instance, update_fields=None, **kwargs):
+    instance._passages_stale = passages_stale(instance, update_fields)
+
+def passages_stale(instance, update_fields):
+    """
+    Whether saving the row changes the passages that passage retrieval reads.
+    """
+    if settings.RETRIEVAL_UNIT != 'passage':
+        return False
+    if update_fields is not None and not set(update_fields) & set(PASSAGE_SOURCE_FIELDS):
+        return False
+    if instance._state.adding or instance.pk is None:
+        return True
+    stored = UniversalContent.objects.filter(pk=instance.pk).values_list(*PASSAGE_SOURCE_FIELDS).first()
+    return stored != tuple(getattr(instance, field) for field in PASSAGE_SOURCE_FIELDS)
+
+@receiver(post_save, sender=UniversalContent)
+def update_passages(sender, instance, **kwargs):
+    if not instance.__dict__.pop('_passages_stale', False):
+        # The passages are unchanged, which keeps a loaded passage index current
+        update_passage_index(None, content_version(instance))
+        return
+    passages = rebuild_passages(instance)
+    update_passage_index(lambda index: index.replace_source(instance.pk, passages), content_version(instance))
+
+@receiver(post_save, sender=UniversalContent)
+@receiver(post_delete, sender=UniversalContent)
+def rewarm_caches(sender, instance, **kwargs):
+    if settings.CACHE_WARMUP_ON_CONTENT_CHANGE:
+        from .cache_warmup import schedule_warmup
+        schedule_warmup()
+
+@receiver(post_migrate)
+def warm_caches_after_migrate(sender, **kwargs):
+    if settings.CACHE_WARMUP_ON_MIGRATE and sender.name == 'api':
+        from .cache_warmup import warm_from_settings
+        warm_from_settings()
+
+@receiver(post_delete, sender=UniversalContent)
+def remove_passages(sender, instance, **kwargs):
+    # The passages themselves are removed by the cascade
+    update_passage_index(lambda index: index.remove_source(instance.pk), content_version(instance))
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .answer_cache import normalize_query
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+def single_flight_key(user_input, context, model_name):
+    """
+    Builds the coalescing key for a chat request from its normalized input,
+    its conversation context and the model name.
+    """
+    raw = json.dumps([normalize_query(user_input), context, model_name], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight computations.
+
+    Within a process, concurrent callers with the same key wait for the first
+    caller (the leader) and receive its result. Across worker processes on the
+    same host, leaders serialise on a per-key `flock` in `lock_dir`; the winner
+    publishes its JSON result next to the lock, and a process that acquires the
+    lock afterwards reuses any result published after it started waiting instead
+    of recomputing it.
+    """
+    def __init__(self, lock_dir, wait_timeout=30.0, poll_interval=0.05):
+        self.lock_dir = lock_dir
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self._writes = 0
+        if fcntl is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            lock_dir=settings.SINGLE_FLIGHT_LOCK_DIR,
+            wait_timeout=settings.SINGLE_FLIGHT_WAIT_TIMEOUT,
+        )
+
+    def do(self, key, fn):
+        """
+        Runs `fn()` unless an identical call is already in flight, in which case
+        its result is shared. `fn` must return a JSON-serialisable value.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not is_leader:
+            if call.done.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            logger.warning("Timed out waiting for in-flight call %.12s, computing it directly", key)
+            return fn()
+
+        try:
+            call.result = self._run_across_processes(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key, coro_fn):
+        """
+        Async counterpart of `do` for a coroutine function. In-process followers
+        await the leader's future; the cross-process lock is polled without
+        blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future_key = (key, id(loop))
+        with self._lock:
+            future = self._async_calls.get(future_key)
+            is_leader = future is None
+            if is_leader:
+                future = loop.create_future()
+                self._async_calls[future_key] = future
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not is_leader:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Timed out waiting for in-flight call %.12s, computing it directly", key)
+                return await coro_fn()
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled (e.g. its client disconnected)
+                return await coro_fn()
+
+        try:
+            result = await self._arun_across_processes(key, coro_fn)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._async_calls.pop(future_key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'in_flight': len(self._calls) + len(self._async_calls),
+            }
+
+    def _paths(self, key):
+        return (
+            os.path.join(self.lock_dir, f"{key}.lock"),
+            os.path.join(self.lock_dir, f"{key}.json"),
+        )
+
+    def _run_across_processes(self, key, fn):
+        if fcntl is None:
+            return fn()
+        started_at = time.time()
+        lock_path, result_path = self._paths(key)
+        lock_file = self._try_lock(lock_path)
+        deadline = time.monotonic() + self.wait_timeout
+        while lock_file is None and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            lock_file = self._try_lock(lock_path)
+        try:
+            shared = self._read_result(result_path, started_at)
+            if shared is not None:
+                with self._lock:
+                    self.followers += 1
+                return shared['result']
+            result = fn()
+            self._write_result(result_path, result)
+            return result
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    async def _arun_across_processes(self, key, coro_fn):
+        if fcntl is None:
+            return await coro_fn()
+        started_at = time.time()
+        lock_path, result_path = self._paths(key)
+        # The lock and result files are touched from a worker thread, never on the event loop
+        try_lock = sync_to_async(self._try_lock, thread_sensitive=False)
+        lock_file = await try_lock(lock_path)
+        deadline = time.monotonic() + self.wait_timeout
+        while lock_file is None and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            lock_file = await try_lock(lock_path)
+        try:
+            shared = await sync_to_async(self._read_result, thread_sensitive=False)(result_path, started_at)
+            if shared is not None:
+                with self._lock:
+                    self.followers += 1
+                return shared['result']
+            result = await coro_fn()
+            await sync_to_async(self._write_result, thread_sensitive=False)(result_path, result)
+            return result
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def _try_lock(self, lock_path):
+        """
+        Opens the lock file and takes its `flock` without blocking.
+
+        Returns:
+            The open, locked file (closing it releases the lock), or None if
+            another process holds the lock.
+        """
+        lock_file = open(lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        # `_prune` may have unlinked the file between open() and flock(): a lock
+        # on the orphaned file excludes nobody, so retry on the current one
+        try:
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                return lock_file
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+        return None
+
+    def _read_result(self, result_path, started_at):
+        try:
+            with open(result_path) as f:
+                shared = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Only results completed while we were waiting count as in-flight
+        if shared.get('completed_at', 0) < started_at:
+            return None
+        return shared
+
+    def _write_result(self, result_path, result):
+        tmp_path = f"{result_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'completed_at': time.time(), 'result': result}, f)
+            os.replace(tmp_path, result_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Could not publish single-flight result: %s", e)
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        """
+        Removes lock and result files that have not been touched for a while, so
+        the lock directory does not grow with every distinct query. A lock file is
+        only removed while holding its lock, so a slow leader never loses it.
+        """
+        cutoff = time.time() - max(self.wait_timeout * 10, 300)
+        try:
+            for entry in os.scandir(self.lock_dir):
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if not entry.name.endswith('.lock'):
+                    # Results this old are never reused, see `_read_result`
+                    os.remove(entry.path)
+                    continue
+                lock_file = self._try_lock(entry.path)
+                if lock_file is not None:
+                    with lock_file:
+                        os.remove(entry.path)
+        except OSError as e:
+            logger.warning("Could not prune single-flight files: %s", e)
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight():
+    """
+    Returns the process-wide `SingleFlight`, creating it on first use.
+    """
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight.from_settings()
+    return _single_flight
@@ -0,0 +1,108 @@
+import json
+import re
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+
+def sse_event(event, data):
+    """
+    Formats a single Server-Sent Event frame with a JSON payload.
+
+    Args:
+        event (str): The event name (e.g. 'token', 'sentence', 'done').
+        data (dict): The JSON-serialisable payload.
+
+    Returns:
+        str: The encoded SSE frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SentenceBuffer:
+    """
+    Accumulates streamed tokens and releases complete sentences as soon as a
+    sentence boundary has been seen, mirroring the split used by the
+    frontend speech synthesis (`/(?<=[.!?])\\s+/`).
+    """
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text: str) -> list:
+        """
+        Adds a chunk of streamed text and returns the sentences it completed.
+        """
+        self.buffer += text
+        parts = SENTENCE_BOUNDARY.split(self.buffer)
+        # The last part may still be growing, keep it buffered
+        self.buffer = parts.pop()
+        return [part.strip() for part in parts if part.strip()]
+
+    def flush(self) -> list:
+        """
+        Returns whatever is left in the buffer as a final sentence.
+        """
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        return [remainder] if remainder else []
+
+
+def stream_events(token_stream):
+    """
+    Turns an iterator of text deltas into 'token' and 'sentence' events.
+
+    Args:
+        token_stream (Iterable[str]): Text deltas as they arrive from the provider.
+
+    Yields:
+        dict: Events of the form {'type': 'token'|'sentence', 'text': str}.
+    """
+    sentences = SentenceBuffer()
+    for token in token_stream:
+        if not token:
+            continue
+        yield {'type': 'token', 'text': token}
+        for sentence in sentences.feed(token):
+            yield {'type': 'sentence', 'text': sentence}
+    for sentence in sentences.flush():
+        yield {'type': 'sentence', 'text': sentence}
+
+
+def sse_stream(events):
+    """
+    Encodes assistant events (dicts with a 'type' key) as SSE frames.
+    """
+    for event in events:
+        payload = {key: value for key, value in event.items() if key != 'type'}
+        yield sse_event(event['type'], payload)
+
+
+async def astream_events(token_stream):
+    """
+    Async counterpart of `stream_events` for an async iterator of text deltas.
+    """
+    sentences = SentenceBuffer()
+    async for token in token_stream:
+        if not token:
+            continue
+        yield {'type': 'token', 'text': token}
+        for sentence in sentences.feed(token):
+            yield {'type': 'sentence', 'text': sentence}
+    for sentence in sentences.flush():
+        yield {'type': 'sentence', 'text': sentence}
+
+
+async def replay_tokens(tokens):
+    """
+    Wraps already-available text (e.g. a cached answer) as an async token stream.
+    """
+    for token in tokens:
+        yield token
+
+
+async def asse_stream(events):
+    """
+    Async counterpart of `sse_stream`.
+    """
+    async for event in events:
+        payload = {key: value for key, value in event.items() if key != 'type'}
+        yield sse_event(event['type'], payload)
@@ -0,0 +1,154 @@
+import atexit
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import connection
+from .answer_cache import normalize_query
+from .models import ChatQueryLog
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_CHAT = 'chat'
+ENDPOINT_WEBSITE = 'website'
+
+def query_log_row(endpoint, user_input, model_name, measurements, streamed=False):
+    """
+    Builds the (unsaved) ChatQueryLog row of one interaction.
+
+    Args:
+        endpoint (str): ENDPOINT_CHAT or ENDPOINT_WEBSITE.
+        user_input (str): The user's query, stored normalized.
+        model_name (str): The model that served the request.
+        measurements (dict): See `GPTAssistant.measurements`.
+        streamed (bool): Whether the answer was streamed.
+    """
+    max_length = ChatQueryLog._meta.get_field('normalized_query').max_length
+    return ChatQueryLog(
+        endpoint=endpoint,
+        normalized_query=normalize_query(user_input)[:max_length],
+        retrieved_ids=list(measurements.get('retrieved_ids') or []),
+        answer_cache_hit=bool(measurements.get('answer_cache_hit')),
+        retrieval_ms=measurements.get('retrieval_ms'),
+        llm_ms=measurements.get('llm_ms'),
+        prompt_tokens=measurements.get('prompt_tokens') or 0,
+        model_name=model_name or '',
+        streamed=streamed,
+    )
+
+class TelemetryWriter:
+    """
+    Buffers ChatQueryLog rows in memory and writes them with one bulk INSERT per
+    batch from a background thread, so a request never waits on the telemetry table.
+
+    Pending rows are written once `batch_size` of them have accumulated, at the
+    latest every `flush_interval` seconds, and when the process exits. While
+    `max_pending` rows are waiting (the database is slow or unavailable), new
+    rows are dropped and counted rather than held without bound.
+    """
+    def __init__(self, batch_size=100, flush_interval=5.0, max_pending=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            batch_size=settings.TELEMETRY_BATCH_SIZE,
+            flush_interval=settings.TELEMETRY_FLUSH_INTERVAL,
+            max_pending=settings.TELEMETRY_MAX_PENDING,
+        )
+
+    def record(self, row):
+        """
+        Queues a row for the next batch. Never touches the database, so it is
+        safe to call from async code.
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(row)
+            batch_ready = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if batch_ready:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Writes all pending rows, `batch_size` per INSERT.
+
+        Returns:
+            int: The number of rows written.
+        """
+        written = 0
+        while True:
+            with self._lock:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return written
+            try:
+                ChatQueryLog.objects.bulk_create(batch)
+            except Exception as e:
+                # Telemetry must never take the chat down; the batch is lost
+                with self._lock:
+                    self.failed += len(batch)
+                logger.warning("Could not write %d chat query log rows: %s", len(batch), e)
+                return written
+            written += len(batch)
+            with self._lock:
+                self.written += len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                # The thread would otherwise hold a database connection between flushes
+                connection.close()
+
+_telemetry_writer = None
+_telemetry_writer_lock = threading.Lock()
+
+def get_telemetry_writer():
+    """
+    Returns the process-wide `TelemetryWriter`, creating it on first use.
+    """
+    global _telemetry_writer
+    if _telemetry_writer is None:
+        with _telemetry_writer_lock:
+            if _telemetry_writer is None:
+                _telemetry_writer = TelemetryWriter.from_settings()
+    return _telemetry_writer
+
+def record_interaction(endpoint, user_input, model_name, measurements, streamed=False):
+    """
+    Queues the ChatQueryLog row of one interaction, when TELEMETRY_ENABLED.
+    """
+    if not settings.TELEMETRY_ENABLED:
+        return
+    try:
+        get_telemetry_writer().record(query_log_row(endpoint, user_input, model_name, measurements, streamed))
+    except Exception as e:
+        logger.warning("Could not record chat query telemetry: %s", e)
@@ -1,3 +1,839 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, override_settings
+from . import cache_warmup
+from .ai_models import AIModel, AIModelFactory, StreamInterrupted, provider_label
+from .answer_cache import AnswerCache
+from .conversation_store import ConversationStore, get_conversation_store
+from .gpt_assistant import GPTAssistant
+from .intent_router import (
+    IntentRouter, GREETING, THANKS, GOODBYE, YOUTUBE, NAVIGATE, QUESTION, CANNED_INTENTS, ROUTER_MODEL_NAME,
+    TRAINING_EXAMPLES,
+)
+from .llm_clients import ProviderClientRegistry
+from .management.commands.load_test import answer_failure
+from .metrics import atimed_stream, span
+from .models import ContentPassage, UniversalContent
+from .retrieval_cache import RetrievalCache, get_retrieval_cache
+from .routing import ProviderHealth, RoutedModel
+from .search_index import LoadedIndex, PassageSearchIndex
+from .signals import passages_stale, update_embedding
+from .single_flight import SingleFlight
+from .streaming import sse_event
+from .youtube_resolver import YouTubeLookup, YouTubeResolver
 
-# Create your tests here.
+class FakeModel(AIModel):
+    """
+    Provider stand-in answering `answer` (None for a failure) after `delay` seconds.
+    """
+    def __init__(self, answer, delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    def generate_response(self, content):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.answer
+
+    def stream_response(self, content):
+        self.calls += 1
+        if self.answer:
+            yield self.answer
+
+    async def agenerate_response(self, content):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.answer
+
+    async def astream_response(self, content):
+        self.calls += 1
+        if self.answer:
+            yield self.answer
+
+class HangingModel(FakeModel):
+    """
+    Provider whose stream sends nothing until `release` is set.
+    """
+    def __init__(self, answer):
+        super().__init__(answer)
+        self.release = threading.Event()
+
+    def stream_response(self, content):
+        self.calls += 1
+        self.release.wait(5)
+        yield self.answer
+
+    async def astream_response(self, content):
+        self.calls += 1
+        while not self.release.is_set():
+            await asyncio.sleep(0.01)
+        yield self.answer
+
+class InterruptedModel(FakeModel):
+    """
+    Provider whose stream fails after its first delta.
+    """
+    def stream_response(self, content):
+        yield self.answer
+        raise StreamInterrupted('connection reset')
+
+    async def astream_response(self, content):
+        yield self.answer
+        raise StreamInterrupted('connection reset')
+
+def routed_model(providers, **options):
+    with mock.patch('api.routing.AIModelFactory.get_model', side_effect=providers.get):
+        return RoutedModel(list(providers), **options)
+
+class ProviderHealthTests(SimpleTestCase):
+    def open_circuit(self, **options):
+        health = ProviderHealth('test', failure_threshold=2, cooldown=0.05, **options)
+        health.record(None, False)
+        health.record(None, False)
+        self.assertEqual(health.state, ProviderHealth.OPEN)
+        return health
+
+    def test_circuit_cycles_from_open_through_half_open_to_closed(self):
+        health = self.open_circuit()
+        self.assertFalse(health.available())
+        self.assertFalse(health.acquire())
+
+        time.sleep(0.06)
+        # Checking availability does not move the circuit
+        self.assertTrue(health.available())
+        self.assertTrue(health.available())
+        self.assertEqual(health.state, ProviderHealth.OPEN)
+
+        self.assertTrue(health.acquire())
+        self.assertEqual(health.state, ProviderHealth.HALF_OPEN)
+        # Only one trial request at a time
+        self.assertFalse(health.available())
+        self.assertFalse(health.acquire())
+
+        health.record(0.1, True)
+        self.assertEqual(health.state, ProviderHealth.CLOSED)
+        self.assertTrue(health.acquire())
+
+    def test_failed_trial_reopens_the_circuit(self):
+        health = self.open_circuit()
+        time.sleep(0.06)
+        self.assertTrue(health.acquire())
+        health.record(None, False)
+        self.assertEqual(health.state, ProviderHealth.OPEN)
+        self.assertFalse(health.available())
+
+    def test_abandoned_trial_frees_the_slot(self):
+        health = self.open_circuit()
+        time.sleep(0.06)
+        self.assertTrue(health.acquire())
+        health.abandon()
+        self.assertEqual(health.state, ProviderHealth.OPEN)
+        self.assertTrue(health.acquire())
+
+    def test_unanswered_trial_times_out(self):
+        health = self.open_circuit(probe_timeout=0.05)
+        time.sleep(0.06)
+        self.assertTrue(health.acquire())
+        self.assertFalse(health.acquire())
+        time.sleep(0.06)
+        self.assertTrue(health.acquire())
+
+class AIModelFactoryTests(SimpleTestCase):
+    @override_settings(LLM_ROUTING_PROVIDERS=['groq', 'gpt4'])
+    def test_auto_model_is_created_with_its_providers(self):
+        models = []
+        with mock.patch.dict(AIModelFactory._instances, clear=True):
+            creator = threading.Thread(target=lambda: models.append(AIModelFactory.get_model('auto')), daemon=True)
+            creator.start()
+            creator.join(5)
+            self.assertFalse(creator.is_alive(), "get_model('auto') deadlocked")
+            self.assertIsInstance(models[0], RoutedModel)
+            self.assertIs(models[0].providers['groq'], AIModelFactory.get_model('groq'))
+            self.assertIs(AIModelFactory.get_model('auto'), models[0])
+        models[0].executor.shutdown()
+
+class RoutedModelTests(SimpleTestCase):
+    def test_cooled_down_provider_stays_a_candidate_until_probed(self):
+        providers = {'a': FakeModel('from a'), 'b': FakeModel('from b'), 'c': FakeModel('from c')}
+        router = routed_model(providers, health_options={'failure_threshold': 1, 'cooldown': 0.05})
+        router.health['b'].record(None, False)
+        time.sleep(0.06)
+
+        for _ in range(5):
+            self.assertEqual(router.generate_response('question'), 'from a')
+            self.assertEqual(router.candidates(), ['a', 'b', 'c'])
+        self.assertEqual(router.health['b'].state, ProviderHealth.OPEN)
+
+        # Once the faster provider fails, the request reaches b as its trial and closes the circuit
+        providers['a'].answer = None
+        self.assertEqual(router.generate_response('question'), 'from b')
+        self.assertEqual(router.health['b'].state, ProviderHealth.CLOSED)
+
+    def test_cancelled_async_trial_does_not_leave_the_circuit_half_open(self):
+        providers = {'a': FakeModel('from a', delay=0.05), 'b': FakeModel('from b', delay=1.0)}
+        router = routed_model(providers, default_latency=0.01, min_hedge_delay=0.01,
+                              health_options={'failure_threshold': 1, 'cooldown': 0.0})
+        router.health['b'].record(None, False)
+
+        async def route():
+            result = await router.agenerate_response('question')
+            # Let the losing hedge process its cancellation
+            await asyncio.sleep(0.01)
+            return result
+
+        self.assertEqual(asyncio.run(route()), 'from a')
+        self.assertEqual(providers['b'].calls, 1)
+        self.assertEqual(router.health['b'].state, ProviderHealth.OPEN)
+        self.assertTrue(router.health['b'].available())
+
+    def test_stream_fails_over_before_the_first_token(self):
+        providers = {'a': FakeModel(None), 'b': FakeModel('streamed')}
+        router = routed_model(providers)
+        self.assertEqual(list(router.stream_response('question')), ['streamed'])
+        self.assertEqual(router.health['a'].consecutive_failures, 1)
+        self.assertEqual(router.health['b'].state, ProviderHealth.CLOSED)
+
+    def test_stream_fails_over_when_the_first_token_is_late(self):
+        providers = {'a': HangingModel('late'), 'b': FakeModel('streamed')}
+        self.addCleanup(providers['a'].release.set)
+        router = routed_model(providers, deadline=0.05)
+        started = time.monotonic()
+        self.assertEqual(list(router.stream_response('question')), ['streamed'])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(router.health['a'].consecutive_failures, 1)
+
+    def test_async_stream_fails_over_when_the_first_token_is_late(self):
+        providers = {'a': HangingModel('late'), 'b': FakeModel('streamed')}
+        router = routed_model(providers, deadline=0.05)
+
+        async def collect():
+            return [delta async for delta in router.astream_response('question')]
+
+        self.assertEqual(asyncio.run(collect()), ['streamed'])
+        self.assertEqual(router.health['a'].consecutive_failures, 1)
+
+    @mock.patch('api.metrics.SPAN_DURATION.observe')
+    def test_llm_span_is_labelled_with_the_provider_that_answered(self, observe):
+        router = routed_model({'a': FakeModel(None), 'b': FakeModel('from b')})
+        with span('llm', provider=provider_label(router, 'auto')):
+            self.assertEqual(router.generate_response('question'), 'from b')
+        with span('llm', provider=provider_label(router, 'auto')):
+            self.assertEqual(list(router.stream_response('question')), ['from b'])
+
+        async def stream():
+            return [delta async for delta in atimed_stream('llm', router.astream_response('question'),
+                                                           provider=provider_label(router, 'auto'))]
+
+        self.assertEqual(asyncio.run(stream()), ['from b'])
+        self.assertEqual([call.kwargs['provider'] for call in observe.call_args_list], ['b', 'b', 'b'])
+        self.assertEqual(provider_label(FakeModel('x'), 'groq')(), 'groq')
+
+    def test_stream_interrupted_mid_answer_counts_as_a_failure(self):
+        providers = {'a': InterruptedModel('partial'), 'b': FakeModel('streamed')}
+        router = routed_model(providers)
+        stream = router.stream_response('question')
+        self.assertEqual(next(stream), 'partial')
+        with self.assertRaises(StreamInterrupted):
+            next(stream)
+        self.assertEqual(router.health['a'].consecutive_failures, 1)
+        self.assertEqual(providers['b'].calls, 0)
+
+@mock.patch.object(GPTAssistant, 'retrieve_context_items', return_value=[])
+@mock.patch.object(GPTAssistant, 'get_cached_answer', return_value=None)
+class StreamedAnswerCachingTests(SimpleTestCase):
+    def assistant(self, model):
+        with mock.patch('api.gpt_assistant.AIModelFactory.get_model', return_value=model):
+            return GPTAssistant(model_name='fake')
+
+    def test_complete_stream_is_cached(self, *mocks):
+        assistant = self.assistant(FakeModel('A complete answer.'))
+        with mock.patch.object(GPTAssistant, 'cache_answer') as cache_answer:
+            events = list(assistant.stream_response('question'))
+        cache_answer.assert_called_once_with('question', [], 'A complete answer.', '')
+        self.assertEqual(events[-1]['type'], 'done')
+
+    def test_interrupted_stream_is_not_cached(self, *mocks):
+        assistant = self.assistant(InterruptedModel('A truncated'))
+        with mock.patch.object(GPTAssistant, 'cache_answer') as cache_answer:
+            events = list(assistant.stream_response('question'))
+        cache_answer.assert_not_called()
+        self.assertEqual(events[0], {'type': 'token', 'text': 'A truncated'})
+        self.assertEqual(events[-1]['type'], 'done')
+
+    def test_interrupted_async_stream_is_not_cached(self, *mocks):
+        assistant = self.assistant(InterruptedModel('A truncated'))
+
+        async def collect():
+            return [event async for event in assistant.astream_response('question')]
+
+        with mock.patch.object(GPTAssistant, 'aretrieve_context_items', return_value=[]), \
+                mock.patch.object(GPTAssistant, 'aget_cached_answer', return_value=None), \
+                mock.patch.object(GPTAssistant, 'acache_answer') as acache_answer:
+            events = asyncio.run(collect())
+        acache_answer.assert_not_called()
+        self.assertEqual(events[-1]['type'], 'done')
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AnswerCache(l2_enabled=False)
+
+    def test_near_identical_phrasings_share_an_answer(self):
+        self.cache.set('What services does Think41 offer?', [1, 2], 'gpt', 'Consulting.')
+        self.assertEqual(self.cache.get('what services does think41 offer', [2, 1], 'gpt'), 'Consulting.')
+        self.assertIsNone(self.cache.get('what services does think41 offer', [1, 3], 'gpt'))
+        self.assertIsNone(self.cache.get('what services does think41 offer', [1, 2], 'groq'))
+
+    def test_key_includes_the_conversation_history(self):
+        history = "User: Tell me about your AI demo\nAssistant: It answers questions by voice."
+        self.cache.set('how does it work', [1], 'gpt', 'It uses speech recognition.', history)
+        self.assertEqual(self.cache.get('how does it work', [1], 'gpt', history), 'It uses speech recognition.')
+        self.assertIsNone(self.cache.get('how does it work', [1], 'gpt'))
+        self.assertIsNone(self.cache.get('how does it work', [1], 'gpt', "User: Tell me about careers"))
+
+    def test_message_list_history_is_part_of_the_key(self):
+        history = [{'role': 'user', 'content': 'Tell me about your AI demo'},
+                   {'role': 'assistant', 'content': 'It answers questions by voice.'}]
+        self.cache.set('how does it work', [1], 'gpt', 'It uses speech recognition.', history)
+        self.assertEqual(self.cache.get('how does it work', [1], 'gpt', list(history)), 'It uses speech recognition.')
+        self.assertIsNone(self.cache.get('how does it work', [1], 'gpt', history[:1]))
+
+    def test_content_change_invalidates_its_answers(self):
+        self.cache.set('what is think41', [1, 2], 'gpt', 'An AI company.')
+        self.cache.set('who are your clients', [3], 'gpt', 'Startups.')
+        self.cache.invalidate_content(2)
+        self.assertIsNone(self.cache.get('what is think41', [1, 2], 'gpt'))
+        self.assertEqual(self.cache.get('who are your clients', [3], 'gpt'), 'Startups.')
+
+    def test_content_version_bump_from_another_process_hides_local_answers(self):
+        self.cache.set('what is think41', [1], 'gpt', 'An AI company.')
+        # As done by the post_save signal of whichever process changed the content
+        get_retrieval_cache().bump_version()
+        self.assertIsNone(self.cache.get('what is think41', [1], 'gpt'))
+        self.assertIsNone(self.cache.get('what is think41 exactly', [1], 'gpt'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+@override_settings(INTENT_ROUTER_ENABLED=False)
+class ChatHistoryTests(SimpleTestCase):
+    @mock.patch('api.telemetry.TelemetryWriter.record')
+    @mock.patch.object(GPTAssistant, 'retrieve_context_items', return_value=[])
+    def test_follow_up_with_message_list_context(self, *mocks):
+        context = [{'role': 'user', 'content': 'What are Autopods?'},
+                   {'role': 'assistant', 'content': 'Small product teams.'}]
+        with mock.patch('api.gpt_assistant.AIModelFactory.get_model', return_value=FakeModel('They ship fast.')):
+            for _ in range(2):
+                response = self.client.post('/api/chat/', {'user_input': 'How big are they?', 'context': context},
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.json()['response'].startswith('They ship fast.'))
+
+class IntentRouterTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.router = IntentRouter()
+
+    def assertIntents(self, intent, utterances):
+        for utterance in utterances:
+            with self.subTest(utterance=utterance):
+                self.assertEqual(self.router.classify(utterance).name, intent)
+
+    def test_rules(self):
+        self.assertIntents(GREETING, ["Hi!", "hello there", "Good morning, Echo", "hey how are you"])
+        self.assertIntents(THANKS, ["Thanks!", "ok thank you so much", "cheers"])
+        self.assertIntents(GOODBYE, ["bye", "See you later", "that's all, thanks"])
+
+    def test_youtube_command_extracts_the_search_term(self):
+        intent = self.router.classify("Play lofi beats on YouTube")
+        self.assertEqual((intent.name, intent.search_term), (YOUTUBE, 'lofi beats'))
+
+    def test_navigation_needs_an_explicit_go_to(self):
+        for utterance, page in [("take me to the services page", 'services'), ("Go to careers", 'careers'),
+                                ("navigate to about us", 'about'), ("please go back to the home page", 'home')]:
+            with self.subTest(utterance=utterance):
+                intent = self.router.classify(utterance)
+                self.assertEqual((intent.name, intent.page_name), (NAVIGATE, page))
+        self.assertIntents(QUESTION, ["show me your services", "open jobs", "switch to insights"])
+
+    def test_classifier_catches_small_talk_the_rules_miss(self):
+        for utterance, expected in [("how are you", GREETING), ("what's up", GREETING), ("morning", GREETING),
+                                    ("yo", GREETING), ("good night", GOODBYE), ("appreciate it", THANKS),
+                                    ("i'm done", GOODBYE), ("got it thanks", THANKS), ("good night echo", GOODBYE)]:
+            with self.subTest(utterance=utterance):
+                intent = self.router.classify(utterance)
+                self.assertEqual((intent.name, intent.source), (expected, 'model'))
+
+    def test_every_canned_training_utterance_is_routed(self):
+        for intent in CANNED_INTENTS:
+            self.assertIntents(intent, TRAINING_EXAMPLES[intent])
+
+    def test_topic_words_keep_small_talk_lookalikes_for_the_assistant(self):
+        self.assertIntents(QUESTION, [
+            "hi are you hiring", "how is it going with ai", "good evening how much does it cost",
+            "what's up with think41", "who are you", "tell me more",
+        ])
+
+    def test_knowledge_questions_reach_the_assistant(self):
+        self.assertIntents(QUESTION, [
+            "hi what do you do", "thanks what else do you offer", "what services do you offer",
+            "hello tell me about your services", "how does the ai demo work", "", "who founded think41",
+        ])
+
+@override_settings(INTENT_ROUTER_ENABLED=True, TELEMETRY_ENABLED=True)
+class RoutedTurnTests(SimpleTestCase):
+    def chat(self, path, **data):
+        return self.client.post(path, data, content_type='application/json')
+
+    @mock.patch('api.telemetry.TelemetryWriter.record')
+    def test_routed_turn_is_remembered_and_recorded(self, record):
+        response = self.chat('/api/chat/', user_input='Thanks!', session_id='routed-session')
+        self.assertEqual(response.json()['intent'], THANKS)
+        history = get_conversation_store().history('routed-session')
+        self.assertEqual([message['role'] for message in history], ['user', 'assistant'])
+        self.assertEqual(history[1]['content'], response.json()['response'])
+        row = record.call_args.args[0]
+        self.assertEqual((row.normalized_query, row.model_name, row.streamed), ('thanks', ROUTER_MODEL_NAME, False))
+
+    @mock.patch('api.telemetry.TelemetryWriter.record')
+    def test_routed_stream_is_remembered_and_recorded(self, record):
+        response = self.chat('/api/chat/stream/', user_input='bye', session_id='routed-stream-session')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: done', body)
+        self.assertEqual(len(get_conversation_store().history('routed-stream-session')), 2)
+        self.assertTrue(record.call_args.args[0].streamed)
+
+class CountingIndex:
+    loads = 0
+
+    def load(self):
+        CountingIndex.loads += 1
+        self.generation = CountingIndex.loads
+
+class LoadedIndexTests(SimpleTestCase):
+    def setUp(self):
+        CountingIndex.loads = 0
+        self.holder = LoadedIndex(CountingIndex)
+
+    def test_loads_once_until_the_content_version_changes(self):
+        index = self.holder.get()
+        self.assertIs(self.holder.get(), index)
+        self.assertEqual(CountingIndex.loads, 1)
+
+        # Bumped by the post_save signal of this or any other process
+        get_retrieval_cache().bump_version()
+        reloaded = self.holder.get()
+        self.assertIsNot(reloaded, index)
+        self.assertEqual(reloaded.generation, 2)
+        self.assertIs(self.holder.get(), reloaded)
+
+    def test_async_get_reloads_after_a_content_change(self):
+        async def get():
+            return await self.holder.aget()
+
+        index = asyncio.run(get())
+        self.assertIs(asyncio.run(get()), index)
+        get_retrieval_cache().bump_version()
+        self.assertEqual(asyncio.run(get()).generation, 2)
+
+    def test_change_applied_in_process_does_not_reload(self):
+        index = self.holder.get()
+        changed = []
+        self.holder.apply(changed.append, get_retrieval_cache().bump_version())
+        self.assertEqual(changed, [index])
+        self.assertIs(self.holder.get(), index)
+        self.assertEqual(CountingIndex.loads, 1)
+
+    def test_change_missed_from_another_process_still_reloads(self):
+        index = self.holder.get()
+        get_retrieval_cache().bump_version()
+        self.holder.apply(None, get_retrieval_cache().bump_version())
+        self.assertIsNot(self.holder.get(), index)
+
+    def test_searches_keep_the_previous_index_while_another_thread_reloads(self):
+        index = self.holder.get()
+        get_retrieval_cache().bump_version()
+        with self.holder._lock:
+            self.assertIs(self.holder.get(), index)
+        self.assertEqual(self.holder.get().generation, 2)
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lock_dir)
+        self.single_flight = SingleFlight(self.lock_dir, wait_timeout=5)
+
+    def age(self, path):
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+
+    def test_concurrent_calls_share_one_computation(self):
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'response': 'shared'}
+
+        threads = [threading.Thread(target=lambda: results.append(self.single_flight.do('key', compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'response': 'shared'}] * 5)
+
+    def test_async_calls_share_one_computation(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'shared'
+
+        async def run():
+            return await asyncio.gather(*(self.single_flight.ado('key', compute) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ['shared'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_prune_keeps_lock_files_held_by_a_leader(self):
+        held_path, idle_path = self.single_flight._paths('held')[0], self.single_flight._paths('idle')[0]
+        result_path = self.single_flight._paths('idle')[1]
+        held = self.single_flight._try_lock(held_path)
+        self.single_flight._try_lock(idle_path).close()
+        with open(result_path, 'w') as f:
+            f.write('{}')
+        for path in (held_path, idle_path, result_path):
+            self.age(path)
+
+        self.single_flight._prune()
+        self.assertEqual(os.listdir(self.lock_dir), [os.path.basename(held_path)])
+        # The leader still holds its lock
+        self.assertIsNone(self.single_flight._try_lock(held_path))
+        held.close()
+        relocked = self.single_flight._try_lock(held_path)
+        self.assertIsNotNone(relocked)
+        relocked.close()
+
+class BatchSearchTests(SimpleTestCase):
+    @mock.patch.object(GPTAssistant, 'search_relevant_content_batch')
+    def test_non_numeric_limit_is_a_bad_request(self, search):
+        for limit in ('many', None, [5]):
+            with self.subTest(limit=limit):
+                response = self.client.post('/api/search/batch/', {'queries': ['ai'], 'limit': limit},
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        search.assert_not_called()
+
+    def test_candidates_are_capped_per_query_in_the_database(self):
+        statements = []
+
+        def fetch(queryset):
+            statements.append(queryset.query.sql_with_params())
+            queryset._result_cache = []
+
+        with mock.patch('api.gpt_assistant.AIModelFactory.get_model'), \
+                mock.patch.object(QuerySet, '_fetch_all', fetch):
+            assistant = GPTAssistant(model_name='fake')
+            self.assertEqual(assistant._batch_search(['ai services', 'careers'], 7), {'ai services': [], 'careers': []})
+        sql, params = statements[0]
+        self.assertIn('ROW_NUMBER() OVER', sql)
+        self.assertTrue(sql.endswith('"best_position" <= %s'))
+        self.assertEqual(params[-1], 7)
+        self.assertIn('"matches_1"', sql)
+
+    def test_queries_only_return_their_own_candidates(self):
+        def row(pk, **ranks):
+            row = UniversalContent(pk=pk, title=f'Row {pk}', content='', content_type='faq')
+            for i, (matches, rank) in enumerate(ranks.values()):
+                setattr(row, f'matches_{i}', matches)
+                for name in ('search_rank', 'title_rank', 'content_rank', 'trigram_similarity_title',
+                             'trigram_similarity_content', 'combined_rank'):
+                    setattr(row, f'{name}_{i}', rank)
+            return row
+
+        # Row 1 only matches the first query, row 2 only the second; row 1 still has a
+        # trigram rank against the second query that its own search would never see
+        rows = [row(1, first=(True, 0.9), second=(False, 0.4)), row(2, first=(False, 0.3), second=(True, 0.2))]
+
+        def fetch(queryset):
+            queryset._result_cache = rows
+
+        with mock.patch('api.gpt_assistant.AIModelFactory.get_model'), \
+                mock.patch.object(QuerySet, '_fetch_all', fetch):
+            ranked = GPTAssistant(model_name='fake')._batch_search(['autopods', 'careers'], 5)
+        self.assertEqual([result.pk for result in ranked['autopods']], [1])
+        self.assertEqual([result.pk for result in ranked['careers']], [2])
+        self.assertEqual(ranked['careers'][0].combined_rank, 0.2)
+
+class LoadTestFailureTests(SimpleTestCase):
+    fallback = "I apologize, but I'm having trouble generating a response at the moment."
+
+    def test_json_fallback_answer_is_a_failure(self):
+        self.assertIsNone(answer_failure(b'{"response": "Think41 builds AI products."}', stream=False))
+        self.assertEqual(answer_failure(f'{{"response": "{self.fallback}"}}'.encode(), stream=False), 'fallback answer')
+        self.assertEqual(answer_failure(b'<html>', stream=False), 'malformed body')
+
+    def test_stream_is_judged_by_its_done_event(self):
+        tokens = sse_event('token', {'text': 'Think41'})
+        self.assertIsNone(answer_failure((tokens + sse_event('done', {'response': 'Think41'})).encode(), stream=True))
+        self.assertEqual(answer_failure((tokens + sse_event('done', {'response': self.fallback})).encode(), stream=True),
+                         'fallback answer')
+        self.assertEqual(answer_failure(tokens.encode(), stream=True), 'no done event')
+
+class PassageRebuildTests(SimpleTestCase):
+    def saved_row(self, **fields):
+        row = UniversalContent(pk=1, title='Services', content='We build AI products.', content_type='company_info', **fields)
+        row._state.adding = False
+        return row
+
+    def stored(self, *values):
+        return mock.patch.object(UniversalContent.objects, 'filter', return_value=mock.Mock(
+            values_list=mock.Mock(return_value=mock.Mock(first=mock.Mock(return_value=values)))
+        ))
+
+    @override_settings(RETRIEVAL_UNIT='content')
+    def test_content_retrieval_never_rebuilds(self):
+        self.assertFalse(passages_stale(UniversalContent(title='New', content='Text.'), None))
+
+    @override_settings(RETRIEVAL_UNIT='passage')
+    def test_only_source_field_changes_rebuild(self):
+        self.assertTrue(passages_stale(UniversalContent(title='New', content='Text.'), None))
+        self.assertFalse(passages_stale(self.saved_row(), frozenset({'metadata'})))
+        with self.stored('Services', 'We build AI products.', 'company_info'):
+            self.assertFalse(passages_stale(self.saved_row(), None))
+        with self.stored('Services', 'We build software.', 'company_info'):
+            self.assertTrue(passages_stale(self.saved_row(), None))
+
+class PassageSearchTests(SimpleTestCase):
+    def test_dominant_source_does_not_crowd_out_the_others(self):
+        index = PassageSearchIndex(max_per_source=2)
+        for position in range(10):
+            index.update(ContentPassage(pk=position + 1, source_id=1, position=position, title='Autopods',
+                                        content='Autopods autopods autopods are small product teams.'))
+        for source_id in (2, 3, 4):
+            index.update(ContentPassage(pk=100 + source_id, source_id=source_id, position=0, title='Services',
+                                        content='We also staff autopods for clients.'))
+        results = index.search('autopods', k=4)
+        self.assertEqual([passage.source_id for passage in results[:2]], [1, 1])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len({passage.source_id for passage in results}), 3)
+
+@override_settings(SEARCH_BACKEND='hybrid')
+class EmbeddingSignalTests(SimpleTestCase):
+    def test_saved_values_are_embedded_after_commit(self):
+        instance = UniversalContent(pk=7, title='Autopods', content='Small product teams.', content_type='faq')
+        committed = []
+        with mock.patch('api.signals.transaction.on_commit', side_effect=committed.append), \
+                mock.patch('api.embeddings.get_embedder') as get_embedder, \
+                mock.patch.object(UniversalContent.objects, 'filter') as rows:
+            get_embedder.return_value.embed.return_value = [[1.0, 0.0]]
+            update_embedding(UniversalContent, instance)
+            get_embedder.return_value.embed.assert_not_called()
+
+            instance.title = 'Changed after the save'
+            committed[0]().result(timeout=5)
+        get_embedder.return_value.embed.assert_called_once_with(['Autopods\nSmall product teams.'])
+        rows.assert_called_once_with(pk=7)
+
+class RetrievalCacheTests(SimpleTestCase):
+    def test_results_read_before_a_content_change_are_not_served_after_it(self):
+        cache = RetrievalCache()
+        version = cache.version()
+        self.assertIsNone(cache.get('postgres', 'ai services', version))
+        cache.bump_version()
+        cache.set('postgres', 'ai services', [(1, 0.5)], version)
+        self.assertIsNone(cache.get('postgres', 'ai services', cache.version()))
+        self.assertEqual(cache.get('postgres', 'ai services', version), [(1, 0.5)])
+
+    def test_version_is_read_from_l2_at_most_once_per_ttl(self):
+        cache, other_process = RetrievalCache(version_ttl=0.05), RetrievalCache()
+        version = cache.version()
+        with mock.patch.object(cache.l2, 'get', wraps=cache.l2.get) as l2_get:
+            for _ in range(3):
+                self.assertEqual(cache.version(), version)
+            l2_get.assert_not_called()
+        # Another process's change is noticed once the local copy expires
+        other_process.bump_version()
+        self.assertEqual(cache.version(), version)
+        time.sleep(0.06)
+        self.assertEqual(cache.version(), version + 1)
+        # This process's own changes are seen at once
+        self.assertEqual(cache.bump_version(), version + 2)
+        self.assertEqual(cache.version(), version + 2)
+
+    @override_settings(SEARCH_BACKEND='postgres', RETRIEVAL_CACHE_ENABLED=True)
+    def test_lookup_reads_the_version_once(self):
+        cache = RetrievalCache()
+        with mock.patch('api.gpt_assistant.AIModelFactory.get_model'), \
+                mock.patch('api.gpt_assistant.get_retrieval_cache', return_value=cache), \
+                mock.patch.object(GPTAssistant, '_search_queryset', return_value=[]), \
+                mock.patch.object(RetrievalCache, 'version', return_value=7) as version:
+            self.assertEqual(GPTAssistant(model_name='fake').search_relevant_content('AI services'), [])
+        version.assert_called_once_with()
+        self.assertEqual(cache.get('postgres', 'ai services', 7), [])
+
+class ScheduledWarmupTests(SimpleTestCase):
+    def tearDown(self):
+        with mock.patch.object(cache_warmup, 'warm_from_settings'):
+            cache_warmup.flush_pending_warmup()
+
+    @mock.patch.object(cache_warmup, 'warm_from_settings')
+    def test_burst_of_changes_warms_once(self, warm):
+        for _ in range(3):
+            cache_warmup.schedule_warmup(delay=0.05)
+        time.sleep(0.3)
+        cache_warmup.flush_pending_warmup()
+        warm.assert_called_once_with(None)
+
+    @mock.patch.object(cache_warmup, 'warm_from_settings')
+    def test_pending_warmup_runs_at_exit(self, warm):
+        cache_warmup.schedule_warmup(delay=60)
+        warm.assert_not_called()
+        cache_warmup.flush_pending_warmup()
+        warm.assert_called_once_with(1)
+        cache_warmup.flush_pending_warmup()
+        warm.assert_called_once_with(1)
+
+class ProviderClientRegistryTests(SimpleTestCase):
+    def test_async_clients_are_per_loop_and_dropped_with_closed_loops(self):
+        registry = ProviderClientRegistry()
+
+        async def clients():
+            return registry.async_client('openai', 'https://api.example.com'), \
+                registry.async_client('openai', 'https://api.example.com')
+
+        first_loop, second_loop = asyncio.new_event_loop(), asyncio.new_event_loop()
+        self.addCleanup(second_loop.close)
+        first, again = first_loop.run_until_complete(clients())
+        self.assertIs(first, again)
+        first_loop.close()
+        second, _ = second_loop.run_until_complete(clients())
+        self.assertIsNot(second, first)
+        self.assertEqual(list(registry._loop_clients), [second_loop])
+        self.assertEqual(registry.stats()['clients'], 1)
+
+class SlowResolver(YouTubeResolver):
+    def __init__(self, url='https://youtu.be/abc'):
+        self.url = url
+        self.calls = 0
+        self.release = threading.Event()
+
+    def resolve(self, search_term):
+        self.calls += 1
+        self.release.wait(5)
+        return self.url
+
+class YouTubeLookupTests(SimpleTestCase):
+    def lookup(self, resolver, **kwargs):
+        lookup = YouTubeLookup(resolver, **kwargs)
+        self.addCleanup(lookup._executor.shutdown, wait=True)
+        self.addCleanup(resolver.release.set)
+        return lookup
+
+    def test_repeated_and_rephrased_terms_are_served_from_the_cache(self):
+        resolver = SlowResolver()
+        resolver.release.set()
+        lookup = self.lookup(resolver)
+        self.assertEqual(lookup.get('Despacito'), 'https://youtu.be/abc')
+        self.assertEqual(lookup.get('  despacito '), 'https://youtu.be/abc')
+        self.assertEqual(resolver.calls, 1)
+        self.assertEqual(lookup.stats()['hits'], 1)
+
+    def test_slow_lookup_times_out_and_still_fills_the_cache(self):
+        resolver = SlowResolver()
+        lookup = self.lookup(resolver, timeout=0.05)
+        self.assertIsNone(lookup.get('despacito'))
+        self.assertEqual(lookup.stats()['timeouts'], 1)
+        resolver.release.set()
+        lookup._executor.shutdown(wait=True)
+        self.assertEqual(lookup.get('despacito'), 'https://youtu.be/abc')
+        self.assertEqual(resolver.calls, 1)
+
+    def test_concurrent_lookups_share_one_resolver_call(self):
+        resolver = SlowResolver()
+        lookup = self.lookup(resolver)
+
+        async def lookups():
+            pending = asyncio.gather(*(lookup.aget('despacito') for _ in range(5)))
+            await asyncio.sleep(0.05)
+            resolver.release.set()
+            return await pending
+
+        self.assertEqual(asyncio.run(lookups()), ['https://youtu.be/abc'] * 5)
+        self.assertEqual(resolver.calls, 1)
+
+    def test_failures_are_cached_briefly(self):
+        resolver = SlowResolver(url=None)
+        resolver.release.set()
+        lookup = self.lookup(resolver, failure_ttl=0.05)
+        self.assertIsNone(lookup.get('nothing'))
+        self.assertIsNone(lookup.get('nothing'))
+        self.assertEqual(resolver.calls, 1)
+        time.sleep(0.1)
+        lookup.get('nothing')
+        self.assertEqual(resolver.calls, 2)
+
+class ConversationFoldingTests(SimpleTestCase):
+    def store(self, summarize):
+        return ConversationStore(recent_turns=2, summary_batch=2, summarize=summarize)
+
+    def wait_for_folds(self, store):
+        store._summary_executor().shutdown(wait=True)
+        store._executor = None
+
+    def test_old_turns_are_folded_into_the_summary(self):
+        folds = []
+
+        def summarize(summary, turns):
+            folds.append((summary, turns))
+            return f"{summary} [{len(turns)} turns]".strip()
+
+        store = self.store(summarize)
+        store.record_exchange('s', 'hi', 'hello')
+        store.record_exchange('s', 'services?', 'AI products')
+        self.wait_for_folds(store)
+        self.assertEqual(folds, [("", [('user', 'hi'), ('assistant', 'hello')])])
+        self.assertEqual(store.history('s'), [
+            {'role': 'summary', 'content': '[2 turns]'},
+            {'role': 'user', 'content': 'services?'},
+            {'role': 'assistant', 'content': 'AI products'},
+        ])
+
+    def test_failed_fold_keeps_the_turns_and_retries(self):
+        results = [None, 'they said hi']
+        store = self.store(lambda summary, turns: results.pop(0))
+        store.record_exchange('s', 'hi', 'hello')
+        store.record_exchange('s', 'services?', 'AI products')
+        self.wait_for_folds(store)
+        self.assertEqual(len(store.history('s')), 4)
+        store.record_exchange('s', 'careers?', 'We are hiring')
+        self.wait_for_folds(store)
+        history = store.history('s')
+        self.assertEqual(history[0], {'role': 'summary', 'content': 'they said hi'})
+        self.assertEqual([message['content'] for message in history[1:]], ['careers?', 'We are hiring'])
+
+    def test_turns_recorded_during_a_fold_are_kept(self):
+        release = threading.Event()
+
+        def summarize(summary, turns):
+            release.wait(5)
+            return 'summary'
+
+        store = self.store(summarize)
+        store.record_exchange('s', 'hi', 'hello')
+        store.record_exchange('s', 'services?', 'AI products')
+        store.record_exchange('s', 'careers?', 'We are hiring')
+        release.set()
+        self.wait_for_folds(store)
+        self.assertEqual(
+            [message['content'] for message in store.history('s')],
+            ['summary', 'services?', 'AI products', 'careers?', 'We are hiring'],
+        )
@@ -9,9 +9,24 @@ from .tour_views import (
 from .content_views import get_content
 from .user_views import user_login, user_logout
 from .analytics_views import get_tour_analytics, get_detailed_analytics
-from .youtube_views import handle_youtube_command
+from .youtube_views import handle_youtube_command, ahandle_youtube_command
 from .ppt_presenter import get_ppt_data
-from .website_call import website_interaction  # Add this import
+from .website_call import (
+    website_interaction, website_interaction_stream,
+    awebsite_interaction, awebsite_interaction_stream
+)
+
+# Under ASGI (see config/asgi.py) the chat pipeline is served by its async views
+if settings.ASYNC_VIEWS:
+    chat_view, chat_stream_view = views.achat_interaction, views.achat_interaction_stream
+    gpt_assistant_view = views.agpt_assistant_view
+    website_view, website_stream_view = awebsite_interaction, awebsite_interaction_stream
+    youtube_view = ahandle_youtube_command
+else:
+    chat_view, chat_stream_view = views.chat_interaction, views.chat_interaction_stream
+    gpt_assistant_view = views.gpt_assistant_view
+    website_view, website_stream_view = website_interaction, website_interaction_stream
+    youtube_view = handle_youtube_command
 
 urlpatterns = [
     # Tour related endpoints
@@ -21,13 +36,14 @@ urlpatterns = [
     # path('tour-steps/', views.get_tour_steps, name='get_tour_steps'),
     
     # Chat interaction endpoint
-    path('chat/', views.chat_interaction, name='chat_interaction'),
+    path('chat/', chat_view, name='chat_interaction'),
+    path('chat/stream/', chat_stream_view, name='chat_interaction_stream'),
     
     # Initial page endpoint
     # path('initial-page/', views.get_initial_page, name='get_initial_page'),
     
     # YouTube command endpoint
-    path('youtube/', handle_youtube_command, name='handle_youtube_command'),
+    path('youtube/', youtube_view, name='handle_youtube_command'),
     
     # # User related endpoints
     # path('login/', user_login, name='user_login'),
@@ -51,20 +67,29 @@ urlpatterns = [
     path('navigate/<str:page_name>/', navigate_to_page, name='navigate_to_page'),
     
     # Interaction related unused endpoints
-    path('gpt-assistant/', views.gpt_assistant_view, name='gpt_assistant'),
+    path('gpt-assistant/', gpt_assistant_view, name='gpt_assistant'),
     
     # Analytics related unused endpoints
     path('tour/analytics/', get_tour_analytics, name='get_tour_analytics'),
     path('analytics/detailed/', get_detailed_analytics, name='get_detailed_analytics'),
     
+    # LLM provider connection pool and prompt cache stats
+    path('llm/pool-stats/', views.llm_pool_stats, name='llm_pool_stats'),
+    path('llm/prompt-stats/', views.llm_prompt_stats, name='llm_prompt_stats'),
+
+    # Prometheus metrics: latency histograms by endpoint and provider, pool stats
+    path('metrics/', views.prometheus_metrics, name='prometheus_metrics'),
+    
     # Search related unused endpoints
     path('search/', views.search_universal_content, name='search_universal_content'),
+    path('search/batch/', views.search_universal_content_batch, name='search_universal_content_batch'),
     
     # PPT data related unused endpoints
     path('ppt-data/', get_ppt_data, name='get_ppt_data'),
     
     # Website interaction endpoint
-    path('website-interaction/', website_interaction, name='website_interaction'),
+    path('website-interaction/', website_view, name='website_interaction'),
+    path('website-interaction/stream/', website_stream_view, name='website_interaction_stream'),
 
 ]
 
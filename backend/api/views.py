@@ -1,10 +1,18 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from .models import TourStep, UniversalContent
 from .gpt_assistant import GPTAssistant
+from .streaming import sse_stream, asse_stream
+from .async_utils import async_post_view
+from .llm_clients import get_client_registry
+from .prompt_templates import usage_stats
+from .metrics import span, render_metrics
+from .telemetry import record_interaction, ENDPOINT_CHAT
+from .intent_router import get_intent_router, routed_events, record_routed_turn
 import json
 import logging
 
@@ -17,30 +25,146 @@ def chat_interaction(request):
     data = json.loads(request.body)
     user_input = data.get('user_input')
     context = data.get('context', '')
-    model_name = data.get('model_name', '4o-mini')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+    session_id = data.get('session_id')
+
+    # Small talk, YouTube and navigation turns are answered without the LLM
+    routed = get_intent_router().route(user_input) if settings.INTENT_ROUTER_ENABLED else None
+    if routed is not None:
+        record_routed_turn(user_input, session_id, routed)
+        with span('render'):
+            return JsonResponse(routed)
     
     assistant = GPTAssistant(model_name=model_name)
-    response = assistant.generate_response(user_input, context)
+    response = assistant.generate_response(user_input, context, session_id=session_id)
+    record_interaction(ENDPOINT_CHAT, user_input, model_name, assistant.measurements())
+
+    with span('render'):
+        return JsonResponse({
+            'response': response['response'],
+            'has_more_info': response['has_more_info']
+        })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def chat_interaction_stream(request):
+    """
+    Server-Sent Events variant of `chat_interaction`. Emits 'token' events as the
+    provider streams, 'sentence' events at each sentence boundary and a final 'done'
+    event with the same payload as the JSON endpoint.
+    """
+    data = json.loads(request.body)
+    user_input = data.get('user_input')
+    context = data.get('context', '')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+    session_id = data.get('session_id')
+
+    routed = get_intent_router().route(user_input) if settings.INTENT_ROUTER_ENABLED else None
+    assistant = GPTAssistant(model_name=model_name)
+
+    def events():
+        if routed is not None:
+            yield from routed_events(routed)
+            record_routed_turn(user_input, session_id, routed, streamed=True)
+            return
+        yield from assistant.stream_response(user_input, context, session_id=session_id)
+        record_interaction(ENDPOINT_CHAT, user_input, model_name, assistant.measurements(), streamed=True)
 
-    return JsonResponse({
-        'response': response['response'],
-        'has_more_info': response['has_more_info']
-    })
+    response = StreamingHttpResponse(sse_stream(events()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def gpt_assistant_view(request):
     data = json.loads(request.body)
     prompt = data.get('prompt')
-    model_name = data.get('model_name', '4o-mini')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
     
     assistant = GPTAssistant(model_name=model_name)
     response = assistant.generate_response(prompt)
+    record_interaction(ENDPOINT_CHAT, prompt, model_name, assistant.measurements())
+
+    with span('render'):
+        return JsonResponse({
+            'response': response['response']
+        })
+
+
+@async_post_view
+async def achat_interaction(request):
+    """
+    Async counterpart of `chat_interaction`, served when running under ASGI.
+    """
+    data = json.loads(request.body)
+    user_input = data.get('user_input')
+    context = data.get('context', '')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+    session_id = data.get('session_id')
+
+    routed = await get_intent_router().aroute(user_input) if settings.INTENT_ROUTER_ENABLED else None
+    if routed is not None:
+        record_routed_turn(user_input, session_id, routed)
+        with span('render'):
+            return JsonResponse(routed)
+
+    assistant = GPTAssistant(model_name=model_name)
+    response = await assistant.agenerate_response(user_input, context, session_id=session_id)
+    record_interaction(ENDPOINT_CHAT, user_input, model_name, assistant.measurements())
+
+    with span('render'):
+        return JsonResponse({
+            'response': response['response'],
+            'has_more_info': response['has_more_info']
+        })
+
+@async_post_view
+async def achat_interaction_stream(request):
+    """
+    Async counterpart of `chat_interaction_stream`.
+    """
+    data = json.loads(request.body)
+    user_input = data.get('user_input')
+    context = data.get('context', '')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+    session_id = data.get('session_id')
+
+    routed = await get_intent_router().aroute(user_input) if settings.INTENT_ROUTER_ENABLED else None
+    assistant = GPTAssistant(model_name=model_name)
 
-    return JsonResponse({
-        'response': response['response']
-    })
+    async def events():
+        if routed is not None:
+            for event in routed_events(routed):
+                yield event
+            record_routed_turn(user_input, session_id, routed, streamed=True)
+            return
+        async for event in assistant.astream_response(user_input, context, session_id=session_id):
+            yield event
+        record_interaction(ENDPOINT_CHAT, user_input, model_name, assistant.measurements(), streamed=True)
+
+    response = StreamingHttpResponse(asse_stream(events()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@async_post_view
+async def agpt_assistant_view(request):
+    """
+    Async counterpart of `gpt_assistant_view`.
+    """
+    data = json.loads(request.body)
+    prompt = data.get('prompt')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+
+    assistant = GPTAssistant(model_name=model_name)
+    response = await assistant.agenerate_response(prompt)
+    record_interaction(ENDPOINT_CHAT, prompt, model_name, assistant.measurements())
 
+    with span('render'):
+        return JsonResponse({
+            'response': response['response']
+        })
 
 
 # @api_view(['GET'])
@@ -65,6 +189,15 @@ def gpt_assistant_view(request):
 #         logger.error(f"Error in get_tour_steps: {str(e)}", exc_info=True)
 #         return Response({"error": "An error occurred while fetching tour steps"}, status=500)
 
+def serialize_search_result(content):
+    return {
+        'id': content.id,
+        'title': content.title,
+        'content': content.content,
+        'content_type': content.content_type,
+        'metadata': content.metadata
+    }
+
 # Add a new view to search universal content
 @api_view(['GET'])
 def search_universal_content(request):
@@ -72,18 +205,55 @@ def search_universal_content(request):
     try:
         assistant = GPTAssistant()
         relevant_content = assistant.search_relevant_content(query)
-        data = [{
-            'id': content.id,
-            'title': content.title,
-            'content': content.content,
-            'content_type': content.content_type,
-            'metadata': content.metadata
-        } for content in relevant_content]
+        with span('render'):
+            data = [serialize_search_result(content) for content in relevant_content]
         return Response(data)
     except Exception as e:
-        logger.error(f"Error in search_universal_content: {str(e)}", exc_info=True)
+        logger.error("Error in search_universal_content: %s", e, exc_info=True)
         return Response({"error": "An error occurred while searching content"}, status=500)
 
+@api_view(['POST'])
+def search_universal_content_batch(request):
+    """
+    Batch variant of `search_universal_content`: takes {"queries": [...], "limit": 5}
+    and returns the results keyed by query, fetched and ranked in one database query.
+    """
+    queries = request.data.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return Response({"error": "'queries' must be a list of strings"}, status=400)
+    if len(queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+        return Response({"error": f"At most {settings.SEARCH_BATCH_MAX_QUERIES} queries per batch"}, status=400)
+    try:
+        limit = max(1, min(int(request.data.get('limit', 5)), 20))
+    except (TypeError, ValueError):
+        return Response({"error": "'limit' must be an integer"}, status=400)
+    try:
+        assistant = GPTAssistant()
+        results = assistant.search_relevant_content_batch(queries, k=limit)
+        with span('render'):
+            data = {
+                query: [serialize_search_result(content) for content in relevant_content]
+                for query, relevant_content in results.items()
+            }
+        return Response(data)
+    except Exception as e:
+        logger.error("Error in search_universal_content_batch: %s", e, exc_info=True)
+        return Response({"error": "An error occurred while searching content"}, status=500)
+
+@require_http_methods(["GET"])
+def llm_pool_stats(request):
+    return JsonResponse(get_client_registry().stats())
+
+@require_http_methods(["GET"])
+def llm_prompt_stats(request):
+    # Provider-reported prompt prefix cache usage per prompt template
+    return JsonResponse(usage_stats())
+
+@require_http_methods(["GET"])
+def prometheus_metrics(request):
+    # Request and span latency histograms plus pool and cache counters of this process
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def get_initial_page(request):
     initial_step = TourStep.objects.filter(is_active=True).order_by('order').first()
     if initial_step:
@@ -1,54 +1,141 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 import json
 from .gpt_assistant import GPTAssistant
-from .ai_models import AIModelFactory
+from .ai_models import AIModelFactory, StreamInterrupted, get_last_usage, provider_label
+from .streaming import stream_events, sse_stream, astream_events, asse_stream
+from .async_utils import async_post_view
+from .prompt_builder import PromptBuilder, count_tokens
+from .prompt_templates import WEBSITE_TEMPLATE, record_usage
+from .metrics import span, timed, timed_stream, atimed_stream, SpanTiming
+from .log_handlers import PROMPT_LOG
+from .telemetry import record_interaction, ENDPOINT_WEBSITE
 import logging
 import random
 
 logger = logging.getLogger(__name__)
 
-def generate_response_website(user_input, relevant_content, current_page, model_name):
-    ai_model = AIModelFactory.get_model(model_name)
-    
-    context = "\n".join([f"{content.title}:\n{content.content}" for content in relevant_content])
+ENGAGEMENT_PHRASES = [
+    "Is there anything else you'd like to know about Think41?",
+    "How else can I assist you with information about our services?",
+    "Do you have any other questions about Think41's expertise?",
+    "What other aspects of our company would you like to explore?",
+]
+
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble generating a response. Is there a specific aspect of Think41 or our services you'd like to know more about?"
+
+@timed('prompt')
+def build_website_prompt(user_input, relevant_content, current_page):
+    # Fill the context token budget in rank order
+    context, context_tokens = PromptBuilder.from_settings().build_context(relevant_content, separator="\n")
     
-    prompt = f"""You are an AI assistant for Think41, a technology consulting company with a product mindset. Your role is to provide helpful information about Think41 and assist users navigating the website. Maintain a professional, friendly, and concise tone.
+    # The static instructions and guidelines come first so providers can cache them
+    prompt = WEBSITE_TEMPLATE.render(current_page=current_page, context=context, user_input=user_input)
 
-Current page: {current_page}
+    prompt_tokens = WEBSITE_TEMPLATE.static_tokens + count_tokens(prompt[len(WEBSITE_TEMPLATE.static):])
+    logger.info("Website prompt tokens: %d (retrieved content: %d)", prompt_tokens, context_tokens, extra=PROMPT_LOG)
+    return prompt, prompt_tokens
 
-User query: '{user_input}'
+def report_website_prompt_usage():
+    cached_prefix_fraction = record_usage(WEBSITE_TEMPLATE.name, get_last_usage())
+    if cached_prefix_fraction is not None:
+        logger.info("Provider served %.0f%% of the website prompt from its prefix cache", cached_prefix_fraction * 100, extra=PROMPT_LOG)
 
-Relevant information from the database:
-{context}
+def finalize_website_response(ai_response):
+    if ai_response and ai_response.strip():
+        return f"{ai_response.strip()}\n\n{random.choice(ENGAGEMENT_PHRASES)}"
+    return FALLBACK_RESPONSE
 
-Guidelines:
-1. Provide a concise response (50-100 words) that directly addresses the user's query.
-2. Use the relevant information provided to answer the query accurately.
-3. If the user asks for additional information about a section, elaborate on the details from the relevant content.
-4. Focus on Think41's services, expertise, and how they can help businesses.
-5. If asked about specific pages or navigation, provide clear and brief instructions.
-6. For questions not related to Think41 or the website, politely redirect the conversation.
-7. If the information isn't available in the context, suggest contacting Think41 for more details.
+def measure_website_response(measurements, llm, prompt_tokens):
+    # Adds the completion's cost to the measurements of the retrieval, see api/telemetry.py
+    if measurements is not None:
+        measurements.update(llm_ms=llm.ms, prompt_tokens=prompt_tokens)
 
-Response:"""
+def generate_response_website(user_input, relevant_content, current_page, model_name, measurements=None):
+    ai_model = AIModelFactory.get_model(model_name)
+    prompt, prompt_tokens = build_website_prompt(user_input, relevant_content, current_page)
+    with span('llm', provider=provider_label(ai_model, model_name)) as llm:
+        ai_response = ai_model.generate_response(prompt)
+    measure_website_response(measurements, llm, prompt_tokens)
+    report_website_prompt_usage()
+    return finalize_website_response(ai_response)
 
-    ai_response = ai_model.generate_response(prompt)
-    
-    engagement_phrases = [
-        "Is there anything else you'd like to know about Think41?",
-        "How else can I assist you with information about our services?",
-        "Do you have any other questions about Think41's expertise?",
-        "What other aspects of our company would you like to explore?",
-    ]
-    
-    if ai_response:
-        response = f"{ai_response.strip()}\n\n{random.choice(engagement_phrases)}"
-    else:
-        response = "I apologize, but I'm having trouble generating a response. Is there a specific aspect of Think41 or our services you'd like to know more about?"
+def stream_response_website(user_input, relevant_content, current_page, model_name, measurements=None):
+    """
+    Streaming counterpart of `generate_response_website`. Yields 'token' and
+    'sentence' events as the completion arrives and returns the final response
+    text through a trailing 'done' event.
+    """
+    ai_model = AIModelFactory.get_model(model_name)
+    prompt, prompt_tokens = build_website_prompt(user_input, relevant_content, current_page)
 
-    return response
+    llm = SpanTiming('llm')
+    chunks = []
+    try:
+        for event in stream_events(timed_stream('llm', ai_model.stream_response(prompt), provider=provider_label(ai_model, model_name), timing=llm)):
+            if event['type'] == 'token':
+                chunks.append(event['text'])
+            yield event
+    except StreamInterrupted as e:
+        # Close the turn with what was streamed
+        logger.warning("Website completion stream interrupted after %d tokens: %s", len(chunks), e)
+
+    measure_website_response(measurements, llm, prompt_tokens)
+    yield from website_closing_events("".join(chunks))
+
+async def agenerate_response_website(user_input, relevant_content, current_page, model_name, measurements=None):
+    """
+    Async counterpart of `generate_response_website`.
+    """
+    ai_model = AIModelFactory.get_model(model_name)
+    prompt, prompt_tokens = build_website_prompt(user_input, relevant_content, current_page)
+    with span('llm', provider=provider_label(ai_model, model_name)) as llm:
+        ai_response = await ai_model.agenerate_response(prompt)
+    measure_website_response(measurements, llm, prompt_tokens)
+    report_website_prompt_usage()
+    return finalize_website_response(ai_response)
+
+async def astream_response_website(user_input, relevant_content, current_page, model_name, measurements=None):
+    """
+    Async counterpart of `stream_response_website`.
+    """
+    ai_model = AIModelFactory.get_model(model_name)
+    prompt, prompt_tokens = build_website_prompt(user_input, relevant_content, current_page)
+
+    llm = SpanTiming('llm')
+    chunks = []
+    try:
+        async for event in astream_events(atimed_stream('llm', ai_model.astream_response(prompt), provider=provider_label(ai_model, model_name), timing=llm)):
+            if event['type'] == 'token':
+                chunks.append(event['text'])
+            yield event
+    except StreamInterrupted as e:
+        logger.warning("Website completion stream interrupted after %d tokens: %s", len(chunks), e)
+
+    measure_website_response(measurements, llm, prompt_tokens)
+    for event in website_closing_events("".join(chunks)):
+        yield event
+
+def website_closing_events(ai_response):
+    ai_response = ai_response.strip()
+    response = finalize_website_response(ai_response)
+    closing = response[len(ai_response):].strip() if ai_response else response
+    events = []
+    if closing:
+        events.append({'type': 'sentence', 'text': closing})
+    events.append({'type': 'done', 'response': response})
+    return events
+
+def serialize_relevant_content(relevant_content):
+    return [
+        {
+            'title': content.title,
+            'content_type': content.content_type,
+            'snippet': content.content[:100] + '...' if len(content.content) > 100 else content.content
+        } for content in relevant_content
+    ]
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -57,33 +144,143 @@ def website_interaction(request):
         data = json.loads(request.body)
         user_input = data.get('user_input')
         current_page = data.get('current_page', 'home')
-        model_name = data.get('model_name', '4o-mini')
+        model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
         
-        assistant = GPTAssistant(current_page=current_page, model_name=model_name)
+        assistant = GPTAssistant(model_name=model_name)
         
         # Implement RAG by searching for relevant content
-        relevant_content = assistant.search_relevant_content(user_input)
+        relevant_content = assistant.retrieve_context_items(user_input)
         
         # Generate response using the relevant content
-        response = generate_response_website(user_input, relevant_content, current_page, model_name)
-
-        return JsonResponse({
-            'response': response,
-            'current_page': current_page,
-            'has_more_info': bool(relevant_content),
-            'relevant_content': [
-                {
-                    'title': content.title,
-                    'content_type': content.content_type,
-                    'snippet': content.content[:100] + '...' if len(content.content) > 100 else content.content
-                } for content in relevant_content
-            ]
-        })
+        measurements = assistant.measurements()
+        response = generate_response_website(user_input, relevant_content, current_page, model_name, measurements)
+        record_interaction(ENDPOINT_WEBSITE, user_input, model_name, measurements)
+
+        with span('render'):
+            return JsonResponse({
+                'response': response,
+                'current_page': current_page,
+                'has_more_info': bool(relevant_content),
+                'relevant_content': serialize_relevant_content(relevant_content)
+            })
     except json.JSONDecodeError:
         logger.error("Invalid JSON in request body")
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
-        logger.error(f"Error in website_interaction: {str(e)}", exc_info=True)
+        logger.error("Error in website_interaction: %s", e, exc_info=True)
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def website_interaction_stream(request):
+    """
+    Server-Sent Events variant of `website_interaction`. Retrieval happens before
+    the stream opens; the 'done' event carries the same fields as the JSON endpoint.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in request body")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    user_input = data.get('user_input')
+    current_page = data.get('current_page', 'home')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+
+    try:
+        assistant = GPTAssistant(model_name=model_name)
+        relevant_content = assistant.retrieve_context_items(user_input)
+    except Exception as e:
+        logger.error("Error in website_interaction_stream: %s", e, exc_info=True)
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+    measurements = assistant.measurements()
+
+    def events():
+        for event in stream_response_website(user_input, relevant_content, current_page, model_name, measurements):
+            if event['type'] == 'done':
+                event.update({
+                    'current_page': current_page,
+                    'has_more_info': bool(relevant_content),
+                    'relevant_content': serialize_relevant_content(relevant_content)
+                })
+            yield event
+        record_interaction(ENDPOINT_WEBSITE, user_input, model_name, measurements, streamed=True)
+
+    response = StreamingHttpResponse(sse_stream(events()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@async_post_view
+async def awebsite_interaction(request):
+    """
+    Async counterpart of `website_interaction`, served when running under ASGI.
+    """
+    try:
+        data = json.loads(request.body)
+        user_input = data.get('user_input')
+        current_page = data.get('current_page', 'home')
+        model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+
+        assistant = GPTAssistant(model_name=model_name)
+        relevant_content = await assistant.aretrieve_context_items(user_input)
+        measurements = assistant.measurements()
+        response = await agenerate_response_website(user_input, relevant_content, current_page, model_name, measurements)
+        record_interaction(ENDPOINT_WEBSITE, user_input, model_name, measurements)
+
+        with span('render'):
+            return JsonResponse({
+                'response': response,
+                'current_page': current_page,
+                'has_more_info': bool(relevant_content),
+                'relevant_content': serialize_relevant_content(relevant_content)
+            })
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in request body")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        logger.error("Error in awebsite_interaction: %s", e, exc_info=True)
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+@async_post_view
+async def awebsite_interaction_stream(request):
+    """
+    Async counterpart of `website_interaction_stream`.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in request body")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    user_input = data.get('user_input')
+    current_page = data.get('current_page', 'home')
+    model_name = data.get('model_name', settings.DEFAULT_CHAT_MODEL)
+
+    try:
+        assistant = GPTAssistant(model_name=model_name)
+        relevant_content = await assistant.aretrieve_context_items(user_input)
+    except Exception as e:
+        logger.error("Error in awebsite_interaction_stream: %s", e, exc_info=True)
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+    measurements = assistant.measurements()
+
+    async def events():
+        async for event in astream_response_website(user_input, relevant_content, current_page, model_name, measurements):
+            if event['type'] == 'done':
+                event.update({
+                    'current_page': current_page,
+                    'has_more_info': bool(relevant_content),
+                    'relevant_content': serialize_relevant_content(relevant_content)
+                })
+            yield event
+        record_interaction(ENDPOINT_WEBSITE, user_input, model_name, measurements, streamed=True)
+
+    response = StreamingHttpResponse(asse_stream(events()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 # ... (keep the get_more_info function as is)
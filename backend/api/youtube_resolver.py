@@ -0,0 +1,198 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import quote_plus
+from django.conf import settings
+from .answer_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+class YouTubeResolver(ABC):
+    """
+    Turns a search term into the URL of a YouTube video.
+    """
+    @abstractmethod
+    def resolve(self, search_term):
+        """
+        Args:
+            search_term (str): What the user asked to play.
+
+        Returns:
+            str: The video URL, or None if nothing was found.
+        """
+        pass
+
+class PywhatkitResolver(YouTubeResolver):
+    """
+    Looks the term up on YouTube with pywhatkit, which scrapes the search results
+    page and takes seconds. pywhatkit is imported on the first lookup, since
+    importing it already checks the internet connection.
+    """
+    def resolve(self, search_term):
+        import pywhatkit
+        return pywhatkit.playonyt(search_term, open_video=False)
+
+class FixtureResolver(YouTubeResolver):
+    """
+    Offline resolver for tests and local runs: answers from a {search term: URL}
+    mapping and, for other terms, with the URL of YouTube's results page unless
+    `search_fallback` is off. Never touches the network.
+    """
+    def __init__(self, fixtures=None, search_fallback=True):
+        self.fixtures = {normalize_query(term): url for term, url in (fixtures or {}).items()}
+        self.search_fallback = search_fallback
+
+    @classmethod
+    def from_file(cls, path, search_fallback=True):
+        with open(path) as f:
+            return cls(json.load(f), search_fallback)
+
+    def resolve(self, search_term):
+        url = self.fixtures.get(normalize_query(search_term))
+        if url is None and self.search_fallback:
+            url = f"https://www.youtube.com/results?search_query={quote_plus(search_term)}"
+        return url
+
+def create_youtube_resolver(backend, fixtures_path=None):
+    if backend == 'pywhatkit':
+        return PywhatkitResolver()
+    if backend == 'fixture':
+        return FixtureResolver.from_file(fixtures_path) if fixtures_path else FixtureResolver()
+    raise ValueError(f"Unsupported YouTube resolver: {backend}")
+
+class YouTubeLookup:
+    """
+    Resolves search terms off the request path, with a TTL cache of the results.
+
+    Lookups run on a small thread pool; callers wait at most `timeout` seconds and
+    get None when the resolver is slower. The lookup carries on in the background
+    and caches its URL, so repeating the command shortly after still returns it.
+    Concurrent lookups of the same term share one resolver call. URLs are cached
+    for `ttl` seconds, failures for `failure_ttl` seconds, and the least recently
+    used of more than `max_entries` terms is evicted.
+    """
+    def __init__(self, resolver, ttl=86400, failure_ttl=60, max_entries=1000, timeout=5.0, workers=4):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='youtube-lookup')
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            create_youtube_resolver(settings.YOUTUBE_RESOLVER, settings.YOUTUBE_FIXTURES),
+            ttl=settings.YOUTUBE_CACHE_TTL,
+            failure_ttl=settings.YOUTUBE_FAILURE_TTL,
+            max_entries=settings.YOUTUBE_CACHE_MAX_ENTRIES,
+            timeout=settings.YOUTUBE_RESOLVE_TIMEOUT,
+            workers=settings.YOUTUBE_RESOLVER_WORKERS,
+        )
+
+    def get(self, search_term):
+        """
+        Returns the URL for the search term, or None if none was found in time.
+        """
+        key = normalize_query(search_term)
+        found, url = self._cached(key)
+        if found:
+            return url
+        try:
+            return self._submit(key, search_term).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            return self._timed_out(search_term)
+
+    async def aget(self, search_term):
+        """
+        Async counterpart of `get`; the event loop is never blocked by the resolver.
+        """
+        key = normalize_query(search_term)
+        found, url = self._cached(key)
+        if found:
+            return url
+        future = asyncio.wrap_future(self._submit(key, search_term))
+        try:
+            # Shielded, so that the timeout leaves the lookup running to fill the cache
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            return self._timed_out(search_term)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'timeouts': self.timeouts,
+            }
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry['url']
+            self.misses += 1
+            return False, None
+
+    def _submit(self, key, search_term):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = self._executor.submit(self._resolve, key, search_term)
+            return future
+
+    def _resolve(self, key, search_term):
+        try:
+            url = self.resolver.resolve(search_term)
+        except Exception as e:
+            logger.error("Error getting YouTube URL for %r: %s", search_term, e)
+            url = None
+        with self._lock:
+            self._entries[key] = {
+                'url': url,
+                'expires_at': time.monotonic() + (self.ttl if url else self.failure_ttl),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._in_flight.pop(key, None)
+        return url
+
+    def _timed_out(self, search_term):
+        with self._lock:
+            self.timeouts += 1
+        logger.warning("YouTube lookup for %r took longer than %ss", search_term, self.timeout)
+        return None
+
+_youtube_lookup = None
+_youtube_lookup_lock = threading.Lock()
+
+def get_youtube_lookup():
+    """
+    Returns the process-wide `YouTubeLookup`, creating it on first use.
+    """
+    global _youtube_lookup
+    if _youtube_lookup is None:
+        with _youtube_lookup_lock:
+            if _youtube_lookup is None:
+                _youtube_lookup = YouTubeLookup.from_settings()
+    return _youtube_lookup
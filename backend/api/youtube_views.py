@@ -1,10 +1,10 @@
 import re
-import pywhatkit as kit
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from .async_utils import async_post_view
+from .youtube_resolver import get_youtube_lookup
 import json
-import pdb
 
 def extract_yt_term(command):
     pattern = r'play\s+(.*?)\s+on\s+youtube'
@@ -12,12 +12,31 @@ def extract_yt_term(command):
     return match.group(1) if match else None
 
 def get_youtube_url(search_term):
-    try:
-        url = kit.playonyt(search_term, open_video=False)
-        return url
-    except Exception as e:
-        print(f"Error getting YouTube URL: {str(e)}")
-        return None
+    # Cached, and bounded by YOUTUBE_RESOLVE_TIMEOUT (see api/youtube_resolver.py)
+    return get_youtube_lookup().get(search_term)
+
+async def aget_youtube_url(search_term):
+    return await get_youtube_lookup().aget(search_term)
+
+def youtube_command_response(search_term, url):
+    if url:
+        return JsonResponse({
+            "status": "success",
+            "message": f"Found YouTube video for {search_term}",
+            "search_term": search_term,
+            "youtube_url": url
+        })
+    else:
+        return JsonResponse({
+            "status": "error",
+            "message": "Failed to get YouTube URL"
+        }, status=500)
+
+def missing_search_term_response():
+    return JsonResponse({
+        "status": "error",
+        "message": "Could not extract search term from the query"
+    }, status=400)
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -28,24 +47,35 @@ def handle_youtube_command(request):
 
         search_term = extract_yt_term(query)
         if search_term:
-            url = get_youtube_url(search_term)
-            if url:
-                return JsonResponse({
-                    "status": "success",
-                    "message": f"Found YouTube video for {search_term}",
-                    "search_term": search_term,
-                    "youtube_url": url
-                })
-            else:
-                return JsonResponse({
-                    "status": "error",
-                    "message": "Failed to get YouTube URL"
-                }, status=500)
+            return youtube_command_response(search_term, get_youtube_url(search_term))
+        else:
+            return missing_search_term_response()
+
+    except json.JSONDecodeError:
+        return JsonResponse({
+            "status": "error",
+            "message": "Invalid JSON in request body"
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            "status": "error",
+            "message": str(e)
+        }, status=500)
+
+@async_post_view
+async def ahandle_youtube_command(request):
+    """
+    Async counterpart of `handle_youtube_command`, served when running under ASGI.
+    """
+    try:
+        data = json.loads(request.body)
+        query = data.get('query', '')
+
+        search_term = extract_yt_term(query)
+        if search_term:
+            return youtube_command_response(search_term, await aget_youtube_url(search_term))
         else:
-            return JsonResponse({
-                "status": "error",
-                "message": "Could not extract search term from the query"
-            }, status=400)
+            return missing_search_term_response()
 
     except json.JSONDecodeError:
         return JsonResponse({
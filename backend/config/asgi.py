@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Serve the chat, gpt-assistant and website-interaction endpoints from their
+# async views, so in-flight LLM calls don't each hold a worker thread.
+# Run with e.g. `uvicorn config.asgi:application`.
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.SEARCH_INDEX_PRELOAD:
+    from api.search_index import preload_search_indexes  # noqa: E402
+    preload_search_indexes()
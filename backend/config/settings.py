@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -42,11 +43,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api',  # Add this line
     'corsheaders',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,6 +79,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# Route the chat endpoints to their async views (set by config/asgi.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
 
 
 # Database
@@ -145,5 +152,172 @@ CORS_ALLOW_ALL_ORIGINS = True  # For development only. Be more specific in produ
 GPT_API_KEY = os.getenv('GPT_API_KEY')
 GPT_MODEL_URL = os.getenv('GPT_MODEL_URL')
 
+# Pooled LLM provider clients (see api/llm_clients.py)
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '20'))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '60'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+
+# Model used when a request does not name one; 'auto' routes across providers
+DEFAULT_CHAT_MODEL = os.getenv('DEFAULT_CHAT_MODEL', '4o-mini')
+
+# Latency-aware multi-provider routing for model_name 'auto' (see api/routing.py)
+LLM_ROUTING_PROVIDERS = os.getenv('LLM_ROUTING_PROVIDERS', '4o-mini,groq,gpt4').split(',')
+LLM_REQUEST_DEADLINE = float(os.getenv('LLM_REQUEST_DEADLINE', '20'))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '2'))
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.25'))
+LLM_ROUTING_MAX_WORKERS = int(os.getenv('LLM_ROUTING_MAX_WORKERS', '32'))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+LLM_CIRCUIT_ERROR_RATE = float(os.getenv('LLM_CIRCUIT_ERROR_RATE', '0.5'))
+LLM_CIRCUIT_COOLDOWN = float(os.getenv('LLM_CIRCUIT_COOLDOWN', '30'))
+
+# Token budgets for prompt assembly (see api/prompt_builder.py)
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv('PROMPT_CONTEXT_TOKEN_BUDGET', '600'))
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv('PROMPT_HISTORY_TOKEN_BUDGET', '300'))
+
+# Semantic answer cache for chat completions (see api/answer_cache.py)
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True') == 'True'
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '600'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.85'))
+# Write answers through to the shared Django cache too (Redis when REDIS_URL is set)
+ANSWER_CACHE_L2_ENABLED = os.getenv('ANSWER_CACHE_L2_ENABLED', 'True') == 'True'
+
+# Coalescing of identical in-flight chat requests (see api/single_flight.py)
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True') == 'True'
+SINGLE_FLIGHT_LOCK_DIR = os.getenv('SINGLE_FLIGHT_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'think41-single-flight'))
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '30'))
+
+# Retrieval backend for GPTAssistant.search_relevant_content: 'postgres' ranks in
+# the database, 'bm25' in a per-process in-memory index (see api/search_index.py),
+# 'hybrid' fuses the database ranking with embedding search (see api/embeddings.py)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'postgres')
+SEARCH_BM25_K1 = float(os.getenv('SEARCH_BM25_K1', '1.2'))
+SEARCH_BM25_B = float(os.getenv('SEARCH_BM25_B', '0.75'))
+SEARCH_BM25_TITLE_BOOST = float(os.getenv('SEARCH_BM25_TITLE_BOOST', '3'))
+# Load the in-memory indexes in the background when the WSGI/ASGI application starts
+SEARCH_INDEX_PRELOAD = os.getenv('SEARCH_INDEX_PRELOAD', 'True') == 'True'
+
+# Embeddings for SEARCH_BACKEND='hybrid'; run compute_embeddings after changing the embedder
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'hashing')  # or 'sentence-transformers'
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '256'))
+SEARCH_HYBRID_CANDIDATES = int(os.getenv('SEARCH_HYBRID_CANDIDATES', '20'))
+SEARCH_RRF_K = int(os.getenv('SEARCH_RRF_K', '60'))
+
+# Upper bound on the queries of one search/batch/ request
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', '50'))
+
+# Retrieval unit for prompts: whole 'content' rows, or 'passage' chunks of them (see api/chunking.py).
+# Passages are only rebuilt on save in 'passage' mode; run chunk_content after switching to it.
+RETRIEVAL_UNIT = os.getenv('RETRIEVAL_UNIT', 'content')
+PASSAGE_MAX_TOKENS = int(os.getenv('PASSAGE_MAX_TOKENS', '120'))
+PASSAGE_OVERLAP_TOKENS = int(os.getenv('PASSAGE_OVERLAP_TOKENS', '30'))
+PASSAGE_MAX_PER_SOURCE = int(os.getenv('PASSAGE_MAX_PER_SOURCE', '2'))
+
+# Two-level retrieval cache (see api/retrieval_cache.py). L2 is the default Django
+# cache; set REDIS_URL (requires the redis package) to share it, and its
+# invalidation, across worker processes.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+RETRIEVAL_CACHE_ENABLED = os.getenv('RETRIEVAL_CACHE_ENABLED', 'True') == 'True'
+RETRIEVAL_CACHE_L1_MAX_ENTRIES = int(os.getenv('RETRIEVAL_CACHE_L1_MAX_ENTRIES', '1024'))
+RETRIEVAL_CACHE_TTL = int(os.getenv('RETRIEVAL_CACHE_TTL', '300'))
+RETRIEVAL_CACHE_NEGATIVE_TTL = int(os.getenv('RETRIEVAL_CACHE_NEGATIVE_TTL', '60'))
+# Seconds a process trusts its copy of the shared content version, i.e. how long
+# a content change made by another process can go unnoticed
+RETRIEVAL_CACHE_VERSION_TTL = float(os.getenv('RETRIEVAL_CACHE_VERSION_TTL', '1.0'))
+
+# Cache warm-up with the top questions (see api/cache_warmup.py and the warm_caches command),
+# optionally after migrate and, debounced by CACHE_WARMUP_DELAY seconds (or at process exit,
+# whichever comes first), after content changes
+CACHE_WARMUP_QUESTIONS = os.getenv('CACHE_WARMUP_QUESTIONS', os.path.join(BASE_DIR, 'top_questions.txt'))
+CACHE_WARMUP_CONCURRENCY = int(os.getenv('CACHE_WARMUP_CONCURRENCY', '4'))
+CACHE_WARMUP_ON_MIGRATE = os.getenv('CACHE_WARMUP_ON_MIGRATE', 'False') == 'True'
+CACHE_WARMUP_ON_CONTENT_CHANGE = os.getenv('CACHE_WARMUP_ON_CONTENT_CHANGE', 'False') == 'True'
+CACHE_WARMUP_DELAY = float(os.getenv('CACHE_WARMUP_DELAY', '30'))
+
+# Per-request timing spans, Server-Timing headers and the Prometheus metrics/ endpoint (see api/metrics.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+
+# Server-side conversation history for chat requests carrying a session_id (see api/conversation_store.py)
+CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', '12'))
+CONVERSATION_MAX_TURN_CHARS = int(os.getenv('CONVERSATION_MAX_TURN_CHARS', '2000'))
+CONVERSATION_MAX_SESSIONS = int(os.getenv('CONVERSATION_MAX_SESSIONS', '10000'))
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', '1800'))
+# Turns beyond the most recent CONVERSATION_RECENT_TURNS are folded into a rolling
+# summary in batches of CONVERSATION_SUMMARY_BATCH, by background workers
+CONVERSATION_SUMMARY_ENABLED = os.getenv('CONVERSATION_SUMMARY_ENABLED', 'True') == 'True'
+CONVERSATION_RECENT_TURNS = int(os.getenv('CONVERSATION_RECENT_TURNS', '6'))
+CONVERSATION_SUMMARY_BATCH = int(os.getenv('CONVERSATION_SUMMARY_BATCH', '4'))
+CONVERSATION_SUMMARY_MODEL = os.getenv('CONVERSATION_SUMMARY_MODEL', DEFAULT_CHAT_MODEL)
+CONVERSATION_SUMMARY_WORKERS = int(os.getenv('CONVERSATION_SUMMARY_WORKERS', '2'))
+
+# In-process intent routing in front of GPTAssistant for the chat endpoints (see
+# api/intent_router.py): greetings, thanks and goodbyes get canned answers, YouTube and
+# navigation requests are dispatched directly. Turns of at most INTENT_ROUTER_MAX_WORDS
+# words the rules miss are classified locally, accepted at INTENT_ROUTER_MIN_CONFIDENCE
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'True') == 'True'
+INTENT_ROUTER_MIN_CONFIDENCE = float(os.getenv('INTENT_ROUTER_MIN_CONFIDENCE', '0.5'))
+INTENT_ROUTER_MAX_WORDS = int(os.getenv('INTENT_ROUTER_MAX_WORDS', '6'))
+
+# YouTube lookups for "play X on youtube" (see api/youtube_resolver.py): 'pywhatkit'
+# scrapes YouTube, 'fixture' answers offline from the YOUTUBE_FIXTURES JSON file of
+# {search term: URL}. Results are cached; requests wait at most YOUTUBE_RESOLVE_TIMEOUT seconds.
+YOUTUBE_RESOLVER = os.getenv('YOUTUBE_RESOLVER', 'pywhatkit')
+YOUTUBE_FIXTURES = os.getenv('YOUTUBE_FIXTURES')
+YOUTUBE_CACHE_TTL = int(os.getenv('YOUTUBE_CACHE_TTL', '86400'))
+YOUTUBE_FAILURE_TTL = int(os.getenv('YOUTUBE_FAILURE_TTL', '60'))
+YOUTUBE_CACHE_MAX_ENTRIES = int(os.getenv('YOUTUBE_CACHE_MAX_ENTRIES', '1000'))
+YOUTUBE_RESOLVE_TIMEOUT = float(os.getenv('YOUTUBE_RESOLVE_TIMEOUT', '5'))
+YOUTUBE_RESOLVER_WORKERS = int(os.getenv('YOUTUBE_RESOLVER_WORKERS', '4'))
+
+# Chat query telemetry (see api/telemetry.py and the query_report command): one
+# ChatQueryLog row per chat and website interaction, buffered in memory and written
+# by a background thread in bulk inserts of TELEMETRY_BATCH_SIZE rows
+TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', 'True') == 'True'
+TELEMETRY_BATCH_SIZE = int(os.getenv('TELEMETRY_BATCH_SIZE', '100'))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv('TELEMETRY_FLUSH_INTERVAL', '5'))
+TELEMETRY_MAX_PENDING = int(os.getenv('TELEMETRY_MAX_PENDING', '10000'))
+
+# Logging goes through a background queue (see api/log_handlers.py). INFO records of
+# the listed categories are sampled at the given rates, e.g. 'search=0.1,prompt=0.1';
+# prompts and provider payloads are only logged with LOG_VERBOSE_PAYLOADS=True.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_VERBOSE_PAYLOADS = os.getenv('LOG_VERBOSE_PAYLOADS', 'False') == 'True'
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, rate in (item.split('=') for item in os.getenv('LOG_SAMPLE_RATES', 'search=0.1,prompt=0.1').split(',') if item.strip())
+}
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {'()': 'api.log_handlers.SamplingFilter', 'rates': LOG_SAMPLE_RATES},
+    },
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'api.log_handlers.BackgroundQueueHandler',
+            'maxsize': LOG_QUEUE_SIZE,
+            'filters': ['sampling'],
+            'formatter': 'plain',
+        },
+    },
+    'root': {'handlers': ['queue'], 'level': 'WARNING'},
+    'loggers': {
+        'api': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
 # Add this line somewhere in your settings.py file
 DEFAULT_COMPANY_NAME = "Think41"
\ No newline at end of file
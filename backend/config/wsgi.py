@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.SEARCH_INDEX_PRELOAD:
+    from api.search_index import preload_search_indexes  # noqa: E402
+    preload_search_indexes()